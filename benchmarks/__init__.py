@@ -0,0 +1,28 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Benchmarks for the furious enqueue and execute hot paths.
+
+The benchmarks run against the App Engine testbed stubs, or the in-process
+local task system, and write machine-readable JSON results that can be
+compared across releases:
+
+    python -m benchmarks --output results.json
+    python -m benchmarks --compare baseline.json --output results.json
+
+Use `--task-system local` to run against furious.extras.local_taskqueue and
+`--filter context` to only run benchmarks whose name contains "context".
+"""
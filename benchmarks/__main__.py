@@ -0,0 +1,66 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Run the furious benchmarks: python -m benchmarks --help"""
+import argparse
+import sys
+
+from benchmarks import harness
+
+
+def _report(result):
+    print "%-28s %8s %10.6fs %12.1f ops/s" % (
+        result['name'], result['param'], result['best'],
+        result['operations_per_second'] or 0)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks')
+    parser.add_argument('--filter', help='Only run matching benchmarks.')
+    parser.add_argument('--task-system', default='appengine_taskqueue',
+                        help='The furious task system to run against.')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='Times to run each benchmark, the best is kept.')
+    parser.add_argument('--output', help='Write the JSON results here.')
+    parser.add_argument('--compare', help='JSON results to compare against.')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Slowdown, as a fraction, that is a regression.')
+
+    args = parser.parse_args(argv)
+
+    harness.load_benchmarks()
+
+    results = harness.run_benchmarks(args.filter, args.task_system,
+                                     args.repeat, report=_report)
+
+    if args.output:
+        harness.write_results(results, args.output)
+
+    if not args.compare:
+        return 0
+
+    regressions = harness.compare(harness.load_results(args.compare),
+                                  results, args.threshold)
+
+    for name, param, before, after in regressions:
+        print "REGRESSION %s %s: %.6fs -> %.6fs per operation" % (
+            name, param, before, after)
+
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
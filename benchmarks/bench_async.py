@@ -0,0 +1,102 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Benchmarks for creating, encoding and executing single Asyncs."""
+from benchmarks.harness import benchmark
+
+
+def noop(*args, **kwargs):
+    """The target of the benchmarked Asyncs."""
+
+
+@benchmark('async.construct', params=[1000])
+def construct(count):
+    from furious.async import Async
+
+    def run():
+        for index in xrange(count):
+            Async(noop, args=[index], kwargs={'key': 'value'})
+
+    return run, count
+
+
+@benchmark('async.to_task', params=['json', 'compact'])
+def to_task(encoding, count=1000):
+    from furious.async import Async
+    from furious.config import get_config
+
+    get_config()['payload_encoding'] = encoding
+
+    asyncs = [Async(noop, args=[index], kwargs={'key': 'value'})
+              for index in xrange(count)]
+
+    def run():
+        for async in asyncs:
+            async.to_task()
+
+    def teardown():
+        get_config()['payload_encoding'] = 'json'
+
+    return run, count, teardown
+
+
+@benchmark('async.encode_options', params=[1024, 100 * 1024, 1024 * 1024])
+def encode_options(size, count=100):
+    from furious.async import Async
+    from furious.async import encode_async_options
+
+    async = Async(noop, args=[['x' * 1024] * (size / 1024)])
+
+    def run():
+        for _ in xrange(count):
+            encode_async_options(async)
+
+    return run, count
+
+
+@benchmark('async.decode_options', params=[1024, 100 * 1024, 1024 * 1024])
+def decode_options(size, count=100):
+    from furious.async import Async
+    from furious.async import decode_async_options
+    from furious.async import encode_async_options
+
+    options = encode_async_options(
+        Async(noop, args=[['x' * 1024] * (size / 1024)]))
+
+    def run():
+        for _ in xrange(count):
+            decode_async_options(options)
+
+    return run, count
+
+
+@benchmark('async.process_task', params=[1000])
+def process_task(count):
+    from furious.async import Async
+    from furious.context._local import _clear_context
+    from furious.handlers import process_async_task
+
+    payloads = [Async(noop, args=[index]).to_task().payload
+                for index in xrange(count)]
+
+    def run():
+        for payload in payloads:
+            process_async_task({}, payload)
+
+            # Each task runs in a fresh request's execution context.
+            _clear_context()
+
+    return run, count
@@ -0,0 +1,55 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Benchmarks for inserting and draining batcher Messages."""
+from benchmarks.harness import benchmark
+
+QUEUE = 'default-pull'
+TAG = 'benchmark'
+
+
+@benchmark('message.insert', params=[100])
+def message_insert(count):
+    from furious.batcher import Message
+
+    def run():
+        for index in xrange(count):
+            Message(queue=QUEUE, task_args={
+                'tag': TAG, 'payload': {'index': index}}).insert()
+
+    return run, count
+
+
+@benchmark('message_iterator.drain', params=[100, 1000])
+def message_iterator_drain(count):
+    import json
+
+    from furious.batcher import MessageIterator
+    from furious.config import get_default_task_system
+
+    taskqueue = get_default_task_system()
+
+    queue = taskqueue.Queue(QUEUE)
+    for start in xrange(0, count, 100):
+        queue.add([taskqueue.Task(payload=json.dumps({'index': index}),
+                                  method='PULL', tag=TAG)
+                   for index in xrange(start, min(count, start + 100))])
+
+    def run():
+        for _ in MessageIterator(TAG, QUEUE, count):
+            pass
+
+    return run, count
@@ -0,0 +1,46 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Benchmarks for checking the completion of large Contexts."""
+from benchmarks.harness import benchmark
+
+
+def noop(*args, **kwargs):
+    """The target of the benchmarked context's complete callback."""
+
+
+@benchmark('completion.check', params=[100, 1000, 10000])
+def completion_check(count):
+    from google.appengine.ext import ndb
+
+    from furious.async import Async
+    from furious.context import Context
+    from furious.extras.appengine import ndb_persistence
+
+    context = Context(_task_ids=["task%d" % index for index in xrange(count)],
+                      callbacks={'complete': Async(noop)})
+    ndb_persistence.store_context(context)
+
+    ndb.put_multi([ndb_persistence.FuriousAsyncMarker(id=task_id, status=1)
+                   for task_id in context.task_ids])
+    ndb.put_multi([ndb_persistence.FuriousAsyncStatus(id=task_id, status=1)
+                   for task_id in context.task_ids])
+
+    def run():
+        ndb_persistence._completion_checker(context.task_ids[-1], context.id)
+
+    # The check is timed as one operation, however many tasks it checks.
+    return run, 1
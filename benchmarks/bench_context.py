@@ -0,0 +1,57 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Benchmarks for inserting the tasks of Contexts and AutoContexts."""
+from benchmarks.harness import benchmark
+
+
+def noop(*args, **kwargs):
+    """The target of the benchmarked Asyncs."""
+
+
+@benchmark('context.add', params=[1, 100, 10000])
+def context_add(count):
+    from furious import context
+
+    def run():
+        with context.new() as ctx:
+            for index in xrange(count):
+                ctx.add(noop, args=[index])
+
+    return run, count
+
+
+@benchmark('context.map', params=[1, 100, 10000])
+def context_map(count):
+    from furious import context
+
+    def run():
+        with context.new() as ctx:
+            ctx.map(noop, ([index] for index in xrange(count)))
+
+    return run, count
+
+
+@benchmark('auto_context.add', params=[10, 100, 500])
+def auto_context_add(batch_size, count=5000):
+    from furious import context
+
+    def run():
+        with context.new(batch_size=batch_size) as ctx:
+            for index in xrange(count):
+                ctx.add(noop, args=[index])
+
+    return run, count
@@ -0,0 +1,202 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Registers, runs and reports benchmarks.
+
+A benchmark is a function taking one parameter value, which prepares its
+fixtures and returns the operation to time, and the number of operations
+that function performs:
+
+    @benchmark('async.construct', params=[1, 100])
+    def construct(count):
+        def run():
+            for _ in xrange(count):
+                Async('foo')
+
+        return run, count
+
+Each benchmark runs inside a fresh testbed, and may return a third item, a
+teardown function.
+"""
+import importlib
+import json
+import os
+import platform
+import time
+
+from collections import namedtuple
+from contextlib import contextmanager
+
+
+Benchmark = namedtuple('Benchmark', 'name params function')
+
+# The modules defining the benchmarks, loaded by load_benchmarks.
+BENCHMARK_MODULES = (
+    'benchmarks.bench_async',
+    'benchmarks.bench_batcher',
+    'benchmarks.bench_completion',
+    'benchmarks.bench_context',
+)
+
+_registry = []
+
+
+def benchmark(name, params=(None,)):
+    """Register the decorated function as a benchmark run once per param."""
+    def decorator(function):
+        _registry.append(Benchmark(name, tuple(params), function))
+        return function
+
+    return decorator
+
+
+def load_benchmarks(modules=BENCHMARK_MODULES):
+    """Import the benchmark modules, registering their benchmarks."""
+    for module in modules:
+        importlib.import_module(module)
+
+
+def get_benchmarks(name_filter=None):
+    """Return the registered benchmarks whose name contains name_filter."""
+    return [bench for bench in _registry
+            if not name_filter or name_filter in bench.name]
+
+
+@contextmanager
+def environment(task_system='appengine_taskqueue'):
+    """Activate the testbed stubs, and the requested task system, for the
+    duration of a benchmark run.
+    """
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    from furious.config import get_config
+    from furious.context._local import _clear_context
+    from furious.extras import local_taskqueue
+
+    root_path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.init_taskqueue_stub(root_path=root_path)
+    bed.init_memcache_stub()
+    bed.init_datastore_v3_stub(
+        consistency_policy=datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1))
+
+    config = get_config()
+    original_task_system = config['task_system']
+    config['task_system'] = task_system
+
+    local_taskqueue.reset_engine()
+
+    try:
+        yield bed
+    finally:
+        config['task_system'] = original_task_system
+        _clear_context()
+        bed.deactivate()
+
+
+def run_benchmark(bench, param, task_system, repeat):
+    """Time one param of a benchmark, returning a result dict."""
+    timings = []
+    operations = 0
+
+    for _ in xrange(repeat):
+        with environment(task_system):
+            prepared = bench.function(param)
+            run, operations = prepared[:2]
+
+            start = time.time()
+            run()
+            timings.append(time.time() - start)
+
+            if len(prepared) > 2:
+                prepared[2]()
+
+    timings.sort()
+    best = timings[0]
+
+    return {
+        'name': bench.name,
+        'param': param,
+        'operations': operations,
+        'repeat': repeat,
+        'best': best,
+        'median': timings[len(timings) / 2],
+        'per_operation': best / max(1, operations),
+        'operations_per_second': operations / best if best else None,
+    }
+
+
+def run_benchmarks(name_filter=None, task_system='appengine_taskqueue',
+                   repeat=3, report=None):
+    """Run every registered benchmark matching name_filter, calling report
+    with each result as it completes.  Return the results document.
+    """
+    from furious import _pkg_meta
+
+    results = []
+    for bench in get_benchmarks(name_filter):
+        for param in bench.params:
+            result = run_benchmark(bench, param, task_system, repeat)
+            results.append(result)
+
+            if report:
+                report(result)
+
+    return {
+        'furious_version': _pkg_meta.version,
+        'python_version': platform.python_version(),
+        'platform': platform.platform(),
+        'task_system': task_system,
+        'timestamp': time.time(),
+        'results': results,
+    }
+
+
+def compare(baseline, current, threshold=0.2):
+    """Return (name, param, baseline, current) for each result at least
+    threshold slower per operation than in the baseline document.
+    """
+    previous = dict(((result['name'], result['param']),
+                     result['per_operation'])
+                    for result in baseline['results'])
+
+    regressions = []
+    for result in current['results']:
+        before = previous.get((result['name'], result['param']))
+        if not before:
+            continue
+
+        if result['per_operation'] > before * (1 + threshold):
+            regressions.append((result['name'], result['param'], before,
+                                result['per_operation']))
+
+    return regressions
+
+
+def load_results(path):
+    """Load a results document written by write_results."""
+    with open(path) as results_file:
+        return json.load(results_file)
+
+
+def write_results(results, path):
+    """Write a results document as JSON."""
+    with open(path, 'w') as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
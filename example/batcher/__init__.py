@@ -64,8 +64,7 @@ class BatcherHandler(webapp2.RequestHandler):
         return color.strip(), value.strip(), count
 
     def get(self):
-        from furious import context
-        from furious.batcher import Message
+        from furious.batcher import insert_messages
         from furious.batcher import MessageProcessor
 
         try:
@@ -86,12 +85,8 @@ class BatcherHandler(webapp2.RequestHandler):
 
         tag = "color"
 
-        # create a context to insert multiple Messages
-        with context.new() as ctx:
-            # loop through the count adding a task to the context per increment
-            for _ in xrange(count):
-                # insert the message with the payload
-                ctx.add(Message(task_args={"payload": payload, "tag": tag}))
+        # insert a message with the payload per increment, in batches
+        insert_messages((payload for _ in xrange(count)), tag)
 
         # insert a processor to fetch the messages in batches
         # this should always be inserted. the logic will keep it from inserting
@@ -135,8 +130,7 @@ def process_messages(tag, retries=0):
     from furious.batcher import MESSAGE_DEFAULT_QUEUE
     from furious.batcher import MessageIterator
     from furious.batcher import MessageProcessor
-
-    from google.appengine.api import memcache
+    from furious.batcher import reduce_messages
 
     # since we don't have a flag for checking complete we'll re-insert a
     # processor task with a retry count to catch any work that may still be
@@ -149,39 +143,13 @@ def process_messages(tag, retries=0):
     # create a message iteragor for the tag in batches of 500
     message_iterator = MessageIterator(tag, MESSAGE_DEFAULT_QUEUE, 500)
 
-    client = memcache.Client()
-
-    # get the stats object from cache
-    stats = client.gets(tag)
-
-    # json decode it if it exists otherwise get the default state.
-    stats = json.loads(stats) if stats else get_default_stats()
-
-    work_processed = False
-
-    # loop through the messages pulled from the queue.
-    for message in message_iterator:
-        work_processed = True
-
-        value = int(message.get("value", 0))
-        color = message.get("color").lower()
-
-        # update the total stats with the value pulled
-        set_stats(stats["totals"], value)
-
-        # update the specific color status via the value pulled
-        set_stats(stats["colors"][color], value)
+    # fold the messages pulled from the queue into a batch of stats, and
+    # merge those into the stats in cache, retrying on collisions. The
+    # messages are only deleted once the stats are updated.
+    stats = reduce_messages(message_iterator, add_stats, get_default_stats,
+                            merge_stats, tag)
 
-    # insert the stats back into cache
-    json_stats = json.dumps(stats)
-
-    # try and do an add first to see if it's new. We can't trush get due to
-    # a race condition.
-    if not client.add(tag, json_stats):
-        # if we couldn't add than lets do a compare and set to safely
-        # update the stats
-        if not client.cas(tag, json_stats):
-            raise Exception("Transaction Collision.")
+    work_processed = stats is not None
 
     # bump the process batch id
     bump_batch(tag)
@@ -201,6 +169,58 @@ def process_messages(tag, retries=0):
     processor.start()
 
 
+def add_stats(stats, message):
+    """Updates the stats with the value and color of the message.
+
+    :param stats: :class: `dict` of stats
+    :param message: :class: `dict` message payload
+    """
+    value = int(message.get("value", 0))
+    color = message.get("color").lower()
+
+    # update the total stats with the value pulled
+    set_stats(stats["totals"], value)
+
+    # update the specific color status via the value pulled
+    set_stats(stats["colors"][color], value)
+
+    return stats
+
+
+def merge_stats(stats, batch_stats):
+    """Merges the stats of a batch of messages into the stats.
+
+    :param stats: :class: `dict` of stats
+    :param batch_stats: :class: `dict` of stats for a batch of messages
+    """
+    merge_stat(stats["totals"], batch_stats["totals"])
+
+    for color, color_stats in batch_stats["colors"].iteritems():
+        merge_stat(stats["colors"][color], color_stats)
+
+    return stats
+
+
+def merge_stat(stats, batch_stats):
+    """Merges one set of batch stats into the stats.
+
+    :param stats: :class: `dict`
+    :param batch_stats: :class: `dict`
+    """
+    if not batch_stats["total_count"]:
+        return
+
+    stats["total_count"] += batch_stats["total_count"]
+    stats["value"] += batch_stats["value"]
+    stats["average"] = stats["value"] / stats["total_count"]
+
+    if batch_stats["max"] > stats["max"]:
+        stats["max"] = batch_stats["max"]
+
+    if batch_stats["min"] < stats["min"] or stats["min"] == 0:
+        stats["min"] = batch_stats["min"]
+
+
 def set_stats(stats, value):
     """Updates the stats with the value passed in.
 
@@ -70,10 +70,10 @@ The order of precedence is:
 import copy
 from functools import partial
 from functools import wraps
-import json
 import os
 import uuid
 
+from furious.encoding import encode_payload
 from furious.job_utils import decode_callbacks
 from furious.job_utils import encode_callbacks
 from furious.job_utils import get_function_path_and_options
@@ -292,8 +292,9 @@ class Async(object):
 
     def to_task(self):
         """Return a task object representing this async job."""
-        from google.appengine.api.taskqueue import Task
-        from google.appengine.api.taskqueue import TaskRetryOptions
+        from furious.config import get_default_task_system
+
+        taskqueue = get_default_task_system()
 
         self._increment_recursion_level()
         self.check_recursion_depth()
@@ -303,16 +304,16 @@ class Async(object):
         kwargs = {
             'url': url,
             'headers': self.get_headers().copy(),
-            'payload': json.dumps(self.to_dict())
+            'payload': encode_payload(self.to_dict())
         }
         kwargs.update(copy.deepcopy(self.get_task_args()))
 
         # Set task_retry_limit
         retry_options = copy.deepcopy(DEFAULT_RETRY_OPTIONS)
         retry_options.update(kwargs.pop('retry_options', {}))
-        kwargs['retry_options'] = TaskRetryOptions(**retry_options)
+        kwargs['retry_options'] = taskqueue.TaskRetryOptions(**retry_options)
 
-        return Task(**kwargs)
+        return taskqueue.Task(**kwargs)
 
     def start(self, transactional=False, async=False, rpc=None):
         """Insert the task into the requested queue, 'default' if non given.
@@ -326,7 +327,9 @@ class Async(object):
         the task itself. If the rpc kwarg is provided, but we're not in async
         mode, then it is ignored.
         """
-        from google.appengine.api import taskqueue
+        from furious.config import get_default_task_system
+
+        taskqueue = get_default_task_system()
 
         task = self.to_task()
         queue = taskqueue.Queue(name=self.get_queue())
@@ -576,8 +579,12 @@ def async_from_options(options):
 
 
 def encode_async_options(async):
-    """Encode Async options for JSON encoding."""
-    options = copy.deepcopy(async._options)
+    """Encode Async options for JSON encoding.
+
+    Only the top-level options, and the options that get rewritten, are
+    copied, the job's args and kwargs are shared with the Async.
+    """
+    options = async._options.copy()
 
     options['_type'] = reference_to_path(async.__class__)
 
@@ -586,7 +593,8 @@ def encode_async_options(async):
     if eta:
         import time
 
-        options['task_args']['eta'] = time.mktime(eta.timetuple())
+        options['task_args'] = dict(options['task_args'],
+                                    eta=time.mktime(eta.timetuple()))
 
     callbacks = async._options.get('callbacks')
     if callbacks:
@@ -601,14 +609,15 @@ def encode_async_options(async):
 
 def decode_async_options(options):
     """Decode Async options from JSON decoding."""
-    async_options = copy.deepcopy(options)
+    async_options = options.copy()
 
     # JSON don't like datetimes.
     eta = async_options.get('task_args', {}).get('eta')
     if eta:
         from datetime import datetime
 
-        async_options['task_args']['eta'] = datetime.fromtimestamp(eta)
+        async_options['task_args'] = dict(async_options['task_args'],
+                                          eta=datetime.fromtimestamp(eta))
 
     # If there are callbacks, reconstitute them.
     callbacks = async_options.get('callbacks', {})
@@ -16,11 +16,14 @@
 
 import json
 import logging
+import math
+import random
+import threading
 import time
 import uuid
 
-from google.appengine.api import memcache
-from google.appengine.runtime.apiproxy_errors import DeadlineExceededError
+from collections import deque
+from collections import namedtuple
 
 from furious.async import Async
 
@@ -28,6 +31,29 @@ MESSAGE_DEFAULT_QUEUE = 'default-pull'
 MESSAGE_PROCESSOR_NAME = 'processor'
 MESSAGE_BATCH_NAME = 'agg-batch'
 METHOD_TYPE = 'PULL'
+DEFAULT_INSERT_CONCURRENCY = 4
+
+# The most batches a MultiTagMessageIterator leases by tag grouping, unless
+# told otherwise.
+DEFAULT_TAG_BATCHES = 10
+
+# Attempts to merge into an aggregate, and the base backoff in seconds between
+# attempts, which doubles after each attempt.
+AGGREGATE_RETRIES = 5
+AGGREGATE_BACKOFF = 0.05
+
+# Leases are extended once less than this fraction of the lease duration is
+# left.
+LEASE_EXTENSION_MARGIN = 0.25
+
+# Seconds a batch id read from memcache is reused before it is read again.
+BATCH_ID_TTL = 1
+
+# Seconds a pull queue's task count is reused before it is fetched again.
+QUEUE_STATS_TTL = 10
+
+_queue_backlogs = {}
+_queue_backlogs_lock = threading.Lock()
 
 
 class Message(object):
@@ -57,7 +83,9 @@ class Message(object):
 
     def to_task(self):
         """Return a task object representing this message."""
-        from google.appengine.api.taskqueue import Task
+        from furious.config import get_default_task_system
+
+        taskqueue = get_default_task_system()
 
         task_args = self.get_task_args().copy()
 
@@ -72,28 +100,29 @@ class Message(object):
 
         kwargs.update(task_args)
 
-        return Task(**kwargs)
+        return taskqueue.Task(**kwargs)
 
     def insert(self):
         """Insert the pull task into the requested queue, 'default' if non
         given.
         """
-        from google.appengine.api.taskqueue import Queue
+        from furious.config import get_default_task_system
+
+        taskqueue = get_default_task_system()
 
         task = self.to_task()
 
-        Queue(name=self.get_queue()).add(task)
+        taskqueue.Queue(name=self.get_queue()).add(task)
 
     def to_dict(self):
         """Return this message as a dict suitable for json encoding."""
-        import copy
-
-        options = copy.deepcopy(self._options)
+        options = self._options.copy()
 
         # JSON don't like datetimes.
         eta = options.get('task_args', {}).get('eta')
         if eta:
-            options['task_args']['eta'] = time.mktime(eta.timetuple())
+            options['task_args'] = dict(options['task_args'],
+                                        eta=time.mktime(eta.timetuple()))
 
         return options
 
@@ -123,11 +152,100 @@ class Message(object):
         if eta:
             from datetime import datetime
 
-            message_options['task_args']['eta'] = datetime.fromtimestamp(eta)
+            message_options['task_args'] = dict(
+                message_options['task_args'], eta=datetime.fromtimestamp(eta))
 
         return Message(**message_options)
 
 
+class LeasedMessage(object):
+    """A leased pull task whose payload is only decoded when first accessed,
+    so messages that are filtered on their name or tag, or skipped, are never
+    decoded.
+    """
+
+    __slots__ = ('task', 'decoder', '_payload', '_decoded')
+
+    def __init__(self, task, decoder=json.loads):
+        self.task = task
+        self.decoder = decoder
+
+        self._payload = None
+        self._decoded = False
+
+    @property
+    def raw(self):
+        """Return the undecoded task payload."""
+        return self.task.payload
+
+    @property
+    def payload(self):
+        """Return the decoded task payload, decoding it on first access."""
+        if not self._decoded:
+            self._payload = self.decoder(self.task.payload)
+            self._decoded = True
+
+        return self._payload
+
+    @property
+    def name(self):
+        """Return the task name."""
+        return self.task.name
+
+    @property
+    def tag(self):
+        """Return the task tag."""
+        return self.task.tag
+
+    @property
+    def eta(self):
+        """Return the task eta, which is when the lease expires."""
+        return self.task.eta
+
+
+InsertResult = namedtuple('InsertResult', 'inserted failed')
+
+
+def insert_messages(payloads, tag, queue=MESSAGE_DEFAULT_QUEUE,
+                    task_args=None, batch_size=None,
+                    concurrency=DEFAULT_INSERT_CONCURRENCY):
+    """Insert a pull task with the tag for each payload, without building a
+    Message for each.  Payloads are JSON encoded once, streamed into batches of
+    up to 100 tasks and inserted with up to concurrency add_async RPCs in
+    flight.
+
+    :param payloads: :class: `iterable` of json serializable payloads
+    :param tag: :class: `str` Pull queue tag for the tasks
+    :param queue: :class: `str` Name of the PULL queue to insert into
+    :param task_args: :class: `dict` Additional kwargs for each task
+    :param batch_size: :class: `int` The number of tasks to insert at once
+    :param concurrency: :class: `int` The most inserts to have in flight
+
+    :return: :class: `InsertResult` of the inserted and failed counts
+    """
+    from furious.config import get_default_task_system
+    from furious.context.context import _insert_tasks_pipelined
+    from furious.context.context import _task_batcher
+
+    taskqueue = get_default_task_system()
+
+    task_args = dict(task_args or {}, tag=tag)
+
+    tasks = (taskqueue.Task(method=METHOD_TYPE, payload=json.dumps(payload),
+                            **task_args)
+             for payload in payloads)
+
+    batches = ((queue, batch)
+               for batch in _task_batcher(tasks, batch_size=batch_size))
+
+    inserted = failed = 0
+    for batch, count in _insert_tasks_pipelined(batches, max(1, concurrency)):
+        inserted += count
+        failed += len(batch) - count
+
+    return InsertResult(inserted, failed)
+
+
 class MessageProcessor(Async):
     """Async message processor for processing messages in the pull queue."""
 
@@ -167,13 +285,7 @@ class MessageProcessor(Async):
 
         :return: :class: `int` current batch id
         """
-        current_batch = memcache.get(self.group_key)
-
-        if not current_batch:
-            memcache.add(self.group_key, 1)
-            current_batch = 1
-
-        return current_batch
+        return get_batch_id_provider().get(self.group_key)
 
     @property
     def time_throttle(self):
@@ -186,6 +298,141 @@ class MessageProcessor(Async):
         return int(time.time() / max(1, self.frequency))
 
 
+class AdaptiveMessageProcessor(MessageProcessor):
+    """Message processor that adapts how soon it runs, and how many messages
+    its target should lease, to the backlog of messages.
+
+    The backlog is the observed lease count passed in, such as the number of
+    messages the last run leased for the tag.  With use_queue_stats, and no
+    backlog given, the pull queue's task count is used instead; note it
+    counts the tasks of every tag in the queue.  When the backlog is larger
+    than the lease size the countdown shrinks and the lease size grows, in
+    proportion, within their bounds.  When there is no backlog the processor
+    backs off to the max frequency.
+
+    Only the countdown adapts, the task is named for the batch and a time
+    window of the max frequency, so processors inserted for the same batch in
+    the same window are deduped whatever their backlogs.
+
+    If lease_size_kwarg is given, the adapted lease size is passed to the
+    target as the kwarg of that name.
+    """
+
+    def __init__(self, target, args=None, kwargs=None, tag=None, freq=30,
+                 min_freq=1, max_freq=None, lease_size=500,
+                 max_lease_size=1000, backlog=None, lease_size_kwarg=None,
+                 use_queue_stats=False, pull_queue=MESSAGE_DEFAULT_QUEUE,
+                 **options):
+        super(AdaptiveMessageProcessor, self).__init__(
+            target, args, kwargs, tag=tag, freq=freq, **options)
+
+        self.base_frequency = freq
+        self.min_frequency = max(1, min_freq)
+        self.max_frequency = max_freq or freq * 4
+        self.base_lease_size = lease_size
+        self.max_lease_size = max_lease_size
+        self.backlog = backlog
+        self.lease_size_kwarg = lease_size_kwarg
+        self.use_queue_stats = use_queue_stats
+        self.pull_queue = pull_queue
+
+        self.lease_size = lease_size
+
+    def to_task(self):
+        """Adapt the frequency and lease size to the backlog, then return a
+        task object representing this MessageProcessor job.
+        """
+        self.adapt(self.get_backlog())
+
+        return super(AdaptiveMessageProcessor, self).to_task()
+
+    def get_backlog(self):
+        """Return the observed backlog, or if none was given and
+        use_queue_stats is set, the pull queue's task count.  Otherwise
+        return None.
+        """
+        if self.backlog is not None:
+            return self.backlog
+
+        if self.use_queue_stats:
+            return get_queue_backlog(self.pull_queue)
+
+        return None
+
+    def adapt(self, backlog):
+        """Set the frequency and lease size for the backlog.  The load, the
+        backlog over the lease size, is rounded down to a power of two, so
+        the countdown and lease size change in steps.  An unknown backlog
+        uses the defaults.
+        """
+        frequency = self.base_frequency
+        lease_size = self.base_lease_size
+
+        if backlog == 0:
+            frequency = self.max_frequency
+        elif backlog is not None and backlog > self.base_lease_size:
+            load = backlog / float(self.base_lease_size)
+            scale = 2 ** int(math.log(load, 2))
+            frequency = self.base_frequency / scale
+            lease_size = self.base_lease_size * scale
+
+        self.frequency = max(self.min_frequency,
+                             min(self.max_frequency, frequency))
+        self.lease_size = min(self.max_lease_size, lease_size)
+
+        if self.lease_size_kwarg:
+            target, args, kwargs = self.job
+            kwargs = dict(kwargs or {})
+            kwargs[self.lease_size_kwarg] = self.lease_size
+            self._options['job'] = (target, args, kwargs)
+
+    @property
+    def time_throttle(self):
+        """Return an :class: `int` of the current time divided by the max
+        frequency, which unlike the adapted frequency is the same for every
+        processor of the tag.
+
+        :return: :class: `int`
+        """
+        return int(time.time() / max(1, self.max_frequency))
+
+
+def get_queue_backlog(queue_name, ttl=QUEUE_STATS_TTL):
+    """Return the pull queue's task count, across all of its tags, or None if
+    it can't be fetched.  The count is reused for ttl seconds, so inserting
+    processors doesn't cost a stats RPC each time.
+    """
+    now = time.time()
+
+    with _queue_backlogs_lock:
+        backlog, expires = _queue_backlogs.get(queue_name, (None, 0))
+
+    if now < expires:
+        return backlog
+
+    from furious.config import get_default_task_system
+
+    taskqueue = get_default_task_system()
+
+    try:
+        backlog = taskqueue.Queue(queue_name).fetch_statistics().tasks
+    except Exception:
+        logging.warning("Unable to fetch stats for %s", queue_name,
+                        exc_info=True)
+        return None
+
+    with _queue_backlogs_lock:
+        _queue_backlogs[queue_name] = (backlog, now + ttl)
+
+    return backlog
+
+
+def reset_queue_backlogs():
+    """Forget all cached pull queue task counts."""
+    with _queue_backlogs_lock:
+        _queue_backlogs.clear()
+
+
 class MessageIterator(object):
     """This iterator will return a batch of messages for a given group.
 
@@ -194,7 +441,9 @@ class MessageIterator(object):
     """
 
     def __init__(self, tag, queue_name, size, duration=60, deadline=10,
-                 auto_delete=True):
+                 auto_delete=True, batches=1, prefetch=0,
+                 delete_batch_size=None, async_delete=False,
+                 extend_leases=False, lazy=False, decoder=json.loads):
         """The generator will yield json deserialized payloads from tasks with
         the corresponding tag.
 
@@ -207,24 +456,67 @@ class MessageIterator(object):
         :param deadline: :class: `int` The time in seconds to wait for the rpc.
         :param auto_delete: :class: `bool` Delete tasks when iteration is
                             complete.
+        :param batches: :class: `int` The most batches of size items to lease.
+                        Leasing stops early once a batch is not full.
+        :param prefetch: :class: `int` The number of batch leases to keep in
+                         flight, using async leases, while the current batch
+                         is iterated over.
+        :param delete_batch_size: :class: `int` When auto deleting, delete the
+                                  processed messages every this many messages
+                                  rather than only once iteration is complete.
+                                  Only use this when each message's processing
+                                  is durable, not inside a transaction.
+        :param async_delete: :class: `bool` Delete using async deletes, which
+                             are waited on when iteration is complete.
+        :param extend_leases: :class: `bool` Between messages, extend the
+                              leases of the undeleted messages when they are
+                              close to expiring, so slow processing does not
+                              let them be leased again.
+        :param lazy: :class: `bool` Yield LeasedMessages, which decode their
+                     payload on first access, rather than payloads.
+        :param decoder: :class: `callable` Decodes a raw payload, json.loads
+                        by default.
 
         :return: :class: `iterator` of json deserialized payloads
         """
-        from google.appengine.api.taskqueue import Queue
+        from furious.config import get_default_task_system
+
+        taskqueue = get_default_task_system()
 
         self.queue_name = queue_name
-        self.queue = Queue(name=self.queue_name)
+        self.queue = taskqueue.Queue(name=self.queue_name)
 
         self.tag = tag
         self.size = size
         self.duration = duration
         self.auto_delete = auto_delete
         self.deadline = deadline
-
+        self.batches = max(1, batches)
+        self.prefetch = prefetch
+        self.delete_batch_size = delete_batch_size
+        self.async_delete = async_delete
+        self.extend_leases = extend_leases
+        self.lazy = lazy
+        self.decoder = decoder
+
+        # Every leased message, in lease order.  The messages before the
+        # position have been iterated over.
         self._messages = []
-        self._processed_messages = []
+        self._position = 0
         self._fetched = False
 
+        # The messages before this index have been deleted.
+        self._deleted = 0
+        self._deletes = []
+
+        self._batches_leased = 0
+        self._leases = deque()
+        self._exhausted = False
+
+        # [start index, end index, lease expiry] of each leased batch, when
+        # extending leases.
+        self._lease_expiries = []
+
     def fetch_messages(self):
         """Fetch messages from the specified pull-queue.
 
@@ -235,42 +527,158 @@ class MessageIterator(object):
         if self._fetched:
             return
 
-        start = time.time()
+        loaded_messages = self._lease_next_batch()
+
+        self._fetched = True
+
+        logging.debug("Calling fetch messages with %s:%s:%s:%s:%s:%s" % (
+            len(self._messages), len(loaded_messages),
+            self._position, self.duration, self.size, self.tag))
+
+    def _lease_next_batch(self):
+        """Lease the next batch of messages, waiting on the oldest in flight
+        lease when prefetching.  Return the leased messages, or None when no
+        more batches will be leased.
+        """
+        if self.prefetch:
+            self._start_leases()
 
-        loaded_messages = self.queue.lease_tasks_by_tag(
-            self.duration, self.size, tag=self.tag, deadline=self.deadline)
+            if not self._leases:
+                return None
+
+            leased_at, tag, rpc = self._leases.popleft()
+
+            try:
+                loaded_messages = rpc.get_result()
+            except _deadline_errors():
+                return self._lease_contended()
+        else:
+            if self._exhausted or self._batches_leased >= self.batches:
+                return None
+
+            start = leased_at = time.time()
+
+            self._batches_leased += 1
+            tag = self._next_lease_tag()
+            loaded_messages = self.queue.lease_tasks_by_tag(
+                self.duration, self.size, tag=tag, deadline=self.deadline)
+
+            # If we are within 0.1 sec of our deadline and no messages were
+            # returned, then we are hitting queue contention issues and this
+            # should be a DeadlineExceederError.
+            if (not loaded_messages and
+                    round(time.time() - start, 1) >= self.deadline - 0.1):
+                return self._lease_contended()
+
+        self._leased(tag, loaded_messages)
+        self._add_messages(loaded_messages, leased_at)
+
+        if self.prefetch:
+            self._start_leases()
+
+        return loaded_messages
+
+    def _lease_contended(self):
+        """Handle a lease that hit its deadline under queue contention.
+
+        The first batch raises a DeadlineExceededError.  Later batches stop
+        leasing, so iteration ends with the messages already leased, and
+        return None.
+        """
+        if not self._fetched:
+            from google.appengine.runtime.apiproxy_errors import (
+                DeadlineExceededError)
 
-        # If we are within 0.1 sec of our deadline and no messages were
-        # returned, then we are hitting queue contention issues and this
-        # should be a DeadlineExceederError.
-        # TODO: investigate other ways around this, perhaps async leases, etc.
-        if (not loaded_messages and
-                round(time.time() - start, 1) >= self.deadline - 0.1):
             raise DeadlineExceededError()
 
-        self._messages.extend(loaded_messages)
+        logging.warning("Lease of %s hit its deadline, not leasing more "
+                        "batches.", self.queue_name)
+
+        # The in flight leases are left to expire.
+        self._exhausted = True
+        self._leases.clear()
+
+        return None
+
+    def _start_leases(self):
+        """Start async leases until prefetch leases are in flight."""
+        while (not self._exhausted and len(self._leases) < self.prefetch and
+               self._batches_leased < self.batches):
+            self._batches_leased += 1
+            leased_at = time.time()
+            tag = self._next_lease_tag()
+            rpc = self.queue.lease_tasks_by_tag_async(
+                self.duration, self.size, tag=tag, deadline=self.deadline)
+            self._leases.append((leased_at, tag, rpc))
+
+    def _next_lease_tag(self):
+        """Return the tag to lease the next batch for."""
+        return self.tag
+
+    def _leased(self, tag, messages):
+        """Stop leasing once a batch is not full."""
+        if len(messages) < self.size:
+            self._exhausted = True
+
+    def _finish_leases(self):
+        """Wait on the in flight leases, keeping the messages they leased, and
+        stop leasing new batches.
+        """
+        self._exhausted = True
 
-        self._fetched = True
+        while self._leases:
+            leased_at, _, rpc = self._leases.popleft()
+            self._add_messages(rpc.get_result(), leased_at)
 
-        logging.debug("Calling fetch messages with %s:%s:%s:%s:%s:%s" % (
-            len(self._messages), len(loaded_messages),
-            len(self._processed_messages), self.duration, self.size, self.tag))
+    def _add_messages(self, messages, leased_at):
+        """Add leased messages, tracking when their lease expires if leases
+        are extended.
+        """
+        start = len(self._messages)
+        self._messages.extend(messages)
+
+        if self.extend_leases and messages:
+            self._lease_expiries.append(
+                [start, len(self._messages), leased_at + self.duration])
+
+    def _extend_leases(self):
+        """Extend the leases of undeleted messages whose lease expires within
+        the lease extension margin.
+        """
+        now = time.time()
+        margin = self.duration * LEASE_EXTENSION_MARGIN
+
+        # Deleted messages no longer need their leases.
+        self._lease_expiries = [lease for lease in self._lease_expiries
+                                if lease[1] > self._deleted]
+
+        for lease in self._lease_expiries:
+            start, end, expires = lease
+            if expires - now > margin:
+                continue
+
+            for message in self._messages[max(start, self._deleted):end]:
+                try:
+                    self.queue.modify_task_lease(message, self.duration)
+                except Exception:
+                    logging.warning("Unable to extend the lease of %s",
+                                    message.name, exc_info=True)
+
+            lease[2] = now + self.duration
 
     def __iter__(self):
         """Initialize this MessageIterator for iteration.
 
         If messages have not been fetched, fetch them.  If messages have been
-        fetched, reset self._messages and self._processed_messages for
-        re-iteration.  The reset is done to prevent deleting messages that were
-        never applied.
+        iterated over, rewind to the first message for re-iteration.  The
+        rewind is done to prevent deleting messages that were never applied.
         """
-        if self._processed_messages:
+        if self._position:
             # If the iterator is used within a transaction, and there is a
-            # retry we need to re-process the original messages, not new
-            # messages.
-            self._messages = list(
-                set(self._messages) | set(self._processed_messages))
-            self._processed_messages = []
+            # retry we need to re-process the original messages, in their
+            # original order, not new messages.
+            self._finish_leases()
+            self._position = 0
 
         if not self._messages:
             self.fetch_messages()
@@ -280,17 +688,51 @@ class MessageIterator(object):
     def next(self):
         """Get the next batch of messages from the previously fetched messages.
 
-        If there's no more messages, check if we should auto-delete the
-        messages and raise StopIteration.
+        Once they are consumed, the next batch is leased if more batches were
+        requested.  If there's no more messages, check if we should auto-delete
+        the messages and raise StopIteration.
         """
-        if not self._messages:
+        self._delete_processed()
+
+        return self._next_message()
+
+    def _delete_processed(self):
+        """When deleting in batches, delete the messages iterated over once
+        there are enough of them.  This is only called before advancing, so
+        the messages handed out have finished processing.
+        """
+        if (self.auto_delete and self.delete_batch_size and
+                self._position - self._deleted >= self.delete_batch_size):
+            self._delete(self._position)
+
+    def _next_message(self):
+        """Advance to and return the next message, leasing the next batch
+        once the leased messages are consumed.
+        """
+        if self.extend_leases:
+            self._extend_leases()
+
+        while self._position >= len(self._messages):
+            if self._fetched and self._lease_next_batch() is not None:
+                continue
+
             if self.auto_delete:
                 self.delete_messages()
             raise StopIteration
 
-        message = self._messages.pop(0)
-        self._processed_messages.append(message)
-        return json.loads(message.payload)
+        message = self._messages[self._position]
+        self._position += 1
+
+        return self._load(message)
+
+    def _load(self, message):
+        """Return the decoded payload of a message, or a LeasedMessage if
+        lazy.
+        """
+        if self.lazy:
+            return LeasedMessage(message, self.decoder)
+
+        return self.decoder(message.payload)
 
     def delete_messages(self, only_processed=True):
         """Delete the messages previously leased.
@@ -298,18 +740,238 @@ class MessageIterator(object):
         Unless otherwise directed, only the messages iterated over will be
         deleted.
         """
-        messages = self._processed_messages
-        if not only_processed:
-            messages += self._messages
+        end = self._position if only_processed else len(self._messages)
 
-        if messages:
-            try:
+        self._delete(end)
+        self._finish_deletes()
+
+    def _delete(self, end):
+        """Delete the messages not yet deleted up to the end index."""
+        messages = self._messages[self._deleted:end]
+        if not messages:
+            return
+
+        self._deleted = end
+
+        try:
+            if self.async_delete:
+                self._deletes.append(self.queue.delete_tasks_async(messages))
+            else:
                 self.queue.delete_tasks(messages)
+        except Exception:
+            logging.exception("Error deleting messages")
+            raise
+
+    def _finish_deletes(self):
+        """Wait on the async deletes in flight."""
+        while self._deletes:
+            try:
+                self._deletes.pop(0).get_result()
             except Exception:
                 logging.exception("Error deleting messages")
                 raise
 
 
+def _deadline_errors():
+    """Return a tuple of the errors raised by a lease that hits its deadline,
+    empty without the App Engine SDK.
+    """
+    try:
+        from google.appengine.runtime.apiproxy_errors import (
+            DeadlineExceededError)
+    except ImportError:
+        return ()
+
+    return (DeadlineExceededError,)
+
+
+class MultiTagMessageIterator(MessageIterator):
+    """Leases messages for many tags from a single iterator, yielding
+    (tag, payload) pairs, or (tag, [payloads]) sub-batches of consecutive
+    messages with the same tag.
+
+    Given a list of tags, each batch leases the next tag in turn, dropping a
+    tag once its batch is not full.  Without tags, each batch is leased by
+    tag grouping, taking the tag of the oldest message in the queue, until a
+    lease comes back empty.
+    """
+
+    def __init__(self, tags, queue_name, size, batches=None,
+                 sub_batches=False, **kwargs):
+        """
+        :param tags: :class: `list` of pull queue tags to lease, or None to
+                     lease the tag of the oldest message for each batch.
+        :param batches: :class: `int` The most batches of size items to lease.
+                        Defaults to one per tag, or DEFAULT_TAG_BATCHES
+                        without tags.
+        :param sub_batches: :class: `bool` Yield (tag, [payloads]) for each
+                            run of consecutive messages with the same tag
+                            rather than (tag, payload) pairs.
+
+        The remaining arguments are the same as MessageIterator's.
+        """
+        if batches is None:
+            batches = len(tags) if tags else DEFAULT_TAG_BATCHES
+
+        super(MultiTagMessageIterator, self).__init__(
+            None, queue_name, size, batches=batches, **kwargs)
+
+        self.tags = list(tags) if tags else None
+        self.sub_batches = sub_batches
+
+        # The tags that may have more messages to lease, in lease order.
+        self._tags = deque(self.tags or ())
+
+    def _next_lease_tag(self):
+        """Return the next tag in turn, or None to lease by tag grouping."""
+        if not self.tags:
+            return None
+
+        tag = self._tags.popleft()
+        self._tags.append(tag)
+
+        return tag
+
+    def _leased(self, tag, messages):
+        """Drop a tag once its batch is not full, stopping once every tag is
+        drained, or without tags, once nothing is leased.
+        """
+        if not self.tags:
+            if not messages:
+                self._exhausted = True
+            return
+
+        if len(messages) < self.size and tag in self._tags:
+            self._tags.remove(tag)
+
+        if not self._tags:
+            self._exhausted = True
+
+    def _load(self, message):
+        return message.tag, super(MultiTagMessageIterator, self)._load(message)
+
+    def next(self):
+        self._delete_processed()
+
+        tag, payload = self._next_message()
+
+        if not self.sub_batches:
+            return tag, payload
+
+        # The sub-batch is not processed until it is returned, so build it
+        # without deleting any of it.
+        payloads = [payload]
+        while (self._position < len(self._messages) and
+               self._messages[self._position].tag == tag):
+            payloads.append(self._next_message()[1])
+
+        return tag, payloads
+
+
+def reduce_messages(messages, reducer, initial, merge, key, store=None):
+    """Fold the messages into an accumulator, merge the accumulator into the
+    aggregate stored under key, then delete the messages.
+
+    The messages are only deleted once the merge succeeds, so if it fails
+    their leases expire and they are processed again.
+
+    :param messages: :class: `MessageIterator` of messages to reduce.  It is
+                     iterated without auto deleting.
+    :param reducer: :class: `callable` taking the accumulator and a payload,
+                    and returning the accumulator.
+    :param initial: :class: `callable` returning an empty accumulator.
+    :param merge: :class: `callable` taking the stored aggregate and the
+                  accumulator, and returning the new aggregate.  It may
+                  update the aggregate in place, but not the accumulator,
+                  which is merged again if the merge is retried.
+    :param key: :class: `str` Key the aggregate is stored under.
+    :param store: The aggregate store, a MemcacheAggregateStore by default.
+
+    :return: The merged aggregate, or None if there were no messages.
+    """
+    messages.auto_delete = False
+
+    accumulator = initial()
+    count = 0
+
+    for payload in messages:
+        accumulator = reducer(accumulator, payload)
+        count += 1
+
+    if not count:
+        return None
+
+    store = store or MemcacheAggregateStore()
+    aggregate = store.merge(key, accumulator, merge, initial)
+
+    messages.delete_messages()
+
+    return aggregate
+
+
+def backoff(attempt, base=AGGREGATE_BACKOFF):
+    """Sleep before retry attempt, doubling the base delay after each attempt
+    with jitter so contending writers spread out.
+    """
+    time.sleep(base * (2 ** attempt) * random.uniform(0.5, 1.5))
+
+
+class MemcacheAggregateStore(object):
+    """Stores aggregates in memcache, merging with compare and set."""
+
+    def __init__(self, retries=AGGREGATE_RETRIES, encoder=json.dumps,
+                 decoder=json.loads, expires=0):
+        self.retries = retries
+        self.encoder = encoder
+        self.decoder = decoder
+        self.expires = expires
+
+    def get(self, key):
+        """Return the aggregate stored under key, or None."""
+        from google.appengine.api import memcache
+
+        value = memcache.get(key)
+
+        return self.decoder(value) if value is not None else None
+
+    def merge(self, key, accumulator, merge, initial):
+        """Merge the accumulator into the aggregate stored under key, retrying
+        with backoff on contention.  Return the new aggregate.
+        """
+        from google.appengine.api import memcache
+
+        from furious.errors import AggregateCollisionError
+
+        client = memcache.Client()
+
+        for attempt in xrange(self.retries):
+            if attempt:
+                backoff(attempt - 1)
+
+            value = client.gets(key)
+
+            if value is None:
+                aggregate = merge(initial(), accumulator)
+
+                # Add fails if another request stored the aggregate first.
+                if client.add(key, self.encoder(aggregate), self.expires):
+                    return aggregate
+
+                continue
+
+            aggregate = merge(self.decoder(value), accumulator)
+
+            if client.cas(key, self.encoder(aggregate), self.expires):
+                return aggregate
+
+            logging.debug("Aggregate %s collision on attempt %d.",
+                          key, attempt + 1)
+
+        raise AggregateCollisionError(
+            "Unable to merge into aggregate %s after %d attempts." % (
+                key, self.retries))
+
+
 def bump_batch(work_group):
     """Return the incremented batch id for the work group
     :param work_group: :class: `str`
@@ -317,4 +979,144 @@ def bump_batch(work_group):
     :return: :class: `int` current batch id.
     """
     key = "%s-%s" % (MESSAGE_BATCH_NAME, work_group)
-    return memcache.incr(key)
+    return get_batch_id_provider().bump(key)
+
+
+class LocalBatchClient(object):
+    """In memory stand in for the memcache get, add and incr calls used by
+    the BatchIdProvider.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def add(self, key, value):
+        with self._lock:
+            if key in self.values:
+                return False
+
+            self.values[key] = value
+            return True
+
+    def incr(self, key, delta=1, initial_value=None):
+        with self._lock:
+            value = self.values.get(key, initial_value)
+            if value is None:
+                return None
+
+            value = self.values[key] = value + delta
+            return value
+
+
+class BatchIdProvider(object):
+    """Reads and bumps batch ids, reusing a read batch id for ttl seconds so
+    inserting a processor doesn't cost a memcache round trip each time.
+
+    The last known batch id for a key is kept past its ttl, and used to
+    restore the batch id if it was evicted, or in place of it if memcache is
+    unavailable, rather than starting the batch over at 1.
+    """
+
+    def __init__(self, client=None, ttl=BATCH_ID_TTL):
+        self.client = client
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._batch_ids = {}
+
+    def get(self, key):
+        """Return the current batch id for key."""
+        now = time.time()
+
+        with self._lock:
+            batch_id, expires = self._batch_ids.get(key, (None, 0))
+
+        if batch_id and now < expires:
+            return batch_id
+
+        client = self._get_client()
+        current = client.get(key)
+
+        if not current:
+            restored = batch_id or 1
+
+            if client.add(key, restored):
+                current = restored
+            else:
+                # Either another request added it first, or memcache is
+                # unavailable.
+                current = client.get(key)
+
+        if not current:
+            logging.warning("Batch id for %s unavailable, using %s.",
+                            key, batch_id or 1)
+            return batch_id or 1
+
+        self._set(key, current, now)
+
+        return current
+
+    def bump(self, key):
+        """Increment and return the batch id for key."""
+        client = self._get_client()
+        batch_id = client.incr(key)
+
+        if batch_id is None:
+            with self._lock:
+                last_known, _ = self._batch_ids.get(key, (None, 0))
+
+            if last_known:
+                # The batch id was evicted, continue on from the last one
+                # seen instead of starting over.
+                batch_id = client.incr(key, initial_value=last_known)
+
+        if batch_id is None:
+            logging.warning("Unable to bump the batch id for %s.", key)
+            return None
+
+        self._set(key, batch_id, time.time())
+
+        return batch_id
+
+    def clear(self):
+        """Forget all cached batch ids."""
+        with self._lock:
+            self._batch_ids = {}
+
+    def _get_client(self):
+        if self.client:
+            return self.client
+
+        from google.appengine.api import memcache
+
+        return memcache
+
+    def _set(self, key, batch_id, now):
+        with self._lock:
+            self._batch_ids[key] = (batch_id, now + self.ttl)
+
+
+_batch_id_provider = None
+
+
+def get_batch_id_provider():
+    """Return the batch id provider, creating it on first use."""
+    global _batch_id_provider
+
+    if _batch_id_provider is None:
+        _batch_id_provider = BatchIdProvider()
+
+    return _batch_id_provider
+
+
+def reset_batch_ids(provider=None):
+    """Replace the batch id provider, or recreate the default one on next use
+    if none is given.
+    """
+    global _batch_id_provider
+
+    _batch_id_provider = provider
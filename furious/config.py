@@ -24,6 +24,21 @@ PERSISTENCE_MODULES = {
     'ndb': 'furious.extras.appengine.ndb_persistence'
 }
 
+TASK_SYSTEM_MODULES = {
+    'appengine_taskqueue': 'google.appengine.api.taskqueue',
+    'local': 'furious.extras.local_taskqueue'
+}
+
+METRICS_RECORDERS = {
+    'null': 'furious.metrics.NullRecorder',
+    'memory': 'furious.metrics.MemoryRecorder'
+}
+
+RESULT_BLOB_STORES = {
+    'local': 'furious.extras.blob_store.LocalBlobStore',
+    'cloudstorage': 'furious.extras.blob_store.CloudStorageBlobStore'
+}
+
 
 class BadModulePathError(Exception):
     """Invalid module path."""
@@ -50,6 +65,31 @@ def get_default_persistence_engine(known_modules=PERSISTENCE_MODULES):
     return _get_configured_module('persistence', known_modules=known_modules)
 
 
+def get_default_task_system(known_modules=TASK_SYSTEM_MODULES):
+    """Return the task system module set in furious.yaml.
+
+    A task system exposes the same interface as App Engine's taskqueue
+    module: `Queue`, `Task`, `TaskRetryOptions` and the taskqueue errors.
+    """
+    return _get_configured_module('task_system', known_modules=known_modules)
+
+
+def get_metrics_recorder(known_modules=METRICS_RECORDERS):
+    """Return the metrics recorder class set in furious.yaml."""
+    return _get_configured_module('metrics', known_modules=known_modules)
+
+
+def get_result_blob_store(known_modules=RESULT_BLOB_STORES):
+    """Return the blob store class set in furious.yaml for large Async
+    results, or None if large results are stored inline.
+    """
+    if not get_config().get('result_blob_store'):
+        return None
+
+    return _get_configured_module('result_blob_store',
+                                  known_modules=known_modules)
+
+
 def get_completion_cleanup_queue():
     """Get the default queue that completion should use to cleanup markers on.
     """
@@ -71,6 +111,28 @@ def get_completion_cleanup_delay():
     return config.get('cleanupdelay')
 
 
+def get_completion_shard_count():
+    """Get the number of counter shards completion should use to track a
+    context's completed tasks.  Zero disables completion counters.
+    """
+    config = get_config()
+    return config.get('completionshards')
+
+
+def get_completion_check_window():
+    """Get the number of seconds completion checks for a context should be
+    coalesced over.  Zero inserts a completion check for every task.
+    """
+    config = get_config()
+    return config.get('completioncheckwindow')
+
+
+def get_payload_encoding():
+    """Get the encoding new Async task payloads should use."""
+    config = get_config()
+    return config.get('payload_encoding')
+
+
 def _get_configured_module(option_name, known_modules=None):
     """Get the module specified by the value of option_name. The value of the
     configuration option will be used to load the module by name from the known
@@ -155,6 +217,11 @@ def default_config():
             'cleanupqueue': 'default',
             'cleanupdelay': 7600,
             'defaultqueue': 'default',
+            'completionshards': 0,
+            'completioncheckwindow': 0,
+            'payload_encoding': 'json',
+            'metrics': 'null',
+            'result_blob_store': None,
             'task_system': 'appengine_taskqueue'}
 
 
@@ -83,6 +83,22 @@ def _clear_context():
     _local_context = threading.local()
 
 
+def _swap_context(context=None):
+    """Replace the calling thread's context with one returned by an earlier
+    call, or with a new empty context, and return the context replaced.
+
+    Unlike _clear_context, other threads' contexts are left untouched, which
+    makes this safe to use around tasks run inline or by a pool of worker
+    threads.
+    """
+    replaced = _local_context.__dict__.copy()
+
+    _local_context.__dict__.clear()
+    _local_context.__dict__.update(context or {})
+
+    return replaced
+
+
 # NOTE: Do not import this directly.  If you MUST use this, access it
 # through get_local_context.
 _local_context = threading.local()
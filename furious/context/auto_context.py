@@ -53,6 +53,20 @@ class AutoContext(Context):
 
         return target
 
+    def map(self, target, iterable_of_args, kwargs=None, **options):
+        """Add an Async job to this context for each item in iterable_of_args.
+
+        Like Context.map(), but also calls _auto_insert_check() to add tasks
+        to queues automatically.
+        """
+
+        task_ids = super(AutoContext, self).map(
+            target, iterable_of_args, kwargs, **options)
+
+        self._auto_insert_check()
+
+        return task_ids
+
     def _auto_insert_check(self):
         """Automatically insert tasks asynchronously.
         Depending on batch_size, insert or wait until next call.
@@ -61,7 +75,10 @@ class AutoContext(Context):
         if not self.batch_size:
             return
 
-        if len(self._tasks) >= self.batch_size:
+        pending = len(self._tasks)
+        pending += sum(len(jobs) for _, jobs in self._mapped_tasks)
+
+        if pending >= self.batch_size:
             self._handle_tasks()
 
     def _handle_tasks(self):
@@ -72,6 +89,7 @@ class AutoContext(Context):
 
         self._handle_tasks_insert(batch_size=self.batch_size)
         self._tasks = []
+        self._mapped_tasks = []
 
     def __exit__(self, exc_type, exc_val, exc_tb):
         """In addition to the default __exit__(), also mark all tasks
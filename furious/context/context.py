@@ -42,6 +42,8 @@ Usage:
 
 """
 import abc
+from collections import deque
+import json
 import time
 import uuid
 
@@ -64,6 +66,7 @@ class Context(object):
     """
     def __init__(self, **options):
         self._tasks = []
+        self._mapped_tasks = []
         self._tasks_inserted = False
         self._insert_success_count = 0
         self._insert_failed_count = 0
@@ -115,11 +118,23 @@ class Context(object):
     def persist_async_results(self):
         return self._options.get('persist_async_results', False)
 
+    @property
+    def completion_shards(self):
+        """The number of shards counting this context's completed tasks.
+
+        It is fixed the first time it is read, so the stored context and its
+        tasks agree on it whatever the config of the instances they run on.
+        """
+        from furious.config import get_completion_shard_count
+
+        return self._options.setdefault('_completion_shards',
+                                        get_completion_shard_count())
+
     def __enter__(self):
         return self
 
     def __exit__(self, exc_type, exc_val, exc_tb):
-        if not exc_type and self._tasks:
+        if not exc_type and (self._tasks or self._mapped_tasks):
             self._handle_tasks()
 
         return False
@@ -144,14 +159,25 @@ class Context(object):
 
         retry_errors = self._options.get('retry_transient_errors', True)
 
-        for queue, tasks in task_map.iteritems():
-            for batch in _task_batcher(tasks, batch_size=batch_size):
-                inserted = self._insert_tasks(batch, queue=queue,
+        batches = ((queue, batch) for queue, tasks in task_map.iteritems()
+                   for batch in _task_batcher(tasks, batch_size=batch_size))
+
+        # Pipelining is only done with the default insert_tasks, so that a
+        # custom insert_tasks function is always honored.
+        concurrency = self._options.get('insert_concurrency')
+        if concurrency > 1 and self._insert_tasks is _insert_tasks:
+            results = _insert_tasks_pipelined(batches, concurrency,
                                               retry_errors=retry_errors)
-                if isinstance(inserted, (int, long)):
-                    # Don't blow up on insert_tasks that don't return counts.
-                    self._insert_success_count += inserted
-                    self._insert_failed_count += len(batch) - inserted
+        else:
+            results = ((batch, self._insert_tasks(batch, queue=queue,
+                                                  retry_errors=retry_errors))
+                       for queue, batch in batches)
+
+        for batch, inserted in results:
+            if isinstance(inserted, (int, long)):
+                # Don't blow up on insert_tasks that don't return counts.
+                self._insert_success_count += inserted
+                self._insert_failed_count += len(batch) - inserted
 
     def _handle_tasks(self):
         """Convert all Async's into tasks, then insert them into queues.
@@ -164,21 +190,33 @@ class Context(object):
     def _get_tasks_by_queue(self):
         """Return the tasks for this Context, grouped by queue."""
         task_map = {}
-        _checker = None
+        checker_options = {}
 
         # Ask the persistence engine for an Async to use for checking if the
-        # context is complete.
+        # context is complete.  The tasks carry the completion shards, so
+        # they know how to record their completion without looking it up.
         if self._persistence_engine:
-            _checker = self._persistence_engine.context_completion_checker
+            checker_options['_context_checker'] = (
+                self._persistence_engine.context_completion_checker)
+
+            if self.completion_shards:
+                checker_options['_completion_shards'] = self.completion_shards
 
         for async in self._tasks:
             queue = async.get_queue()
-            if _checker:
-                async.update_options(_context_checker=_checker)
+            if checker_options:
+                async.update_options(**checker_options)
 
             task = async.to_task()
             task_map.setdefault(queue, []).append(task)
 
+        for template, jobs in self._mapped_tasks:
+            if checker_options:
+                template.update_options(**checker_options)
+
+            task_map.setdefault(template.get_queue(), []).extend(
+                _iter_mapped_tasks(template, jobs))
+
         return task_map
 
     def _prepare_persistence_engine(self):
@@ -249,9 +287,47 @@ class Context(object):
 
         return target
 
+    def map(self, target, iterable_of_args, kwargs=None, **options):
+        """Add an Async job to this context for each item in iterable_of_args.
+
+        Each item is a tuple or list of positional args for target, any other
+        item is passed as the only positional arg.  kwargs and options are
+        shared by every job.  The target path, recursion info, parent and
+        context ids and options are resolved once for all of the jobs, and
+        their tasks are built directly, without an Async per job.  Returns
+        the ids of the added jobs.
+        """
+        from furious.async import Async
+
+        if self._tasks_inserted:
+            raise errors.ContextAlreadyStartedError(
+                "This Context has already had its tasks inserted.")
+
+        template = Async(target, None, kwargs, **options)
+
+        if 'name' in template.get_task_args():
+            raise ValueError('Mapped jobs can not share a task name.')
+
+        template.update_options(_context_id=self.id)
+
+        if self.persist_async_results:
+            template.update_options(persist_result=True)
+
+        jobs = []
+        for index, args in enumerate(iterable_of_args):
+            if not isinstance(args, (tuple, list)):
+                args = (args,)
+
+            jobs.append(("%s-%d" % (template.id, index), args))
+
+        self._mapped_tasks.append((template, jobs))
+        self._options['_task_ids'].extend(job_id for job_id, _ in jobs)
+
+        return [job_id for job_id, _ in jobs]
+
     def start(self):
         """Insert this Context's tasks so they start executing."""
-        if self._tasks:
+        if self._tasks or self._mapped_tasks:
             self._handle_tasks()
 
     def persist(self):
@@ -277,9 +353,8 @@ class Context(object):
 
     def to_dict(self):
         """Return this Context as a dict suitable for json encoding."""
-        import copy
-
-        options = copy.deepcopy(self._options)
+        options = self._options.copy()
+        options['_task_ids'] = list(self._options['_task_ids'])
 
         if self._insert_tasks:
             options['insert_tasks'] = reference_to_path(self._insert_tasks)
@@ -301,9 +376,11 @@ class Context(object):
     @classmethod
     def from_dict(cls, context_options_dict):
         """Return a context job from a dict output by Context.to_dict."""
-        import copy
+        context_options = context_options_dict.copy()
 
-        context_options = copy.deepcopy(context_options_dict)
+        # Tasks added to the context must not be added to the dict.
+        if '_task_ids' in context_options:
+            context_options['_task_ids'] = list(context_options['_task_ids'])
 
         tasks_inserted = context_options.pop('_tasks_inserted', False)
 
@@ -362,12 +439,65 @@ class ContextResultBase(object):
         return
 
 
+def _iter_mapped_tasks(template, jobs):
+    """Yield a task for each (id, args) job, using the template Async for
+    everything but the job's id and args.  The template's options are
+    encoded once and spliced into each job's payload.
+    """
+    from furious.async import ASYNC_ENDPOINT
+    from furious.async import DEFAULT_RETRY_OPTIONS
+    from furious.config import get_default_task_system
+    from furious.config import get_payload_encoding
+    from furious.encoding import JSON_ENCODING
+
+    taskqueue = get_default_task_system()
+
+    template._increment_recursion_level()
+    template.check_recursion_depth()
+
+    options = template.to_dict()
+    target, _, kwargs = options.pop('job')
+    options.pop('id')
+
+    if get_payload_encoding() == JSON_ENCODING:
+        # The shared options are encoded once, the leading brace is dropped
+        # so each job's id and job can be prepended.
+        head = '{"id": "'
+        middle = '", "job": [%s, ' % (json.dumps(target),)
+        tail = ', %s], %s' % (json.dumps(kwargs), json.dumps(options)[1:])
+
+        def encode(job_id, args):
+            return ''.join((head, job_id, middle, json.dumps(args), tail))
+    else:
+        from furious.encoding import encode_payload
+
+        def encode(job_id, args):
+            return encode_payload(
+                dict(options, id=job_id, job=(target, args, kwargs)))
+
+    url = "%s/%s" % (ASYNC_ENDPOINT, template.function_path)
+    headers = template.get_headers()
+
+    task_args = template.get_task_args().copy()
+    retry_options = DEFAULT_RETRY_OPTIONS.copy()
+    retry_options.update(task_args.pop('retry_options', {}))
+    retry_options = taskqueue.TaskRetryOptions(**retry_options)
+
+    for job_id, args in jobs:
+        payload = encode(job_id, args)
+
+        yield taskqueue.Task(url=url, headers=headers.copy(), payload=payload,
+                             retry_options=retry_options, **task_args)
+
+
 def _insert_tasks(tasks, queue, transactional=False, retry_errors=True):
     """Insert a batch of tasks into the specified queue. If an error occurs
     during insertion, split the batch and retry until they are successfully
     inserted. Return the number of successfully inserted tasks.
     """
-    from google.appengine.api import taskqueue
+    from furious.config import get_default_task_system
+
+    taskqueue = get_default_task_system()
 
     if not tasks:
         return 0
@@ -378,33 +508,96 @@ def _insert_tasks(tasks, queue, transactional=False, retry_errors=True):
     except (taskqueue.BadTaskStateError,
             taskqueue.TaskAlreadyExistsError,
             taskqueue.TombstonedTaskError):
-        if len(tasks) <= 1:
-            # Task has already been inserted, no reason to report an error here.
-            return 0
-
-        # If a list of more than one Tasks is given, a raised exception does
-        # not guarantee that no tasks were added to the queue (unless
-        # transactional is set to True). To determine which tasks were
-        # successfully added when an exception is raised, check the
-        # Task.was_enqueued property.
-        reinsert = _tasks_to_reinsert(tasks, transactional)
-        count = len(reinsert)
-        inserted = len(tasks) - count
-        inserted += _insert_tasks(reinsert[:count / 2], queue, transactional)
-        inserted += _insert_tasks(reinsert[count / 2:], queue, transactional)
-
-        return inserted
+        return _split_and_reinsert_tasks(tasks, queue, transactional)
     except taskqueue.TransientError:
-        if not retry_errors:
-            return 0
+        return _retry_insert_tasks(tasks, queue, transactional, retry_errors)
 
-        reinsert = _tasks_to_reinsert(tasks, transactional)
 
-        # Retry with a delay, and then let any errors re-raise.
-        time.sleep(RETRY_SLEEP_SECS)
+def _insert_tasks_pipelined(batches, concurrency, transactional=False,
+                            retry_errors=True):
+    """Insert (queue, tasks) batches, keeping up to concurrency add_async RPCs
+    in flight across queues and batches.  Yield a (tasks, inserted) tuple for
+    each batch, in order, as its RPC completes.  Failed batches are split and
+    retried exactly as _insert_tasks does.
+    """
+    from furious.config import get_default_task_system
 
-        taskqueue.Queue(name=queue).add(reinsert, transactional=transactional)
-        return len(tasks)
+    taskqueue = get_default_task_system()
+
+    in_flight = deque()
+
+    for queue, tasks in batches:
+        if len(in_flight) >= concurrency:
+            yield _wait_for_insert(taskqueue, transactional, retry_errors,
+                                   *in_flight.popleft())
+
+        if not tasks:
+            yield tasks, 0
+            continue
+
+        rpc = taskqueue.Queue(name=queue).add_async(
+            tasks, transactional=transactional)
+        in_flight.append((rpc, queue, tasks))
+
+    while in_flight:
+        yield _wait_for_insert(taskqueue, transactional, retry_errors,
+                               *in_flight.popleft())
+
+
+def _wait_for_insert(taskqueue, transactional, retry_errors, rpc, queue,
+                     tasks):
+    """Wait for an add_async RPC and return a (tasks, inserted) tuple."""
+    try:
+        rpc.get_result()
+        return tasks, len(tasks)
+    except (taskqueue.BadTaskStateError,
+            taskqueue.TaskAlreadyExistsError,
+            taskqueue.TombstonedTaskError):
+        return tasks, _split_and_reinsert_tasks(tasks, queue, transactional)
+    except taskqueue.TransientError:
+        return tasks, _retry_insert_tasks(tasks, queue, transactional,
+                                          retry_errors)
+
+
+def _split_and_reinsert_tasks(tasks, queue, transactional):
+    """Split a batch that hit a task exists error in half, and reinsert the
+    tasks that were not enqueued.  Return the number of inserted tasks.
+    """
+    if len(tasks) <= 1:
+        # Task has already been inserted, no reason to report an error here.
+        return 0
+
+    # If a list of more than one Tasks is given, a raised exception does
+    # not guarantee that no tasks were added to the queue (unless
+    # transactional is set to True). To determine which tasks were
+    # successfully added when an exception is raised, check the
+    # Task.was_enqueued property.
+    reinsert = _tasks_to_reinsert(tasks, transactional)
+    count = len(reinsert)
+    inserted = len(tasks) - count
+    inserted += _insert_tasks(reinsert[:count / 2], queue, transactional)
+    inserted += _insert_tasks(reinsert[count / 2:], queue, transactional)
+
+    return inserted
+
+
+def _retry_insert_tasks(tasks, queue, transactional, retry_errors):
+    """Reinsert the tasks of a batch that hit a TransientError which were not
+    enqueued.  Return the number of inserted tasks.
+    """
+    from furious.config import get_default_task_system
+
+    if not retry_errors:
+        return 0
+
+    reinsert = _tasks_to_reinsert(tasks, transactional)
+
+    # Retry with a delay, and then let any errors re-raise.
+    time.sleep(RETRY_SLEEP_SECS)
+
+    taskqueue = get_default_task_system()
+    taskqueue.Queue(name=queue).add(reinsert, transactional=transactional)
+    return len(tasks)
 
 
 def _tasks_to_reinsert(tasks, transactional):
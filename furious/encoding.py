@@ -0,0 +1,151 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Wire formats for Async task payloads.
+
+JSON is the default.  The opt-in compact format replaces the well known
+option keys with short field tags, drops the whitespace from the JSON body and
+zlib compresses large bodies.  Compact payloads start with a header holding
+a magic marker, the schema version and flags, so decode_payload can tell
+which format a payload is in:
+
+    payload = encode_payload(async.to_dict(), encoding=COMPACT_ENCODING)
+    options = decode_payload(payload)
+
+Set the format used for new tasks with `payload_encoding` in furious.yaml.
+"""
+import json
+import zlib
+
+from furious import errors
+
+
+JSON_ENCODING = 'json'
+COMPACT_ENCODING = 'compact'
+
+# Neither byte can start a JSON document, so JSON payloads never collide.
+COMPACT_MAGIC = '\xfe\xca'
+COMPACT_VERSION = 1
+COMPACT_HEADER_SIZE = len(COMPACT_MAGIC) + 2
+
+FLAG_ZLIB = 0x01
+
+# Bodies smaller than this are not worth the cost of compressing.
+COMPRESS_THRESHOLD = 512
+
+# The option keys tagged by each version of the compact schema.  A version's
+# fields must never change, tag new keys in a new version so payloads already
+# in the queues can still be decoded.  Async options are Python identifiers,
+# so the numeric tags never collide with untagged keys.
+_SCHEMA_FIELDS = {
+    1: ('job', 'id', '_type', '_recursion', 'parent_id', 'context_id',
+        'callbacks', 'task_args', 'queue', 'persist_result',
+        '__context_checker', '_process_results', 'persistence_engine',
+        'headers', 'current', 'max'),
+}
+
+_FIELD_TAGS = dict(
+    (version, dict((field, str(tag)) for tag, field in enumerate(fields)))
+    for version, fields in _SCHEMA_FIELDS.iteritems())
+
+_TAG_FIELDS = dict(
+    (version, dict((str(tag), field) for tag, field in enumerate(fields)))
+    for version, fields in _SCHEMA_FIELDS.iteritems())
+
+
+def encode_payload(options, encoding=None):
+    """Encode an Async's options dict as a task payload in the requested
+    encoding, or the configured `payload_encoding` if none is given.
+    """
+    if not encoding:
+        from furious.config import get_payload_encoding
+
+        encoding = get_payload_encoding()
+
+    if encoding == JSON_ENCODING:
+        return json.dumps(options)
+
+    if encoding == COMPACT_ENCODING:
+        return encode_compact(options)
+
+    raise errors.PayloadEncodingError(
+        'Unknown payload encoding "%s".' % (encoding,))
+
+
+def decode_payload(payload):
+    """Decode a task payload, in any supported encoding, to an options dict.
+    """
+    if isinstance(payload, str) and payload.startswith(COMPACT_MAGIC):
+        return decode_compact(payload)
+
+    return json.loads(payload)
+
+
+def encode_compact(options, version=COMPACT_VERSION):
+    """Encode an options dict in the compact format."""
+    tags = _FIELD_TAGS[version]
+
+    body = json.dumps(_rekey(options, tags), separators=(',', ':'))
+
+    flags = 0
+    if len(body) >= COMPRESS_THRESHOLD:
+        compressed = zlib.compress(body)
+        if len(compressed) < len(body):
+            body = compressed
+            flags |= FLAG_ZLIB
+
+    return ''.join((COMPACT_MAGIC, chr(version), chr(flags), body))
+
+
+def decode_compact(payload):
+    """Decode a compact format payload to an options dict."""
+    version = ord(payload[len(COMPACT_MAGIC)])
+    flags = ord(payload[len(COMPACT_MAGIC) + 1])
+
+    fields = _TAG_FIELDS.get(version)
+    if not fields:
+        raise errors.PayloadEncodingError(
+            'Unsupported compact payload version %d.' % (version,))
+
+    body = payload[COMPACT_HEADER_SIZE:]
+    if flags & FLAG_ZLIB:
+        body = zlib.decompress(body)
+
+    return _rekey(json.loads(body), fields)
+
+
+def _rekey(options, keys):
+    """Return a copy of the options dict with its keys replaced using keys.
+    Keys not in keys are kept.  The recursion info and any encoded callback
+    Asyncs are rekeyed as well.
+    """
+    rekeyed = {}
+
+    for key, value in options.iteritems():
+        field = keys.get(key, key)
+
+        if '_recursion' in (key, field) and isinstance(value, dict):
+            value = _rekey(value, keys)
+
+        elif 'callbacks' in (key, field) and isinstance(value, dict):
+            value = dict(
+                (event, _rekey(callback, keys)
+                 if isinstance(callback, dict) else callback)
+                for event, callback in value.iteritems())
+
+        rekeyed[field] = value
+
+    return rekeyed
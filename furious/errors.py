@@ -19,6 +19,14 @@ class BadObjectPathError(Exception):
     """Invalid object path."""
 
 
+class PayloadEncodingError(Exception):
+    """The task payload encoding is unknown or unsupported."""
+
+
+class AggregateCollisionError(Exception):
+    """The aggregate could not be updated within the allowed retries."""
+
+
 class AsyncError(Exception):
     """The base class other Async errors can subclass."""
 
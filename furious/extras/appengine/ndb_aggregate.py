@@ -0,0 +1,77 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""An aggregate store for furious.batcher.reduce_messages backed by the App
+Engine ndb library, for aggregates that must survive memcache eviction:
+
+    reduce_messages(messages, reducer, initial, merge, 'stats',
+                    store=NdbAggregateStore())
+"""
+import logging
+
+from google.appengine.api import datastore_errors
+from google.appengine.ext import ndb
+
+from furious.batcher import AGGREGATE_RETRIES
+from furious.batcher import backoff
+from furious.errors import AggregateCollisionError
+
+
+class FuriousAggregate(ndb.Model):
+    """NDB entity to store an aggregate as JSON."""
+
+    value = ndb.JsonProperty(indexed=False, compressed=True)
+
+
+class NdbAggregateStore(object):
+    """Stores aggregates in the datastore, merging in transactions."""
+
+    def __init__(self, retries=AGGREGATE_RETRIES):
+        self.retries = retries
+
+    def get(self, key):
+        """Return the aggregate stored under key, or None."""
+        entity = FuriousAggregate.get_by_id(key)
+
+        return entity.value if entity else None
+
+    def merge(self, key, accumulator, merge, initial):
+        """Merge the accumulator into the aggregate stored under key, retrying
+        with backoff on contention.  Return the new aggregate.
+        """
+        @ndb.transactional(retries=0)
+        def _merge():
+            entity = FuriousAggregate.get_by_id(key)
+            if not entity:
+                entity = FuriousAggregate(id=key, value=initial())
+
+            entity.value = merge(entity.value, accumulator)
+            entity.put()
+
+            return entity.value
+
+        for attempt in xrange(self.retries):
+            if attempt:
+                backoff(attempt - 1)
+
+            try:
+                return _merge()
+            except datastore_errors.TransactionFailedError:
+                logging.debug("Aggregate %s collision on attempt %d.",
+                              key, attempt + 1)
+
+        raise AggregateCollisionError(
+            "Unable to merge into aggregate %s after %d attempts." % (
+                key, self.retries))
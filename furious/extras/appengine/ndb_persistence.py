@@ -18,12 +18,18 @@ persistence operations backed by the App Engine ndb library.
 """
 import json
 import logging
+import math
 import os
+import time
+
+from collections import deque
+from collections import OrderedDict
 
 from itertools import imap
 from itertools import islice
 from itertools import izip
 
+from random import randrange
 from random import shuffle
 
 from google.appengine.ext import ndb
@@ -34,8 +40,23 @@ from furious import config
 CLEAN_QUEUE = config.get_completion_cleanup_queue()
 DEFAULT_QUEUE = config.get_completion_default_queue()
 CLEAN_DELAY = config.get_completion_cleanup_delay()
+COMPLETION_CHECK_WINDOW = config.get_completion_check_window()
 QUEUE_HEADER = 'HTTP_X_APPENGINE_QUEUENAME'
 
+# The number of markers looked up at once, and the number of those lookups
+# kept in flight, when checking a context's markers.
+MARKER_WINDOW_SIZE = 100
+MARKER_WINDOWS_IN_FLIGHT = 4
+
+# Encoded results larger than this many bytes are stored in the result blob
+# store, when one is configured, rather than on the marker.
+INLINE_RESULT_LIMIT = 100 * 1024
+
+# The number of markers looked up at once when deleting their result blobs.
+CLEANUP_BATCH_SIZE = 100
+
+_result_store = None
+
 
 class FuriousContextNotFoundError(Exception):
     """FuriousContext entity not found in the datastore."""
@@ -69,6 +90,20 @@ class FuriousAsyncMarker(ndb.Model):
     """This entity serves as a 'complete' marker."""
 
     result = ndb.JsonProperty(indexed=False, compressed=True)
+    result_blob = ndb.StringProperty(indexed=False)
+    status = ndb.IntegerProperty(indexed=False)
+
+    @property
+    def success(self):
+        from furious.async import AsyncResult
+        return self.status != AsyncResult.ERROR
+
+
+class FuriousAsyncStatus(ndb.Model):
+    """The status of a completed Async, stored apart from its marker so
+    completion checks read a few bytes per Async, whatever its result's size.
+    """
+
     status = ndb.IntegerProperty(indexed=False)
 
     @property
@@ -78,28 +113,205 @@ class FuriousAsyncMarker(ndb.Model):
 
 
 class FuriousCompletionMarker(ndb.Model):
-    """This entity serves as a 'complete' marker for the entire context."""
+    """This entity serves as a 'complete' marker for the entire context.
+
+    When the context tracks completion with counters, shards is the number of
+    FuriousCompletionShard entities counting its completed tasks.  statuses is
+    set for contexts whose tasks record FuriousAsyncStatus entities, those
+    stored before then are checked by their markers.
+    """
 
     complete = ndb.BooleanProperty(default=False, indexed=False)
     has_errors = ndb.BooleanProperty(default=False, indexed=False)
+    shards = ndb.IntegerProperty(default=0, indexed=False)
+    statuses = ndb.BooleanProperty(default=False, indexed=False)
+    task_count = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class FuriousAsyncCounted(ndb.Model):
+    """Marks that an Async has been counted on its context's completion
+    shards.  It is kept apart from the marker, which is rewritten when the
+    Async's result is stored.
+    """
+
+
+class FuriousCompletionShard(ndb.Model):
+    """One shard of the counters of a context's completed and errored tasks.
+    """
+
+    complete = ndb.IntegerProperty(default=0, indexed=False)
+    errors = ndb.IntegerProperty(default=0, indexed=False)
+
+
+class ResultStore(object):
+    """Stores encoded Async results on their markers, or once larger than
+    inline_limit bytes, in the blob store with the marker naming the blob.
+    """
+
+    def __init__(self, blob_store=None, inline_limit=INLINE_RESULT_LIMIT):
+        self.blob_store = blob_store
+        self.inline_limit = inline_limit
+
+    def store(self, marker, result):
+        """Set the encoded result on the marker, first storing it in the blob
+        store if it is too large.
+        """
+        if not self.blob_store or len(result) <= self.inline_limit:
+            marker.result = result
+            marker.result_blob = None
+            return
+
+        # The blob is stored before the marker naming it.
+        name = marker.key.id()
+        self.blob_store.put(name, result)
+
+        marker.result = None
+        marker.result_blob = name
+
+    def load(self, marker):
+        """Return the marker's encoded result, or None."""
+        if not marker.result_blob:
+            return marker.result
+
+        if not self.blob_store:
+            logging.warning("No result blob store to load %s from.",
+                            marker.result_blob)
+            return None
+
+        return self.blob_store.get(marker.result_blob)
+
+    def delete(self, markers):
+        """Delete the blobs of the markers' results stored in the blob
+        store.
+        """
+        names = [marker.result_blob for marker in markers
+                 if marker and marker.result_blob]
+
+        if names and self.blob_store:
+            self.blob_store.delete(names)
+
+
+def get_result_store():
+    """Return the result store, creating it on first use."""
+    global _result_store
+
+    if _result_store is None:
+        blob_store = config.get_result_blob_store()
+
+        _result_store = ResultStore(blob_store() if blob_store else None)
+
+    return _result_store
+
+
+def reset_result_store(store=None):
+    """Replace the result store, or recreate the configured one on next use
+    if none is given.
+    """
+    global _result_store
+
+    _result_store = store
+
+
+class ResultCache(object):
+    """A least recently used cache of up to max_size markers by task id."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._markers = OrderedDict()
+
+    def __len__(self):
+        return len(self._markers)
+
+    def __contains__(self, task_id):
+        return task_id in self._markers
+
+    def __setitem__(self, task_id, marker):
+        self._markers.pop(task_id, None)
+        self._markers[task_id] = marker
+
+        while len(self._markers) > self.max_size:
+            self._markers.popitem(last=False)
+
+    def get(self, task_id, default=None):
+        if task_id not in self._markers:
+            return default
+
+        marker = self._markers.pop(task_id)
+        self._markers[task_id] = marker
+
+        return marker
+
+
+class MarkerResult(object):
+    """An Async's result from its marker, loading and decoding the stored
+    result only when the payload is first accessed.
+    """
+
+    __slots__ = ('marker', '_result')
+
+    def __init__(self, marker):
+        self.marker = marker
+        self._result = None
+
+    @property
+    def status(self):
+        return self.marker.status if self.marker else None
+
+    @property
+    def success(self):
+        return self.marker.success if self.marker else None
+
+    @property
+    def payload(self):
+        if not self.marker:
+            return None
+
+        if self._result is None:
+            result = get_result_store().load(self.marker)
+            if not result:
+                return None
+
+            self._result = json.loads(result)
+
+        return self._result["payload"]
 
 
 class ContextResult(ContextResultBase):
 
     BATCH_SIZE = 10
-
-    def __init__(self, context):
+    PREFETCH = 2
+
+    def __init__(self, context, prefetch=PREFETCH, cache_size=None):
+        """
+        :param prefetch: :class: `int` The number of batches of markers to
+                         look up ahead of the batch being read.
+        :param cache_size: :class: `int` The most markers kept for reading the
+                           results again, or None to keep them all.
+        """
         self._context = context
-        self._task_cache = {}
+        self._prefetch = prefetch
         self._marker = None
 
+        if cache_size is None:
+            self._task_cache = {}
+        elif cache_size:
+            self._task_cache = ResultCache(cache_size)
+        else:
+            self._task_cache = None
+
     @property
     def _tasks(self):
-        if self._task_cache:
-            return ((key, task) for key, task in self._task_cache.iteritems())
+        task_ids = self._context.task_ids
+
+        # Only a cache holding every task's marker can be used in place of
+        # the datastore, a partially read or bounded cache is missing some.
+        if (self._task_cache and len(self._task_cache) >= len(task_ids) and
+                all(task_id in self._task_cache for task_id in task_ids)):
+            return ((task_id, self._task_cache.get(task_id))
+                    for task_id in task_ids)
 
         return iter_context_results(self._context, self.BATCH_SIZE,
-                                    self._task_cache)
+                                    self._task_cache, self._prefetch)
 
     @property
     def _completion_marker(self):
@@ -112,18 +324,35 @@ class ContextResult(ContextResultBase):
     def items(self):
         """Yield the async reuslts for the context."""
         for key, task in self._tasks:
-            if not (task and task.result):
-                yield key, None
-            else:
-                yield key, json.loads(task.result)["payload"]
+            yield key, MarkerResult(task).payload
 
     def values(self):
         """Yield the async reuslt values for the context."""
         for _, task in self._tasks:
-            if not (task and task.result):
-                yield None
-            else:
-                yield json.loads(task.result)["payload"]
+            yield MarkerResult(task).payload
+
+    def get(self, task_id):
+        """Return the MarkerResult for one of the context's asyncs."""
+        cache = self._task_cache
+
+        if cache is not None and task_id in cache:
+            return MarkerResult(cache.get(task_id))
+
+        task = FuriousAsyncMarker.get_by_id(task_id)
+
+        if cache is not None:
+            cache[task_id] = task
+
+        return MarkerResult(task)
+
+    def stream(self):
+        """Yield (task id, MarkerResult) for the context's asyncs, without
+        caching the markers, so memory use is bounded by the batch size and
+        prefetch however many results the context has.
+        """
+        for key, task in iter_context_results(self._context, self.BATCH_SIZE,
+                                              prefetch=self._prefetch):
+            yield key, MarkerResult(task)
 
     def has_errors(self):
         """Return the error flag from the completion marker."""
@@ -136,18 +365,52 @@ class ContextResult(ContextResultBase):
 def context_completion_checker(async):
     """Persist async marker and async the completion check"""
 
-    store_async_marker(async.id, async.result.status if async.result else -1)
+    status = async.result.status if async.result else -1
+
+    # The context's tasks carry the completion shards it was stored with.
+    shards = async.get_options().get('_completion_shards')
+
+    if shards and async.context_id:
+        _count_async_completion(async.id, status, async.context_id, shards)
+    elif async.result and async.get_options().get('persist_result'):
+        # The marker was written with the result when the result was set.
+        logging.debug("Marker stored with result for %s.", async.id)
+    else:
+        # The marker must be stored before the check is inserted, or
+        # concurrent checks may each miss the other's marker.
+        record_async_completion(async.id, status).get_result()
 
     logging.debug("Async check completion for: %s", async.context_id)
     current_queue = _get_current_queue()
     from furious.async import Async
     logging.debug("Completion Check queue:%s", current_queue)
     Async(_completion_checker, queue=current_queue,
-          args=(async.id, async.context_id)).start()
+          args=(async.id, async.context_id),
+          task_args=_completion_check_task_args(async.context_id)).start()
 
     return True
 
 
+def _completion_check_task_args(context_id):
+    """Return the task args for a context's completion check.
+
+    When completion checks are coalesced the check is named after the context
+    and the current window, and delayed until the window ends, so at most one
+    check is inserted per context per window. Every task completed within a
+    window is covered by that window's check, so only the check for the final
+    window will find the context done.
+    """
+    if not COMPLETION_CHECK_WINDOW or not context_id:
+        return {}
+
+    now = time.time()
+    window = int(now / COMPLETION_CHECK_WINDOW)
+    window_end = (window + 1) * COMPLETION_CHECK_WINDOW
+
+    return {'name': "%s-check-%d" % (context_id, window),
+            'countdown': int(math.ceil(window_end - now))}
+
+
 def _get_current_queue():
 
     return os.environ.get(QUEUE_HEADER, DEFAULT_QUEUE)
@@ -160,9 +423,13 @@ def _completion_checker(async_id, context_id):
         logging.debug("Context for async %s does not exist", async_id)
         return
 
-    context = FuriousContext.from_id(context_id)
     marker = FuriousCompletionMarker.get_by_id(context_id)
 
+    if marker and marker.shards:
+        return _check_completion_counters(marker)
+
+    context = FuriousContext.from_id(context_id)
+
     if marker and marker.complete:
         logging.info("Context %s already complete" % context_id)
         return True
@@ -174,7 +441,8 @@ def _completion_checker(async_id, context_id):
     logging.debug("Loaded context.")
     logging.debug(task_ids)
 
-    done, has_errors = _check_markers(task_ids)
+    done, has_errors = _check_markers(
+        task_ids, legacy_markers=not (marker and marker.statuses))
 
     if not done:
         return False
@@ -184,28 +452,127 @@ def _completion_checker(async_id, context_id):
     return True
 
 
-def _check_markers(task_ids, offset=10):
+def _check_completion_counters(marker):
+    """Check if all of a context's tasks have been counted as complete by its
+    completion shards.  This costs the same number of reads regardless of the
+    number of tasks in the context.
+    """
+    context_id = marker.key.id()
+
+    if marker.complete:
+        logging.info("Context %s already complete" % context_id)
+        return True
+
+    shards = ndb.get_multi(_completion_shard_keys(context_id, marker.shards))
+
+    complete = sum(shard.complete for shard in shards if shard)
+    if complete < marker.task_count:
+        logging.debug("%d of %d Asyncs complete for %s", complete,
+                      marker.task_count, context_id)
+        return False
+
+    has_errors = any(shard.errors for shard in shards if shard)
+
+    context = FuriousContext.from_id(context_id)
+
+    _mark_context_complete(marker, context, has_errors)
+
+    return True
+
+
+@ndb.transactional(xg=True)
+def _count_async_completion(async_id, status, context_id, shards):
+    """Transactionally mark the Async complete and count it on one of its
+    context's completion shards.  An Async is only ever counted once, so
+    retried tasks do not inflate the count.
+    """
+    from furious.async import AsyncResult
+
+    counted, marker = ndb.get_multi((ndb.Key(FuriousAsyncCounted, async_id),
+                                     ndb.Key(FuriousAsyncMarker, async_id)))
+
+    if counted:
+        logging.debug("Async %s already counted.", async_id)
+        return False
+
+    entities = [FuriousAsyncCounted(id=async_id)]
+
+    # Keep a marker stored with the Async's result.
+    if not marker:
+        entities.append(FuriousAsyncMarker(id=async_id, status=status))
+
+    shard_key = _completion_shard_keys(context_id, shards)[randrange(shards)]
+    shard = shard_key.get() or FuriousCompletionShard(key=shard_key)
+
+    shard.complete += 1
+    if status == AsyncResult.ERROR:
+        shard.errors += 1
+
+    entities.append(shard)
+    ndb.put_multi(entities)
+
+    return True
+
+
+def _completion_shard_keys(context_id, shards):
+    """Return the keys of a context's completion shards."""
+    return [ndb.Key(FuriousCompletionShard, "%s-%d" % (context_id, index))
+            for index in xrange(shards)]
+
+
+def _check_markers(task_ids, offset=MARKER_WINDOW_SIZE,
+                   in_flight=MARKER_WINDOWS_IN_FLIGHT, legacy_markers=False):
     """Returns a flag for markers being found for the task_ids. If all task ids
     have markers True will be returned. Otherwise it will return False as soon
     as a None result is hit.
+
+    The Asyncs' status entities are looked up in windows of offset keys,
+    keeping in_flight windows of lookups running at once.  With
+    legacy_markers, for contexts stored before status entities were written,
+    Asyncs without a status entity fall back to their markers.  Once a marker
+    is missing no more windows are looked up, and those in flight are not
+    waited on.
     """
 
     shuffle(task_ids)
     has_errors = False
 
-    for index in xrange(0, len(task_ids), offset):
-        keys = [ndb.Key(FuriousAsyncMarker, id)
-                for id in task_ids[index:index + offset]]
+    windows = (task_ids[index:index + offset]
+               for index in xrange(0, len(task_ids), offset))
+    lookups = deque()
+
+    def start_lookups():
+        for ids in islice(windows, in_flight - len(lookups)):
+            keys = [ndb.Key(FuriousAsyncStatus, id) for id in ids]
+            lookups.append((ids, ndb.get_multi_async(keys)))
 
-        markers = ndb.get_multi(keys)
+    start_lookups()
 
-        if not all(markers):
+    while lookups:
+        ids, futures = lookups.popleft()
+        statuses = [future.get_result() for future in futures]
+
+        missing = [id for id, status in izip(ids, statuses) if not status]
+        if missing and not legacy_markers:
             logging.debug("Not all Async's complete")
             return False, None
 
+        if missing:
+            markers = ndb.get_multi(
+                [ndb.Key(FuriousAsyncMarker, id) for id in missing])
+
+            if not all(markers):
+                logging.debug("Not all Async's complete")
+                return False, None
+
+            statuses = [status for status in statuses if status] + markers
+
         # Did any of the aync's fail? Check the success property on the
         # AsyncResult.
-        has_errors = not all((marker.success for marker in markers))
+        if not has_errors:
+            has_errors = not all(status.success for status in statuses)
+
+        start_lookups()
 
     return True, has_errors
 
@@ -230,12 +597,12 @@ def _mark_context_complete(marker, context, has_errors):
     current.put()
 
     # Kick off completion tasks.
-    _insert_post_complete_tasks(context)
+    _insert_post_complete_tasks(context, current.shards)
 
     return True
 
 
-def _insert_post_complete_tasks(context):
+def _insert_post_complete_tasks(context, shards=0):
     """Insert the event's asyncs and cleanup tasks."""
 
     logging.debug("Context %s is complete.", context.id)
@@ -249,21 +616,37 @@ def _insert_post_complete_tasks(context):
         # wait until the results have been accessed.
         from furious.async import Async
         Async(_cleanup_markers, queue=CLEAN_QUEUE,
-              args=[context.id, context.task_ids],
+              args=[context.id, context.task_ids, shards],
               task_args={'countdown': CLEAN_DELAY}).start()
     except:
         pass
 
 
-def _cleanup_markers(context_id, task_ids):
-    """Delete the FuriousAsyncMarker entities corresponding to ids."""
+def _cleanup_markers(context_id, task_ids, shards=0):
+    """Delete the FuriousAsyncMarker entities corresponding to ids, and the
+    context's completion marker and shards.
+    """
 
     logging.debug("Cleanup %d markers for Context %s",
                   len(task_ids), context_id)
 
+    # The markers name their result blobs, so the blobs are deleted first,
+    # a batch of markers at a time.
+    result_store = get_result_store()
+    if result_store.blob_store:
+        for batch in iget_batches(task_ids, batch_size=CLEANUP_BATCH_SIZE,
+                                  prefetch=1):
+            result_store.delete(future.get_result() for _, future in batch)
+
     # TODO: Handle exceptions and retries here.
     delete_entities = [ndb.Key(FuriousAsyncMarker, id) for id in task_ids]
+    delete_entities.extend(ndb.Key(FuriousAsyncStatus, id) for id in task_ids)
     delete_entities.append(ndb.Key(FuriousCompletionMarker, context_id))
+    delete_entities.extend(_completion_shard_keys(context_id, shards))
+
+    if shards:
+        delete_entities.extend(ndb.Key(FuriousAsyncCounted, id)
+                               for id in task_ids)
 
     ndb.delete_multi(delete_entities)
 
@@ -283,10 +666,15 @@ def store_context(context):
 
     logging.debug("Attempting to store Context %s.", context.id)
 
+    # Read the completion shards first, so they are stored with the context.
+    marker = FuriousCompletionMarker(id=context.id,
+                                     shards=context.completion_shards,
+                                     statuses=True,
+                                     task_count=len(context.task_ids))
+
     entity = FuriousContext.from_context(context)
 
     # TODO: Handle exceptions and retries here.
-    marker = FuriousCompletionMarker(id=context.id)
     key, _ = ndb.put_multi((entity, marker))
 
     logging.debug("Stored Context with key: %s.", key)
@@ -299,9 +687,8 @@ def store_async_result(async_id, async_result):
 
     logging.debug("Storing result for %s", async_id)
 
-    key = FuriousAsyncMarker(
-        id=async_id, result=json.dumps(async_result.to_dict()),
-        status=async_result.status).put()
+    key = record_async_completion(
+        async_id, async_result.status, async_result).get_result()
 
     logging.debug("Setting Async result %s using marker: %s.", async_result,
                   key)
@@ -310,25 +697,44 @@ def store_async_result(async_id, async_result):
 def store_async_marker(async_id, status):
     """Persist a marker indicating the Async ran to the datastore."""
 
-    logging.debug("Attempting to mark Async %s complete.", async_id)
+    key = record_async_completion(async_id, status).get_result()
 
-    # QUESTION: Do we trust if the marker had a flag result to just trust it?
-    marker = FuriousAsyncMarker.get_by_id(async_id)
+    logging.debug("Marked Async complete using marker: %s.", key)
 
-    if marker:
-        logging.debug("Marker already exists for %s.", async_id)
-        return
 
-    # TODO: Handle exceptions and retries here.
-    key = FuriousAsyncMarker(id=async_id, status=status).put()
+def record_async_completion(async_id, status, async_result=None):
+    """Write the marker indicating the Async ran, with its result if given,
+    and its status entity, without reading them first.  Writing the same
+    marker again is harmless, so a retried task can record its completion
+    again.
 
-    logging.debug("Marked Async complete using marker: %s.", key)
+    Return a future for the marker's key.
+    """
+    logging.debug("Recording Async %s complete.", async_id)
 
+    marker = FuriousAsyncMarker(id=async_id, status=status)
 
-def iter_context_results(context, batch_size=10, task_cache=None):
+    if async_result:
+        get_result_store().store(marker, json.dumps(async_result.to_dict()))
+
+    return _put_marker_key((marker,
+                            FuriousAsyncStatus(id=async_id, status=status)))
+
+
+@ndb.tasklet
+def _put_marker_key(entities):
+    """Put the entities together, returning the first entity's key."""
+    keys = yield ndb.put_multi_async(entities)
+
+    raise ndb.Return(keys[0])
+
+
+def iter_context_results(context, batch_size=10, task_cache=None,
+                         prefetch=0):
     """Yield out the results found on the markers for the context task ids."""
 
-    for futures in iget_batches(context.task_ids, batch_size=batch_size):
+    for futures in iget_batches(context.task_ids, batch_size=batch_size,
+                                prefetch=prefetch):
         for key, future in futures:
             task = future.get_result()
 
@@ -338,14 +744,23 @@ def iter_context_results(context, batch_size=10, task_cache=None):
             yield key.id(), task
 
 
-def iget_batches(task_ids, batch_size=10):
+def iget_batches(task_ids, batch_size=10, prefetch=0):
     """Yield out a map of the keys and futures in batches of the batch size
-    passed in.
+    passed in, with the lookups for up to prefetch more batches in flight.
     """
 
     make_key = lambda _id: ndb.Key(FuriousAsyncMarker, _id)
-    for keys in i_batch(imap(make_key, task_ids), batch_size):
-        yield izip(keys, ndb.get_multi_async(keys))
+    batches = ((keys, ndb.get_multi_async(keys))
+               for keys in i_batch(imap(make_key, task_ids), batch_size))
+
+    pending = deque(islice(batches, prefetch))
+
+    for batch in batches:
+        pending.append(batch)
+        yield izip(*pending.popleft())
+
+    while pending:
+        yield izip(*pending.popleft())
 
 
 def i_batch(items, size):
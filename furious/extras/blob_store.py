@@ -0,0 +1,122 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""Blob stores hold Async results too large to store on their markers.
+
+The blob store is selected with `result_blob_store` in furious.yaml, either
+`local`, `cloudstorage`, or the path to a blob store class.  A blob store
+implements:
+
+    put(name, data)
+    get(name)
+    delete(names)
+
+where get returns None for a missing blob, and delete ignores missing blobs.
+"""
+import errno
+import os
+import tempfile
+import urllib
+
+
+class LocalBlobStore(object):
+    """Stores blobs as files in a local directory, for tests and local
+    development.
+    """
+
+    def __init__(self, root=None):
+        self.root = root or os.path.join(tempfile.gettempdir(),
+                                         'furious-blobs')
+
+    def put(self, name, data):
+        if not os.path.isdir(self.root):
+            try:
+                os.makedirs(self.root)
+            except OSError as e:
+                if e.errno != errno.EEXIST:
+                    raise
+
+        path = self._path(name)
+
+        # Write then rename, so a partially written blob is never read.
+        temp_path = "%s.%d.tmp" % (path, os.getpid())
+        with open(temp_path, 'wb') as blob:
+            blob.write(data)
+
+        os.rename(temp_path, path)
+
+    def get(self, name):
+        try:
+            with open(self._path(name), 'rb') as blob:
+                return blob.read()
+        except IOError as e:
+            if e.errno == errno.ENOENT:
+                return None
+            raise
+
+    def delete(self, names):
+        for name in names:
+            try:
+                os.remove(self._path(name))
+            except OSError as e:
+                if e.errno != errno.ENOENT:
+                    raise
+
+    def _path(self, name):
+        return os.path.join(self.root, urllib.quote(name, safe=''))
+
+
+class CloudStorageBlobStore(object):
+    """Stores blobs in a Google Cloud Storage bucket, the app's default bucket
+    unless given one, using the App Engine cloudstorage client library.
+    """
+
+    def __init__(self, bucket=None, prefix='furious-results'):
+        if not bucket:
+            from google.appengine.api import app_identity
+
+            bucket = app_identity.get_default_gcs_bucket_name()
+
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def put(self, name, data):
+        import cloudstorage
+
+        with cloudstorage.open(self._path(name), 'w',
+                               content_type='application/json') as blob:
+            blob.write(data)
+
+    def get(self, name):
+        import cloudstorage
+
+        try:
+            with cloudstorage.open(self._path(name)) as blob:
+                return blob.read()
+        except cloudstorage.NotFoundError:
+            return None
+
+    def delete(self, names):
+        import cloudstorage
+
+        for name in names:
+            try:
+                cloudstorage.delete(self._path(name))
+            except cloudstorage.NotFoundError:
+                pass
+
+    def _path(self, name):
+        return "/%s/%s/%s" % (self.bucket, self.prefix,
+                              urllib.quote(name, safe=''))
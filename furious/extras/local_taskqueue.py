@@ -0,0 +1,721 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+"""A pure-Python, in-process task system that mirrors the parts of App
+Engine's taskqueue module used by furious.  It makes it possible to run, and
+load-test, furious workflows without the App Engine SDK.
+
+Select it by setting the task system in furious.yaml:
+
+    task_system: local
+
+Push tasks are kept in per-queue priority queues keyed by ETA and executed
+by `process_async_task`, either inline or on a pool of worker threads.  Pull
+tasks may be leased, have their leases modified and be deleted, just as with
+App Engine pull queues.
+
+Usage:
+
+    from furious.extras import local_taskqueue
+
+    engine = local_taskqueue.get_engine()
+
+    # Run tasks on a pool of worker threads as they become ready.
+    engine.start(workers=8)
+
+    Async(some_function, args=(1, 2)).start()
+
+    # Wait for all push queues to drain, then shut the workers down.
+    engine.join()
+    engine.stop()
+
+    # Alternatively, run every ready task inline on the current thread.
+    engine.run()
+
+Both join and run only wait for delayed tasks that become ready within
+`max_wait` seconds, a minute by default, so tasks delayed for hours, such as
+the marker cleanup inserted when a persisted Context completes, are left
+queued rather than blocking.  Pass `max_wait=None` to wait for every task.
+"""
+import calendar
+import datetime
+import heapq
+import itertools
+import logging
+import threading
+import time
+
+DEFAULT_QUEUE = 'default'
+DEFAULT_WORKERS = 4
+# Seconds run and join wait for delayed tasks to become ready.  Tasks delayed
+# by longer, such as furious' marker cleanup, are left queued.
+DEFAULT_MAX_WAIT = 60
+MAX_TASKS_PER_ADD = 100
+DEFAULT_MIN_BACKOFF_SECONDS = 0.1
+DEFAULT_MAX_BACKOFF_SECONDS = 3600
+
+
+class Error(Exception):
+    """Base class for local task system errors."""
+
+
+class TransientError(Error):
+    """A transient error occurred, the operation may be retried."""
+
+
+class BadTaskStateError(Error):
+    """The task is in a state that is not valid for the operation."""
+
+
+class TaskAlreadyExistsError(Error):
+    """A task with the same name already exists in the queue."""
+
+
+class TombstonedTaskError(Error):
+    """A task with the same name was previously run or deleted."""
+
+
+class DuplicateTaskNameError(Error):
+    """Two tasks with the same name were added in a single batch."""
+
+
+class TooManyTasksError(Error):
+    """More than MAX_TASKS_PER_ADD tasks were added in a single batch."""
+
+
+class TaskRetryOptions(object):
+    """Retry parameters for a push task."""
+
+    def __init__(self, min_backoff_seconds=None, max_backoff_seconds=None,
+                 task_age_limit=None, max_doublings=None,
+                 task_retry_limit=None):
+        self.min_backoff_seconds = min_backoff_seconds
+        self.max_backoff_seconds = max_backoff_seconds
+        self.task_age_limit = task_age_limit
+        self.max_doublings = max_doublings
+        self.task_retry_limit = task_retry_limit
+
+
+class Task(object):
+    """A push or pull task."""
+
+    def __init__(self, payload=None, name=None, method='POST', url=None,
+                 headers=None, countdown=None, eta=None, retry_options=None,
+                 tag=None, **kwargs):
+        self.payload = payload
+        self.name = name
+        self.method = method.upper()
+        self.url = url
+        self.headers = dict(headers or {})
+        self.retry_options = retry_options
+        self.tag = tag
+        self.retry_count = 0
+
+        self._eta_posix = _get_eta_posix(eta, countdown)
+        self._enqueued = False
+        self._deleted = False
+
+    @property
+    def eta(self):
+        """Return the task's ETA as a naive UTC datetime.  For leased pull
+        tasks this is the time the lease expires.
+        """
+        return datetime.datetime.utcfromtimestamp(self._eta_posix)
+
+    @property
+    def eta_posix(self):
+        return self._eta_posix
+
+    @property
+    def was_enqueued(self):
+        return self._enqueued
+
+    @property
+    def was_deleted(self):
+        return self._deleted
+
+
+class QueueStatistics(object):
+    """Point in time statistics for a queue."""
+
+    def __init__(self, queue, tasks, oldest_eta_usec=None):
+        self.queue = queue
+        self.tasks = tasks
+        self.oldest_eta_usec = oldest_eta_usec
+
+
+class Queue(object):
+    """A queue backed by the process-wide LocalQueueEngine."""
+
+    def __init__(self, name=DEFAULT_QUEUE):
+        self.name = name
+
+    def add(self, task, transactional=False):
+        """Add a task, or list of tasks, to this queue.  Returns what was
+        passed in.
+        """
+        return get_engine().add(self.name, task, transactional=transactional)
+
+    def add_async(self, task, transactional=False, rpc=None):
+        """Add a task, or list of tasks, to this queue.  Errors are raised
+        when the result is requested from the returned rpc.
+        """
+        return _LocalRPC(self.add, task, transactional=transactional)
+
+    def lease_tasks(self, lease_seconds, max_tasks, deadline=10):
+        """Lease up to max_tasks pull tasks for lease_seconds."""
+        return get_engine().lease(self.name, lease_seconds, max_tasks)
+
+    def lease_tasks_by_tag(self, lease_seconds, max_tasks, tag=None,
+                           deadline=10):
+        """Lease up to max_tasks pull tasks with the given tag.  If no tag is
+        given, the tag of the oldest ready task is used.
+        """
+        return get_engine().lease(self.name, lease_seconds, max_tasks,
+                                  tag=tag, group_by_tag=True)
+
+    def lease_tasks_by_tag_async(self, lease_seconds, max_tasks, tag=None,
+                                 deadline=10, rpc=None):
+        """Asynchronous version of lease_tasks_by_tag."""
+        return _LocalRPC(self.lease_tasks_by_tag, lease_seconds, max_tasks,
+                         tag=tag, deadline=deadline)
+
+    def modify_task_lease(self, task, lease_seconds):
+        """Extend, or shorten, the lease on a leased pull task."""
+        get_engine().modify_lease(self.name, task, lease_seconds)
+
+    def delete_tasks(self, task):
+        """Delete a task, or list of tasks, from this queue."""
+        return get_engine().delete(self.name, task)
+
+    def delete_tasks_async(self, task, rpc=None):
+        """Asynchronous version of delete_tasks."""
+        return _LocalRPC(self.delete_tasks, task)
+
+    def delete_tasks_by_name(self, task_name):
+        """Delete a task, or list of tasks, by name."""
+        return get_engine().delete_by_name(self.name, task_name)
+
+    def fetch_statistics(self, deadline=10):
+        """Return the QueueStatistics for this queue."""
+        return get_engine().statistics(self.name)
+
+    def purge(self):
+        """Remove all tasks from this queue."""
+        get_engine().purge(self.name)
+
+
+class _LocalRPC(object):
+    """Minimal stand-in for an App Engine UserRPC.  The call is executed
+    immediately and its result, or error, is returned from get_result.
+    """
+
+    def __init__(self, method, *args, **kwargs):
+        self._result = None
+        self._exception = None
+
+        try:
+            self._result = method(*args, **kwargs)
+        except Exception as e:
+            self._exception = e
+
+    def wait(self):
+        pass
+
+    def check_success(self):
+        if self._exception:
+            raise self._exception
+
+    def get_result(self):
+        self.check_success()
+        return self._result
+
+
+class _LocalQueue(object):
+    """Tasks held by a single named queue.  Heap entries are lazily
+    invalidated: an entry is stale if its task has been deleted or its ETA
+    has since been changed.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.push = []
+        self.pull = {}
+        self.names = set()
+        self.tasks = {}
+
+    def push_entry(self, task, sequence):
+        entry = (task.eta_posix, sequence, task)
+        if task.method == 'PULL':
+            heapq.heappush(self.pull.setdefault(task.tag, []), entry)
+        else:
+            heapq.heappush(self.push, entry)
+
+
+class LocalQueueEngine(object):
+    """Holds every local queue and runs their push tasks.
+
+    Tasks are executed with `handler`, which defaults to running furious
+    tasks through `process_async_task`.
+    """
+
+    def __init__(self, handler=None):
+        self.handler = handler or _handle_furious_task
+
+        self._condition = threading.Condition()
+        self._queues = {}
+        self._sequence = itertools.count()
+        self._in_flight = 0
+        self._workers = []
+        self._running = False
+
+    def _get_queue(self, queue_name):
+        queue = self._queues.get(queue_name)
+        if not queue:
+            queue = self._queues[queue_name] = _LocalQueue(queue_name)
+
+        return queue
+
+    def add(self, queue_name, task, transactional=False):
+        """Add a task, or list of tasks, to the named queue."""
+        tasks = task if isinstance(task, (list, tuple)) else [task]
+
+        if len(tasks) > MAX_TASKS_PER_ADD:
+            raise TooManyTasksError(
+                'No more than %d tasks can be added in a single call.' %
+                (MAX_TASKS_PER_ADD,))
+
+        names = [t.name for t in tasks if t.name]
+        if len(names) != len(set(names)):
+            raise DuplicateTaskNameError(
+                'The same task name was used more than once in a batch.')
+
+        error = None
+
+        with self._condition:
+            queue = self._get_queue(queue_name)
+
+            for t in tasks:
+                if t.was_enqueued:
+                    raise BadTaskStateError('Task has already been added.')
+
+                if transactional:
+                    error = error or _check_name(queue, t)
+
+            if error:
+                raise error
+
+            for t in tasks:
+                task_error = _check_name(queue, t)
+                if task_error:
+                    error = error or task_error
+                    continue
+
+                # Only user named tasks can collide, so only they need to be
+                # remembered once they have run.
+                if t.name:
+                    queue.names.add(t.name)
+                else:
+                    t.name = 'task%d' % (next(self._sequence),)
+
+                queue.tasks[t.name] = t
+                queue.push_entry(t, next(self._sequence))
+                t._enqueued = True
+
+            self._condition.notify_all()
+
+        if error:
+            raise error
+
+        return task
+
+    def lease(self, queue_name, lease_seconds, max_tasks, tag=None,
+              group_by_tag=False):
+        """Lease up to max_tasks ready pull tasks from the named queue."""
+        now = time.time()
+        leased = []
+
+        with self._condition:
+            queue = self._get_queue(queue_name)
+
+            if group_by_tag and tag is None:
+                tag = _oldest_ready_tag(queue, now)
+
+            if group_by_tag:
+                heaps = [queue.pull.get(tag, [])]
+            else:
+                heaps = queue.pull.values()
+
+            for heap in heaps:
+                while heap and len(leased) < max_tasks:
+                    eta, _, task = heap[0]
+                    if _is_stale(eta, task):
+                        heapq.heappop(heap)
+                        continue
+
+                    if eta > now:
+                        break
+
+                    heapq.heappop(heap)
+                    leased.append(task)
+
+            for task in leased:
+                task.retry_count += 1
+                task._eta_posix = now + lease_seconds
+                queue.push_entry(task, next(self._sequence))
+
+        leased.sort(key=lambda leased_task: leased_task.eta_posix)
+        return leased
+
+    def modify_lease(self, queue_name, task, lease_seconds):
+        """Set the lease on a leased task to expire lease_seconds from now."""
+        with self._condition:
+            queue = self._get_queue(queue_name)
+
+            if task.was_deleted or task.name not in queue.tasks:
+                raise BadTaskStateError('Task is not leased.')
+
+            task._eta_posix = time.time() + lease_seconds
+            queue.push_entry(task, next(self._sequence))
+
+    def delete(self, queue_name, task):
+        """Delete a task, or list of tasks, from the named queue."""
+        tasks = task if isinstance(task, (list, tuple)) else [task]
+
+        with self._condition:
+            queue = self._get_queue(queue_name)
+
+            for t in tasks:
+                queue.tasks.pop(t.name, None)
+                t._deleted = True
+
+        return task
+
+    def delete_by_name(self, queue_name, task_name):
+        """Delete a task, or list of tasks, from the named queue by name."""
+        names = (task_name if isinstance(task_name, (list, tuple))
+                 else [task_name])
+
+        with self._condition:
+            queue = self._get_queue(queue_name)
+
+            for name in names:
+                task = queue.tasks.pop(name, None)
+                if task:
+                    task._deleted = True
+
+    def statistics(self, queue_name):
+        """Return QueueStatistics for the named queue."""
+        with self._condition:
+            queue = self._get_queue(queue_name)
+            tasks = queue.tasks.values()
+
+        oldest_eta_usec = None
+        if tasks:
+            oldest_eta_usec = int(
+                min(task.eta_posix for task in tasks) * 1e6)
+
+        return QueueStatistics(queue_name, len(tasks), oldest_eta_usec)
+
+    def purge(self, queue_name=None):
+        """Remove all tasks from the named queue, or from every queue."""
+        with self._condition:
+            names = [queue_name] if queue_name else self._queues.keys()
+
+            for name in names:
+                queue = self._queues.pop(name, None)
+                if not queue:
+                    continue
+
+                for task in queue.tasks.itervalues():
+                    task._deleted = True
+
+            self._condition.notify_all()
+
+    def run(self, queue_names=None, max_tasks=None, ignore_eta=False,
+            max_wait=DEFAULT_MAX_WAIT):
+        """Run push tasks inline until the queues are drained or max_tasks
+        tasks have run.  Delayed tasks are run immediately if ignore_eta is
+        set, otherwise those ready within max_wait seconds are waited for, or
+        every delayed task if max_wait is None.  Returns the number of tasks
+        run.
+        """
+        processed = 0
+
+        while max_tasks is None or processed < max_tasks:
+            with self._condition:
+                queue, task, wait = self._next_push_task(
+                    queue_names, ignore_eta)
+
+            if wait is not None:
+                if max_wait is not None and wait > max_wait:
+                    break
+
+                time.sleep(wait)
+                continue
+
+            if not task:
+                break
+
+            self._execute(queue, task)
+            processed += 1
+
+        return processed
+
+    def start(self, workers=DEFAULT_WORKERS, queue_names=None):
+        """Start a pool of worker threads that run push tasks as they become
+        ready.
+        """
+        with self._condition:
+            if self._running:
+                return
+
+            self._running = True
+
+        for _ in xrange(workers):
+            worker = threading.Thread(target=self._work, args=(queue_names,))
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+
+    def join(self, timeout=None, max_wait=DEFAULT_MAX_WAIT):
+        """Wait until no push tasks are running, or queued to be ready within
+        max_wait seconds, or at all if max_wait is None.  Returns False if the
+        timeout expired first.
+        """
+        end = time.time() + timeout if timeout is not None else None
+
+        with self._condition:
+            while self._in_flight or self._has_push_tasks(max_wait):
+                remaining = None
+                if end is not None:
+                    remaining = end - time.time()
+                    if remaining <= 0:
+                        return False
+
+                self._condition.wait(remaining)
+
+        return True
+
+    def stop(self):
+        """Stop the worker threads once their current tasks complete."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+
+        for worker in self._workers:
+            worker.join()
+
+        self._workers = []
+
+    def _work(self, queue_names):
+        while True:
+            with self._condition:
+                while self._running:
+                    queue, task, wait = self._next_push_task(queue_names)
+                    if task:
+                        break
+
+                    self._condition.wait(wait)
+
+                if not self._running:
+                    return
+
+            self._execute(queue, task)
+
+    def _next_push_task(self, queue_names=None, ignore_eta=False):
+        """Pop the push task with the earliest ETA.  Must be called holding
+        the condition.  Returns a (queue, task, wait) tuple; wait is the number
+        of seconds until the next delayed task is ready.
+        """
+        now = time.time()
+        best_entry = best_queue = None
+
+        for queue in self._queues.values():
+            if queue_names and queue.name not in queue_names:
+                continue
+
+            heap = queue.push
+            while heap and _is_stale(*heap[0][::2]):
+                heapq.heappop(heap)
+
+            if heap and (not best_entry or heap[0] < best_entry):
+                best_entry, best_queue = heap[0], queue
+
+        if not best_entry:
+            return None, None, None
+
+        eta = best_entry[0]
+        if eta > now and not ignore_eta:
+            return None, None, eta - now
+
+        _, _, task = heapq.heappop(best_queue.push)
+        self._in_flight += 1
+
+        return best_queue, task, None
+
+    def _has_push_tasks(self, max_wait=None):
+        """Return whether a push task is queued to be ready within max_wait
+        seconds, or at all if max_wait is None.  Must be called holding the
+        condition.
+        """
+        ready_by = time.time() + max_wait if max_wait is not None else None
+
+        for queue in self._queues.itervalues():
+            heap = queue.push
+            while heap and _is_stale(*heap[0][::2]):
+                heapq.heappop(heap)
+
+            if heap and (ready_by is None or heap[0][0] <= ready_by):
+                return True
+
+        return False
+
+    def _execute(self, queue, task):
+        """Run a push task, rescheduling it with backoff if it fails and has
+        retries remaining.
+        """
+        try:
+            self.handler(queue.name, task)
+        except Exception:
+            logging.exception('Local task %s failed.', task.name)
+
+            if _can_retry(task):
+                with self._condition:
+                    task.retry_count += 1
+                    task._eta_posix = time.time() + _get_backoff(task)
+                    queue.push_entry(task, next(self._sequence))
+            else:
+                self._finish(queue, task)
+        else:
+            self._finish(queue, task)
+        finally:
+            with self._condition:
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def _finish(self, queue, task):
+        with self._condition:
+            queue.tasks.pop(task.name, None)
+            task._deleted = True
+
+
+def _handle_furious_task(queue_name, task):
+    """Run a furious push task through process_async_task."""
+    from furious.async import ASYNC_ENDPOINT
+    from furious.context._local import _swap_context
+    from furious.handlers import process_async_task
+
+    if not (task.url or '').startswith(ASYNC_ENDPOINT):
+        logging.warning('Dropping non-furious local task %s to %s.',
+                        task.name, task.url)
+        return
+
+    headers = dict(task.headers)
+    headers.update({
+        'X-Appengine-Queuename': queue_name,
+        'X-Appengine-Taskname': task.name,
+        'X-Appengine-Taskretrycount': str(task.retry_count),
+        'X-Appengine-Taskexecutioncount': str(task.retry_count),
+        'X-Appengine-Tasketa': str(task.eta_posix)
+    })
+
+    # Each task should look like it is running in a new request, without
+    # disturbing the context of the thread running it, which may be the
+    # caller of LocalQueueEngine.run.
+    caller_context = _swap_context()
+
+    try:
+        process_async_task(headers, task.payload)
+    finally:
+        _swap_context(caller_context)
+
+
+def _check_name(queue, task):
+    """Return the error adding task to queue would raise, if any."""
+    if not task.name or task.name not in queue.names:
+        return None
+
+    if task.name in queue.tasks:
+        return TaskAlreadyExistsError(task.name)
+
+    return TombstonedTaskError(task.name)
+
+
+def _is_stale(eta, task):
+    return task.was_deleted or eta != task.eta_posix
+
+
+def _oldest_ready_tag(queue, now):
+    """Return the tag of the oldest ready pull task in queue."""
+    oldest = None
+
+    for tag, heap in queue.pull.iteritems():
+        while heap and _is_stale(*heap[0][::2]):
+            heapq.heappop(heap)
+
+        if heap and heap[0][0] <= now and (not oldest or heap[0] < oldest):
+            oldest = heap[0]
+
+    return oldest[2].tag if oldest else None
+
+
+def _can_retry(task):
+    retry_options = task.retry_options
+    if not retry_options or retry_options.task_retry_limit is None:
+        return True
+
+    return task.retry_count < retry_options.task_retry_limit
+
+
+def _get_backoff(task):
+    retry_options = task.retry_options or TaskRetryOptions()
+    min_backoff = (retry_options.min_backoff_seconds or
+                   DEFAULT_MIN_BACKOFF_SECONDS)
+    max_backoff = (retry_options.max_backoff_seconds or
+                   DEFAULT_MAX_BACKOFF_SECONDS)
+
+    return min(min_backoff * 2 ** task.retry_count, max_backoff)
+
+
+def _get_eta_posix(eta=None, countdown=None):
+    """Convert an eta datetime or countdown into a posix timestamp.  Naive
+    datetimes are treated as UTC, as App Engine does.
+    """
+    if eta:
+        if eta.tzinfo:
+            return calendar.timegm(eta.utctimetuple())
+
+        return calendar.timegm(eta.timetuple())
+
+    return time.time() + (countdown or 0)
+
+
+def get_engine():
+    """Return the process-wide LocalQueueEngine."""
+    return _engine
+
+
+def reset_engine(handler=None):
+    """Replace the process-wide LocalQueueEngine with a fresh one."""
+    global _engine
+
+    _engine.stop()
+    _engine = LocalQueueEngine(handler=handler)
+
+    return _engine
+
+
+_engine = LocalQueueEngine()
@@ -20,15 +20,21 @@ import time
 import logging
 
 from furious.async import async_from_options
+from furious.encoding import decode_payload
+from furious.metrics import get_recorder
 from furious import context
 from furious.processors import run_job
 
 
 def process_async_task(headers, request_body):
     """Process an Async task and execute the requested function."""
-    async_options = json.loads(request_body)
+    start = time.time()
+
+    async_options = decode_payload(request_body)
     async = async_from_options(async_options)
 
+    _record_task_metrics(headers, async.function_path, time.time() - start)
+
     _log_task_info(headers)
     logging.info(async._function_path)
 
@@ -51,3 +57,22 @@ def _log_task_info(headers):
     }
 
     logging.debug('TASK-INFO: %s', json.dumps(task_info))
+
+
+def _record_task_metrics(headers, function_path, decode_time):
+    """Record the decode time, queue latency and retries of a task."""
+    recorder = get_recorder()
+
+    recorder.timing('decode', function_path, decode_time)
+    recorder.increment('executions', function_path)
+
+    task_eta = float(headers.get('X-Appengine-Tasketa', 0.0))
+    if task_eta:
+        recorder.timing('queue_latency', function_path,
+                        time.time() - task_eta)
+
+    # The header counts every previous attempt, so each retried execution
+    # only adds one retry.
+    retry_count = int(headers.get('X-Appengine-Taskretrycount', 0) or 0)
+    if retry_count:
+        recorder.increment('retries', function_path)
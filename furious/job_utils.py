@@ -18,9 +18,27 @@
 Functions to help with encoding and decoding job information.
 """
 
+import re
+import threading
+
+from collections import OrderedDict
+
 from furious import errors
 
 
+# The number of resolved object paths kept by path_to_reference, and of
+# validated paths kept by reference_to_path.
+REFERENCE_CACHE_SIZE = 1024
+
+_PATH_PATTERN = re.compile(r'^[^\d\W]([a-zA-Z._]|((?<!\.)\d))+$')
+
+# Maps an object path to the module, or class, containing the object.  The
+# object itself is looked up on every call, so patching it still works.
+_container_cache = OrderedDict()
+_valid_paths = OrderedDict()
+_cache_lock = threading.Lock()
+
+
 def get_function_path_and_options(function):
     """Validates `function` is a potentially valid path or reference to
     a function and returns the cleansed path to the function.
@@ -44,11 +62,15 @@ def reference_to_path(reference):
     # Try to pop the options off whatever they passed in.
     if isinstance(reference, basestring):
         # This is an object path name in str form.
-        import re
-        if not re.match(r'^[^\d\W]([a-zA-Z._]|((?<!\.)\d))+$', reference):
+        if reference in _valid_paths:
+            return reference
+
+        if not _PATH_PATTERN.match(reference):
             raise errors.BadObjectPathError(
                 'Invalid reference path, must meet Python\'s identifier '
                 'requirements, passed value was "%s".', reference)
+
+        _cache_put(_valid_paths, reference, True)
         return reference
 
     if callable(reference):
@@ -107,14 +129,10 @@ def path_to_reference(path):
 
     module_path, function_name = path.rsplit('.', 1)
 
-    try:
-        module = __import__(name=module_path,
-                            fromlist=[function_name])
-    except ImportError:
-        module_path, class_name = module_path.rsplit('.', 1)
-
-        module = __import__(name=module_path, fromlist=[class_name])
-        module = getattr(module, class_name)
+    module = _container_cache.get(path)
+    if module is None:
+        module = _import_container(module_path, function_name)
+        _cache_put(_container_cache, path, module)
 
     try:
         return getattr(module, function_name)
@@ -123,6 +141,40 @@ def path_to_reference(path):
             'Unable to find function "%s".' % (path,))
 
 
+def _import_container(module_path, function_name):
+    """Import and return the module, or class, holding function_name."""
+    try:
+        return __import__(name=module_path, fromlist=[function_name])
+    except ImportError:
+        module_path, class_name = module_path.rsplit('.', 1)
+
+        module = __import__(name=module_path, fromlist=[class_name])
+        return getattr(module, class_name)
+
+
+def _cache_put(cache, key, value):
+    """Add key to a bounded cache, evicting the oldest entries when full."""
+    with _cache_lock:
+        cache[key] = value
+
+        while len(cache) > REFERENCE_CACHE_SIZE:
+            cache.popitem(last=False)
+
+
+def clear_reference_cache(path=None):
+    """Forget the resolved containers for path, or for every path if none is
+    given.  Call this after reloading or replacing a module so its objects
+    are resolved again.
+    """
+    with _cache_lock:
+        if path is None:
+            _container_cache.clear()
+            _valid_paths.clear()
+            return
+
+        _container_cache.pop(str(path), None)
+
+
 def encode_callbacks(callbacks):
     """Encode callbacks to as a dict suitable for JSON encoding."""
     from furious.async import Async
@@ -0,0 +1,225 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+"""Per function path metrics for executed Async tasks.
+
+The recorder is selected with `metrics` in furious.yaml, either `null` (the
+default), `memory`, or the path to a recorder class.  A recorder implements:
+
+    timing(name, function_path, seconds)
+    increment(name, function_path, value=1)
+
+Task processing records the `decode`, `execute`, `callbacks` and
+`completion_check` timings, and `queue_latency`, with `executions`, `errors`
+and `retries` counts.
+
+The MemoryRecorder aggregates counts and timing histograms in memory, and
+hands them to its flush handler, logging them by default, once per flush
+interval:
+
+    recorder = get_recorder()
+    recorder.slowest('execute')
+"""
+import json
+import logging
+import threading
+import time
+
+from contextlib import contextmanager
+
+
+# Upper bounds, in seconds, of the timing histogram buckets.
+HISTOGRAM_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60,
+                     float('inf'))
+
+DEFAULT_FLUSH_INTERVAL = 60
+
+_recorder = None
+
+
+class NullRecorder(object):
+    """Discards all metrics."""
+
+    def timing(self, name, function_path, seconds):
+        pass
+
+    def increment(self, name, function_path, value=1):
+        pass
+
+
+class Histogram(object):
+    """Count, total, min, max and bucketed distribution of timings."""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+        self.buckets = [0] * len(HISTOGRAM_BUCKETS)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.min = seconds if self.min is None else min(self.min, seconds)
+        self.max = seconds if self.max is None else max(self.max, seconds)
+
+        for index, bound in enumerate(HISTOGRAM_BUCKETS):
+            if seconds <= bound:
+                self.buckets[index] += 1
+                break
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def to_dict(self):
+        return {
+            'count': self.count,
+            'total': self.total,
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'buckets': dict(
+                (str(bound), count)
+                for bound, count in zip(HISTOGRAM_BUCKETS, self.buckets)
+                if count)
+        }
+
+
+def log_metrics(metrics):
+    """The default flush handler, logs the metrics as a JSON line."""
+    logging.info('FURIOUS-METRICS: %s', json.dumps(metrics))
+
+
+class MemoryRecorder(object):
+    """Aggregates metrics in memory, per name and function path."""
+
+    def __init__(self, flush_interval=DEFAULT_FLUSH_INTERVAL,
+                 flush_handler=log_metrics):
+        self.flush_interval = flush_interval
+        self.flush_handler = flush_handler
+
+        self._lock = threading.Lock()
+        self._timings = {}
+        self._counters = {}
+        self._last_flush = time.time()
+
+    def timing(self, name, function_path, seconds):
+        with self._lock:
+            histogram = self._timings.get((name, function_path))
+            if not histogram:
+                histogram = self._timings[(name, function_path)] = Histogram()
+
+            histogram.add(seconds)
+
+        self._maybe_flush()
+
+    def increment(self, name, function_path, value=1):
+        with self._lock:
+            key = (name, function_path)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+        self._maybe_flush()
+
+    def snapshot(self):
+        """Return the aggregated metrics as a dict keyed by function path,
+        then metric name.
+        """
+        with self._lock:
+            return _metrics_by_path(self._timings, self._counters)
+
+    def flush(self):
+        """Return the aggregated metrics, and reset the aggregates."""
+        with self._lock:
+            timings, self._timings = self._timings, {}
+            counters, self._counters = self._counters, {}
+            self._last_flush = time.time()
+
+        # Metrics are only added under the lock, so once swapped out the old
+        # aggregates are no longer updated.
+        return _metrics_by_path(timings, counters)
+
+    def slowest(self, name='execute', limit=10):
+        """Return up to limit (function path, histogram dict) pairs with the
+        highest mean timing for name.
+        """
+        with self._lock:
+            timings = [(path, histogram.to_dict())
+                       for (timing, path), histogram
+                       in self._timings.iteritems() if timing == name]
+
+        timings.sort(key=lambda timing: timing[1]['mean'], reverse=True)
+
+        return timings[:limit]
+
+    def _maybe_flush(self):
+        """Flush to the flush handler once the flush interval has passed."""
+        if not self.flush_handler or not self.flush_interval:
+            return
+
+        if time.time() - self._last_flush < self.flush_interval:
+            return
+
+        metrics = self.flush()
+        if metrics:
+            self.flush_handler(metrics)
+
+
+def get_recorder():
+    """Return the configured metrics recorder, creating it on first use."""
+    global _recorder
+
+    if _recorder is None:
+        from furious.config import get_metrics_recorder
+
+        _recorder = get_metrics_recorder()()
+
+    return _recorder
+
+
+def reset_recorder(recorder=None):
+    """Replace the metrics recorder, or recreate the configured one on next
+    use if none is given.
+    """
+    global _recorder
+
+    _recorder = recorder
+
+
+@contextmanager
+def timer(name, function_path):
+    """Record the time spent in the with block."""
+    start = time.time()
+
+    try:
+        yield
+    finally:
+        get_recorder().timing(name, function_path, time.time() - start)
+
+
+def _metrics_by_path(timings, counters):
+    """Return the timings and counters as a dict keyed by function path, then
+    metric name.
+    """
+    metrics = {}
+
+    for (name, path), histogram in timings.iteritems():
+        metrics.setdefault(path, {})[name] = histogram.to_dict()
+
+    for (name, path), count in counters.iteritems():
+        metrics.setdefault(path, {})[name] = count
+
+    return metrics
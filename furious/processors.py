@@ -28,6 +28,8 @@ from furious.context import get_current_async
 from furious.errors import Abort
 from furious.errors import AbortAndRestart
 from furious.job_utils import path_to_reference
+from furious.metrics import get_recorder
+from furious.metrics import timer
 
 
 AsyncException = namedtuple('AsyncException', 'error args traceback exception')
@@ -54,7 +56,9 @@ def run_job():
 
     try:
         async.executing = True
-        async.result = AsyncResult(payload=function(*args, **kwargs),
+        with timer('execute', function_path):
+            payload = function(*args, **kwargs)
+        async.result = AsyncResult(payload=payload,
                                    status=AsyncResult.SUCCESS)
     except Abort as abort:
         logging.info('Async job was aborted: %r', abort)
@@ -62,17 +66,22 @@ def run_job():
 
         # QUESTION: In this eventuality, we should probably tell the context we
         # are "complete" and let it handle completion checking.
-        _handle_context_completion_check(async)
+        with timer('completion_check', function_path):
+            _handle_context_completion_check(async)
         return
     except AbortAndRestart as restart:
         logging.info('Async job was aborted and restarted: %r', restart)
         raise
     except Exception as e:
+        get_recorder().increment('errors', function_path)
         async.result = AsyncResult(payload=encode_exception(e),
                                    status=AsyncResult.ERROR)
 
-    _handle_results(async_options)
-    _handle_context_completion_check(async)
+    with timer('callbacks', function_path):
+        _handle_results(async_options)
+
+    with timer('completion_check', function_path):
+        _handle_context_completion_check(async)
 
 
 def _handle_results(options):
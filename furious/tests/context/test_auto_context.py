@@ -114,6 +114,25 @@ class TestAutoContextTestCase(unittest.TestCase):
         tasks_added = queue_add_mock.call_args[0][0]
         self.assertEqual(3, len(tasks_added))
 
+    @patch('google.appengine.api.taskqueue.Queue.add', auto_spec=True)
+    def test_map_jobs_inserted_in_batches(self, queue_add_mock):
+        """Ensure mapping more jobs than the batch_size inserts them as soon
+        as they are mapped, and the rest when the context exits.
+        """
+        from furious.context.auto_context import AutoContext
+
+        with AutoContext(2) as ctx:
+            ctx.map('test', [[1], [2], [3]])
+
+            self.assertEqual(2, queue_add_mock.call_count)
+
+            ctx.map('test', [[4]])
+
+            self.assertEqual(2, queue_add_mock.call_count)
+
+        self.assertEqual(3, queue_add_mock.call_count)
+        self.assertEqual(4, ctx.insert_success)
+
     @patch('google.appengine.api.taskqueue.Queue.add', auto_spec=True)
     def test_no_jobs(self, queue_add_mock):
         """When no Asyncs are added to the context, ensure that there are no
@@ -267,6 +267,128 @@ class TestContext(unittest.TestCase):
         self.assertEqual(2, ctx.insert_success)
         self.assertEqual(1, ctx.insert_failed)
 
+    @patch('google.appengine.api.taskqueue.Queue.add', auto_spec=True)
+    def test_map_jobs_to_context(self, queue_add_mock):
+        """Ensure map adds a task per set of args and returns their ids."""
+        from furious.context import Context
+
+        with Context() as ctx:
+            task_ids = ctx.map('test', [[1, 2], (3, 4), 5])
+
+        self.assertEqual(3, len(set(task_ids)))
+        self.assertEqual(task_ids, ctx.task_ids)
+        queue_add_mock.assert_called_once()
+        self.assertEqual(3, len(queue_add_mock.call_args[0][0]))
+        self.assertEqual(3, ctx.insert_success)
+
+    @patch('google.appengine.api.taskqueue.Queue.add', auto_spec=True)
+    def test_map_payloads_match_add(self, queue_add_mock):
+        """Ensure mapped tasks decode to the same Async options as tasks for
+        jobs added individually.
+        """
+        import json
+
+        from furious.context import Context
+
+        with Context(id='ctx') as ctx:
+            added = ctx.add('test', args=[1, 2], kwargs={'a': 1}, queue='Q')
+            task_ids = ctx.map('test', [[1, 2]], kwargs={'a': 1}, queue='Q')
+
+        added_task, mapped_task = queue_add_mock.call_args[0][0]
+
+        added_options = json.loads(added_task.payload)
+        mapped_options = json.loads(mapped_task.payload)
+
+        self.assertEqual(added.id, added_options.pop('id'))
+        self.assertEqual(task_ids[0], mapped_options.pop('id'))
+
+        # Outside of a request each Async gets a random parent id.
+        del added_options['parent_id']
+        del mapped_options['parent_id']
+
+        self.assertEqual(added_options, mapped_options)
+        self.assertEqual(added_task.url, mapped_task.url)
+
+    @patch('google.appengine.api.taskqueue.Queue.add', auto_spec=True)
+    def test_map_tasks_decode_to_asyncs(self, queue_add_mock):
+        """Ensure mapped tasks can be decoded back into Asyncs."""
+        import json
+
+        from furious.async import async_from_options
+        from furious.context import Context
+
+        with Context() as ctx:
+            task_ids = ctx.map('test', [[1, 2], [3]], kwargs={'a': 1})
+
+        asyncs = [async_from_options(json.loads(task.payload))
+                  for task in queue_add_mock.call_args[0][0]]
+
+        self.assertEqual(task_ids, [async.id for async in asyncs])
+        self.assertEqual([('test', [1, 2], {'a': 1}), ('test', [3], {'a': 1})],
+                         [tuple(async.job) for async in asyncs])
+        self.assertEqual([ctx.id, ctx.id],
+                         [async.get_options()['_context_id']
+                          for async in asyncs])
+
+    @patch('furious.config.get_completion_shard_count', Mock(return_value=4))
+    @patch('google.appengine.api.taskqueue.Queue.add', auto_spec=True)
+    def test_tasks_carry_completion_shards(self, queue_add_mock):
+        """Ensure added and mapped tasks carry the context's completion
+        shards, and the context keeps them.
+        """
+        import json
+
+        from furious.async import async_from_options
+        from furious.context import Context
+        from furious.extras.appengine import ndb_persistence
+
+        with Context(persistence_engine=ndb_persistence) as ctx:
+            ctx.add('test')
+            ctx.map('test', [[1]])
+
+        asyncs = [async_from_options(json.loads(task.payload))
+                  for task in queue_add_mock.call_args[0][0]]
+
+        self.assertEqual([4, 4], [async.get_options()['_completion_shards']
+                                  for async in asyncs])
+        self.assertEqual(4, ctx.to_dict()['_completion_shards'])
+
+    @patch('google.appengine.api.taskqueue.Queue.add', auto_spec=True)
+    def test_tasks_without_completion_shards(self, queue_add_mock):
+        """Ensure tasks don't carry completion shards when none are
+        configured.
+        """
+        import json
+
+        from furious.context import Context
+        from furious.extras.appengine import ndb_persistence
+
+        with Context(persistence_engine=ndb_persistence) as ctx:
+            ctx.add('test')
+
+        options = json.loads(queue_add_mock.call_args[0][0][0].payload)
+
+        self.assertNotIn('_completion_shards', options)
+
+    def test_map_rejects_task_names(self):
+        """Ensure mapped jobs can not share a task name."""
+        from furious.context import Context
+
+        ctx = Context()
+
+        self.assertRaises(ValueError, ctx.map, 'test', [[1]],
+                          task_args={'name': 'same'})
+
+    def test_map_after_insert_raises(self):
+        """Ensure jobs can not be mapped into a started context."""
+        from furious.context import Context
+        from furious.errors import ContextAlreadyStartedError
+
+        ctx = Context()
+        ctx._tasks_inserted = True
+
+        self.assertRaises(ContextAlreadyStartedError, ctx.map, 'test', [[1]])
+
     def test_to_dict(self):
         """Ensure to_dict returns a dictionary representation of the Context.
         """
@@ -682,6 +804,115 @@ class TestInsertTasks(unittest.TestCase):
         self.assertEqual(1, inserted)
 
 
+class TestInsertTasksPipelined(unittest.TestCase):
+    """Test that _insert_tasks_pipelined behaves as expected."""
+    def setUp(self):
+        harness = testbed.Testbed()
+        harness.activate()
+        harness.init_taskqueue_stub()
+
+    @patch('google.appengine.api.taskqueue.Queue.add_async', auto_spec=True)
+    def test_batches_are_inserted(self, add_async_mock):
+        """Ensure each batch is inserted into its queue and counted."""
+        from furious.context.context import _insert_tasks_pipelined
+
+        batches = [('A', ['a1', 'a2']), ('B', ['b1'])]
+
+        results = list(_insert_tasks_pipelined(batches, 2))
+
+        self.assertEqual([(['a1', 'a2'], 2), (['b1'], 1)], results)
+        self.assertEqual([call(['a1', 'a2'], transactional=False),
+                          call(['b1'], transactional=False)],
+                         add_async_mock.call_args_list)
+
+    @patch('google.appengine.api.taskqueue.Queue.add_async', auto_spec=True)
+    def test_in_flight_rpcs_are_limited(self, add_async_mock):
+        """Ensure no more than concurrency RPCs are in flight at once."""
+        from furious.context.context import _insert_tasks_pipelined
+
+        events = []
+
+        def add_async(tasks, transactional=False):
+            events.append(('add', tasks[0]))
+
+            rpc = Mock()
+            rpc.get_result.side_effect = lambda: events.append(
+                ('wait', tasks[0]))
+            return rpc
+
+        add_async_mock.side_effect = add_async
+
+        batches = [('A', [i]) for i in xrange(4)]
+
+        list(_insert_tasks_pipelined(batches, 2))
+
+        self.assertEqual([('add', 0), ('add', 1), ('wait', 0), ('add', 2),
+                          ('wait', 1), ('add', 3), ('wait', 2), ('wait', 3)],
+                         events)
+
+    @patch('google.appengine.api.taskqueue.Queue.add', auto_spec=True)
+    @patch('google.appengine.api.taskqueue.Queue.add_async', auto_spec=True)
+    def test_failed_batches_get_split(self, add_async_mock, queue_add_mock):
+        """Ensure a batch that hits a TaskAlreadyExistsError is split and only
+        the tasks that were not enqueued are reinserted.
+        """
+        from furious.context.context import _insert_tasks_pipelined
+        from google.appengine.api import taskqueue
+
+        add_async_mock.return_value.get_result.side_effect = (
+            taskqueue.TaskAlreadyExistsError)
+
+        tasks = [Mock(was_enqueued=True), taskqueue.Task('1'),
+                 taskqueue.Task('B')]
+
+        results = list(_insert_tasks_pipelined([('A', tasks)], 2))
+
+        self.assertEqual([(tasks, 3)], results)
+        self.assertEqual([call([tasks[1]], transactional=False),
+                          call([tasks[2]], transactional=False)],
+                         queue_add_mock.call_args_list)
+
+    @patch('time.sleep')
+    @patch('google.appengine.api.taskqueue.Queue.add', auto_spec=True)
+    @patch('google.appengine.api.taskqueue.Queue.add_async', auto_spec=True)
+    def test_transient_errors_get_retried(self, add_async_mock,
+                                          queue_add_mock, mock_sleep):
+        """Ensure a batch that hits a TransientError is retried once."""
+        from furious.context.context import _insert_tasks_pipelined
+        from google.appengine.api import taskqueue
+
+        add_async_mock.return_value.get_result.side_effect = (
+            taskqueue.TransientError)
+
+        tasks = [taskqueue.Task('A'), taskqueue.Task('B')]
+
+        results = list(_insert_tasks_pipelined([('A', tasks)], 2))
+
+        self.assertEqual([(tasks, 2)], results)
+        queue_add_mock.assert_called_once_with(tasks, transactional=False)
+        self.assertEqual(1, mock_sleep.call_count)
+
+    @patch('google.appengine.api.taskqueue.Queue.add_async', auto_spec=True)
+    def test_context_uses_pipelined_inserts(self, add_async_mock):
+        """Ensure a Context with insert_concurrency inserts its batches with
+        add_async and counts them.
+        """
+        from google.appengine.api import taskqueue
+        from furious.context import Context
+
+        add_async_mock.return_value.get_result.side_effect = [
+            None, taskqueue.TransientError]
+
+        with Context(insert_concurrency=4,
+                     retry_transient_errors=False) as ctx:
+            for _ in xrange(150):
+                ctx.add('test', args=[1, 2])
+
+        self.assertEqual(2, add_async_mock.call_count)
+        self.assertEqual(100, ctx.insert_success)
+        self.assertEqual(50, ctx.insert_failed)
+
+
 class TestTaskBatcher(unittest.TestCase):
 
     def test_no_tasks(self):
@@ -0,0 +1,92 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import unittest
+
+from google.appengine.api import datastore_errors
+from google.appengine.ext import testbed
+from google.appengine.datastore import datastore_stub_util
+
+from mock import patch
+
+from furious.errors import AggregateCollisionError
+
+from furious.extras.appengine.ndb_aggregate import FuriousAggregate
+from furious.extras.appengine.ndb_aggregate import NdbAggregateStore
+
+
+def _merge(aggregate, accumulator):
+    return dict((key, aggregate.get(key, 0) + accumulator.get(key, 0))
+                for key in set(aggregate) | set(accumulator))
+
+
+class NdbAggregateStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(NdbAggregateStoreTestCase, self).setUp()
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.setup_env(app_id="furious")
+
+        self.policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=self.policy)
+        self.testbed.init_memcache_stub()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+        super(NdbAggregateStoreTestCase, self).tearDown()
+
+    def test_merge_creates_aggregate(self):
+        """Ensure merging into a missing aggregate merges into the initial
+        value and stores it.
+        """
+        store = NdbAggregateStore()
+
+        aggregate = store.merge('stats', {'red': 2}, _merge, dict)
+
+        self.assertEqual({'red': 2}, aggregate)
+        self.assertEqual({'red': 2}, FuriousAggregate.get_by_id('stats').value)
+
+    def test_merge_updates_aggregate(self):
+        """Ensure merging folds the accumulator into the stored aggregate."""
+        FuriousAggregate(id='stats', value={'red': 2, 'blue': 1}).put()
+
+        store = NdbAggregateStore()
+
+        aggregate = store.merge('stats', {'red': 3}, _merge, dict)
+
+        self.assertEqual({'red': 5, 'blue': 1}, aggregate)
+        self.assertEqual({'red': 5, 'blue': 1}, store.get('stats'))
+
+    def test_get_missing_aggregate(self):
+        """Ensure getting a missing aggregate returns None."""
+        self.assertIsNone(NdbAggregateStore().get('stats'))
+
+    @patch('furious.batcher.time')
+    def test_collisions_retried_then_raised(self, time):
+        """Ensure failed transactions are retried with backoff, then raise
+        AggregateCollisionError.
+        """
+        store = NdbAggregateStore(retries=3)
+
+        def merge(aggregate, accumulator):
+            raise datastore_errors.TransactionFailedError()
+
+        self.assertRaises(AggregateCollisionError, store.merge, 'stats',
+                          {'red': 1}, merge, dict)
+        self.assertEqual(2, time.sleep.call_count)
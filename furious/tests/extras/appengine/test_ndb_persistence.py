@@ -17,6 +17,7 @@ import json
 import os
 import unittest
 
+from google.appengine.ext import ndb
 from google.appengine.ext import testbed
 from google.appengine.datastore import datastore_stub_util
 from google.appengine.runtime.apiproxy_errors import DeadlineExceededError
@@ -34,10 +35,13 @@ from furious.processors import encode_exception
 from furious.extras.appengine.ndb_persistence import context_completion_checker
 from furious.extras.appengine.ndb_persistence import ContextResult
 from furious.extras.appengine.ndb_persistence import _completion_checker
+from furious.extras.appengine.ndb_persistence import FuriousAsyncCounted
 from furious.extras.appengine.ndb_persistence import FuriousAsyncMarker
+from furious.extras.appengine.ndb_persistence import FuriousAsyncStatus
 from furious.extras.appengine.ndb_persistence import FuriousContext
 from furious.extras.appengine.ndb_persistence import FuriousCompletionMarker
 from furious.extras.appengine.ndb_persistence import iter_context_results
+from furious.extras.appengine.ndb_persistence import record_async_completion
 from furious.extras.appengine.ndb_persistence import store_async_marker
 from furious.extras.appengine.ndb_persistence import store_async_result
 from furious.extras.appengine.ndb_persistence import store_context
@@ -120,6 +124,86 @@ class ContextCompletionCheckerTestCase(NdbTestBase):
         self.assertEqual(marker.key.id(), async.id)
         self.assertEqual(marker.status, 1)
 
+    @patch('furious.extras.appengine.ndb_persistence.record_async_completion')
+    def test_completion_persisted_result_not_rewritten(self, record):
+        """Ensure the marker isn't written again when it was stored with the
+        result.
+        """
+        async = Async('foo', persist_result=True)
+        async._executing = True
+        async._result = AsyncResult(status=1)
+        async._executed = True
+
+        context_completion_checker(async)
+
+        self.assertFalse(record.called)
+
+    @patch.object(FuriousAsyncMarker, 'get_by_id')
+    def test_completion_marker_not_read(self, get_by_id):
+        """Ensure the marker is written without reading it first."""
+        async = Async('foo')
+        async._executed = True
+
+        context_completion_checker(async)
+
+        self.assertFalse(get_by_id.called)
+
+    @patch('furious.async.Async.start', autospec=True)
+    def test_completion_check_not_coalesced(self, start):
+        """Ensure a completion check is inserted for every task by default."""
+        async = Async('foo', context_id="contextid")
+        async._executed = True
+
+        context_completion_checker(async)
+
+        check = start.call_args[0][0]
+        self.assertNotIn('name', check.get_task_args())
+
+
+@patch('time.time', Mock(return_value=1005.5))
+@patch('furious.extras.appengine.ndb_persistence.COMPLETION_CHECK_WINDOW', 10)
+class CoalescedCompletionCheckTestCase(NdbTestBase):
+
+    def test_check_named_for_window(self):
+        """Ensure the completion check is named for the context and window,
+        and delayed until the window ends.
+        """
+        from furious.extras.appengine.ndb_persistence import (
+            _completion_check_task_args)
+
+        task_args = _completion_check_task_args("contextid")
+
+        self.assertEqual({'name': "contextid-check-100", 'countdown': 5},
+                         task_args)
+
+    def test_no_context_not_coalesced(self):
+        """Ensure an Async without a context is not given a named check."""
+        from furious.extras.appengine.ndb_persistence import (
+            _completion_check_task_args)
+
+        self.assertEqual({}, _completion_check_task_args(None))
+
+    @patch('google.appengine.api.taskqueue.Queue.add')
+    def test_one_check_inserted_per_window(self, queue_add):
+        """Ensure completions within one window insert a single check, and
+        the duplicates are ignored.
+        """
+        from google.appengine.api import taskqueue
+
+        queue_add.side_effect = [None, taskqueue.TaskAlreadyExistsError]
+
+        for async_id in ("task1", "task2"):
+            async = Async('foo', id=async_id, context_id="contextid")
+            async._executed = True
+
+            self.assertTrue(context_completion_checker(async))
+
+        names = set(call[0][0].name for call in queue_add.call_args_list)
+        self.assertEqual(set(["contextid-check-100"]), names)
+
+        self.assertIsNotNone(FuriousAsyncMarker.get_by_id("task1"))
+        self.assertIsNotNone(FuriousAsyncMarker.get_by_id("task2"))
+
 
 class StoreContextTestCase(NdbTestBase):
 
@@ -140,6 +224,186 @@ class StoreContextTestCase(NdbTestBase):
         self.assertEqual(context.to_dict(), loaded_context.to_dict())
 
 
+class RecordAsyncCompletionTestCase(NdbTestBase):
+
+    def test_marker_written_with_result(self):
+        """Ensure the marker is written with the status and result, and a
+        future for the put is returned.
+        """
+        async_result = AsyncResult(payload='foo', status=AsyncResult.SUCCESS)
+
+        future = record_async_completion("asyncid", AsyncResult.SUCCESS,
+                                         async_result)
+
+        self.assertIsInstance(future, ndb.Future)
+        self.assertEqual(ndb.Key(FuriousAsyncMarker, "asyncid"),
+                         future.get_result())
+
+        marker = FuriousAsyncMarker.get_by_id("asyncid")
+
+        self.assertEqual(marker.result, json.dumps(async_result.to_dict()))
+        self.assertEqual(marker.status, AsyncResult.SUCCESS)
+
+    def test_status_written(self):
+        """Ensure the status entity is written with the marker."""
+        record_async_completion("asyncid", AsyncResult.ERROR).get_result()
+
+        status = FuriousAsyncStatus.get_by_id("asyncid")
+
+        self.assertEqual(AsyncResult.ERROR, status.status)
+        self.assertFalse(status.success)
+
+    def test_marker_written_without_result(self):
+        """Ensure the marker is written with no result if none is given."""
+        record_async_completion("asyncid", AsyncResult.ERROR).get_result()
+
+        marker = FuriousAsyncMarker.get_by_id("asyncid")
+
+        self.assertIsNone(marker.result)
+        self.assertEqual(marker.status, AsyncResult.ERROR)
+
+    def test_marker_rewritten(self):
+        """Ensure recording completion again overwrites the marker."""
+        FuriousAsyncMarker(id="asyncid", status=AsyncResult.ERROR).put()
+
+        record_async_completion("asyncid", AsyncResult.SUCCESS).get_result()
+
+        marker = FuriousAsyncMarker.get_by_id("asyncid")
+
+        self.assertEqual(marker.status, AsyncResult.SUCCESS)
+
+
+class ResultStoreTestCase(NdbTestBase):
+
+    def setUp(self):
+        super(ResultStoreTestCase, self).setUp()
+
+        import tempfile
+
+        from furious.extras.blob_store import LocalBlobStore
+        from furious.extras.appengine.ndb_persistence import ResultStore
+        from furious.extras.appengine.ndb_persistence import (
+            reset_result_store)
+
+        self.root = tempfile.mkdtemp()
+        self.blob_store = LocalBlobStore(self.root)
+        self.result_store = ResultStore(self.blob_store, inline_limit=50)
+
+        reset_result_store(self.result_store)
+
+    def tearDown(self):
+        import shutil
+
+        from furious.extras.appengine.ndb_persistence import (
+            reset_result_store)
+
+        reset_result_store()
+        shutil.rmtree(self.root)
+
+        super(ResultStoreTestCase, self).tearDown()
+
+    def test_small_result_inline(self):
+        """Ensure results within the inline limit are stored on the
+        marker.
+        """
+        async_result = AsyncResult(payload="small", status=1)
+
+        record_async_completion("asyncid", 1, async_result).get_result()
+
+        marker = FuriousAsyncMarker.get_by_id("asyncid")
+
+        self.assertEqual(json.dumps(async_result.to_dict()), marker.result)
+        self.assertIsNone(marker.result_blob)
+        self.assertIsNone(self.blob_store.get("asyncid"))
+
+    def test_large_result_in_blob_store(self):
+        """Ensure results over the inline limit are stored in the blob store,
+        and named on the marker.
+        """
+        async_result = AsyncResult(payload="x" * 100, status=1)
+
+        record_async_completion("asyncid", 1, async_result).get_result()
+
+        marker = FuriousAsyncMarker.get_by_id("asyncid")
+
+        self.assertIsNone(marker.result)
+        self.assertEqual("asyncid", marker.result_blob)
+        self.assertEqual(json.dumps(async_result.to_dict()),
+                         self.blob_store.get("asyncid"))
+        self.assertEqual(json.dumps(async_result.to_dict()),
+                         self.result_store.load(marker))
+
+    def test_large_result_inline_without_blob_store(self):
+        """Ensure large results are stored inline without a blob store."""
+        from furious.extras.appengine.ndb_persistence import ResultStore
+
+        marker = FuriousAsyncMarker(id="asyncid")
+
+        ResultStore(inline_limit=1).store(marker, '"large"')
+
+        self.assertEqual('"large"', marker.result)
+        self.assertIsNone(marker.result_blob)
+
+    def test_context_result_loads_blob_on_demand(self):
+        """Ensure ContextResult only loads a result from the blob store when
+        its payload is read.
+        """
+        record_async_completion(
+            "1", 1, AsyncResult(payload="x" * 100, status=1)).get_result()
+
+        context = Context(_task_ids=["1"])
+
+        with patch.object(self.blob_store, 'get',
+                          wraps=self.blob_store.get) as get:
+            (task_id, result), = list(ContextResult(context).stream())
+
+            self.assertFalse(get.called)
+            self.assertEqual("x" * 100, result.payload)
+
+        get.assert_called_once_with("1")
+
+    def test_cleanup_deletes_blobs(self):
+        """Ensure cleaning up the markers deletes their result blobs."""
+        from furious.extras.appengine.ndb_persistence import _cleanup_markers
+
+        record_async_completion(
+            "1", 1, AsyncResult(payload="x" * 100, status=1)).get_result()
+        record_async_completion(
+            "2", 1, AsyncResult(payload="small", status=1)).get_result()
+
+        _cleanup_markers("contextid", ["1", "2"])
+
+        self.assertIsNone(self.blob_store.get("1"))
+        self.assertIsNone(FuriousAsyncMarker.get_by_id("1"))
+        self.assertIsNone(FuriousAsyncMarker.get_by_id("2"))
+        self.assertIsNone(FuriousAsyncStatus.get_by_id("1"))
+        self.assertIsNone(FuriousAsyncStatus.get_by_id("2"))
+
+    @patch('furious.extras.appengine.ndb_persistence.CLEANUP_BATCH_SIZE', 2)
+    def test_cleanup_deletes_blobs_in_batches(self):
+        """Ensure cleaning up looks up the markers, and deletes their result
+        blobs, a batch at a time.
+        """
+        from furious.extras.appengine.ndb_persistence import _cleanup_markers
+
+        task_ids = [str(index) for index in xrange(5)]
+        for task_id in task_ids:
+            record_async_completion(
+                task_id, 1,
+                AsyncResult(payload="x" * 100, status=1)).get_result()
+
+        with patch.object(self.blob_store, 'delete',
+                          wraps=self.blob_store.delete) as delete:
+            _cleanup_markers("contextid", task_ids)
+
+        self.assertEqual([(["0", "1"],), (["2", "3"],), (["4"],)],
+                         [call[0] for call in delete.call_args_list])
+
+        for task_id in task_ids:
+            self.assertIsNone(self.blob_store.get(task_id))
+            self.assertIsNone(FuriousAsyncMarker.get_by_id(task_id))
+
+
 class StoreAsyncMarkerTestCase(NdbTestBase):
 
     def test_marker_does_not_exist(self):
@@ -150,18 +414,15 @@ class StoreAsyncMarkerTestCase(NdbTestBase):
 
         self.assertIsNotNone(FuriousAsyncMarker.get_by_id(async_id))
 
-    def test_marker_does_exist(self):
-        """Ensure the marker is not saved if it already exists."""
+    @patch.object(FuriousAsyncMarker, 'get_by_id')
+    def test_marker_not_read(self, get_by_id):
+        """Ensure the marker is written without reading it first."""
         async_id = "asyncid"
-        result = '{"foo": "bar"}'
-        FuriousAsyncMarker(id=async_id, result=result, status=1).put()
 
         store_async_marker(async_id, 1)
 
-        marker = FuriousAsyncMarker.get_by_id(async_id)
-
-        self.assertEqual(marker.result, result)
-        self.assertEqual(marker.status, 1)
+        self.assertFalse(get_by_id.called)
+        self.assertEqual(1, FuriousAsyncStatus.get_by_id(async_id).status)
 
     def test_store_async_exception(self):
         """Ensure an async exception is encoded correctly."""
@@ -241,6 +502,26 @@ class CompletionCheckerTestCase(NdbTestBase):
 
         complete_event.start.assert_called_once_with(transactional=True)
 
+    def test_legacy_markers_checked_by_marker_flag(self, context_from_id,
+                                                   check_markers):
+        """Ensure markers are only checked in place of status entities for
+        contexts stored before status entities were recorded.
+        """
+        context_from_id.return_value = Context(id="contextid",
+                                               _task_ids=["task0"])
+        check_markers.return_value = False, None
+
+        FuriousCompletionMarker(id="contextid").put()
+        _completion_checker("task1", "contextid")
+
+        FuriousCompletionMarker(id="contextid", statuses=True).put()
+        _completion_checker("task1", "contextid")
+
+        self.assertEqual(
+            [True, False],
+            [kwargs['legacy_markers']
+             for _, kwargs in check_markers.call_args_list])
+
     @patch('furious.extras.appengine.ndb_persistence._mark_context_complete')
     def test_markers_and_context_complete(self, mark, context_from_id,
                                           check_markers):
@@ -301,31 +582,264 @@ class CompletionCheckerTestCase(NdbTestBase):
         self.assertFalse(current_marker.complete)
 
 
-@patch('furious.extras.appengine.ndb_persistence.ndb.get_multi')
+@patch('furious.config.get_completion_shard_count', Mock(return_value=4))
+class CompletionCountersTestCase(NdbTestBase):
+
+    def _store_context(self, task_count, **options):
+        context = Context(id="contextid", **options)
+        context._options['_task_ids'] = ["task%d" % index
+                                         for index in xrange(task_count)]
+        store_context(context)
+
+        return context
+
+    def _count_completion(self, async_id, status=1, **options):
+        async = Async('foo', id=async_id, context_id="contextid",
+                      _completion_shards=4, **options)
+        async._executing = True
+        async.result = AsyncResult(status=status)
+
+        with patch('furious.async.Async.start'):
+            context_completion_checker(async)
+
+    def _get_shards(self):
+        from furious.extras.appengine.ndb_persistence import (
+            _completion_shard_keys)
+
+        return filter(None, ndb.get_multi(
+            _completion_shard_keys("contextid", 4)))
+
+    def test_store_context_records_shards(self):
+        """Ensure the completion marker records the shards and task count."""
+        self._store_context(3)
+
+        marker = FuriousCompletionMarker.get_by_id("contextid")
+
+        self.assertEqual(4, marker.shards)
+        self.assertEqual(3, marker.task_count)
+
+    def test_completion_counted_once(self):
+        """Ensure an Async that completes twice is only counted once."""
+        self._store_context(2)
+
+        self._count_completion("task0")
+        self._count_completion("task0")
+
+        shards = self._get_shards()
+        self.assertEqual(1, sum(shard.complete for shard in shards))
+        self.assertIsNotNone(FuriousAsyncCounted.get_by_id("task0"))
+
+    def test_retry_with_persisted_result_counted_once(self):
+        """Ensure a retried Async that persists its result, rewriting its
+        marker, is only counted once, and doesn't complete the context.
+        """
+        self._store_context(2)
+
+        self._count_completion("task0", persist_result=True)
+        self._count_completion("task0", persist_result=True)
+
+        shards = self._get_shards()
+        self.assertEqual(1, sum(shard.complete for shard in shards))
+        self.assertIsNotNone(FuriousAsyncMarker.get_by_id("task0").result)
+
+        with patch.object(FuriousContext, 'from_id') as context_from_id:
+            self.assertFalse(_completion_checker("task0", "contextid"))
+
+        self.assertFalse(context_from_id.called)
+        self.assertFalse(
+            FuriousCompletionMarker.get_by_id("contextid").complete)
+
+    def test_store_context_records_shards_on_context(self):
+        """Ensure the shards are stored with the context, so they don't
+        change with the config of the instance reading them.
+        """
+        self._store_context(2)
+
+        context = FuriousContext.from_id("contextid")
+
+        with patch('furious.config.get_completion_shard_count',
+                   Mock(return_value=0)):
+            self.assertEqual(4, context.completion_shards)
+
+    @patch.object(FuriousCompletionMarker, 'get_by_id')
+    def test_completion_marker_not_read(self, get_by_id):
+        """Ensure counting completion doesn't look up the completion marker.
+        """
+        self._store_context(2)
+
+        self._count_completion("task0")
+
+        self.assertFalse(get_by_id.called)
+        self.assertEqual(1, sum(shard.complete for shard in self._get_shards()))
+
+    def test_errors_counted(self):
+        """Ensure errored Asyncs are counted as errors."""
+        self._store_context(2)
+
+        self._count_completion("task0", status=AsyncResult.ERROR)
+        self._count_completion("task1")
+
+        shards = self._get_shards()
+        self.assertEqual(2, sum(shard.complete for shard in shards))
+        self.assertEqual(1, sum(shard.errors for shard in shards))
+
+    @patch.object(FuriousContext, 'from_id')
+    def test_checker_not_complete(self, context_from_id):
+        """Ensure the context is not complete, and is not loaded, until all
+        of its tasks are counted.
+        """
+        self._store_context(2)
+        self._count_completion("task0")
+
+        result = _completion_checker("task0", "contextid")
+
+        self.assertFalse(result)
+        self.assertFalse(context_from_id.called)
+        self.assertFalse(
+            FuriousCompletionMarker.get_by_id("contextid").complete)
+
+    @patch('furious.extras.appengine.ndb_persistence._check_markers')
+    def test_checker_complete(self, check_markers):
+        """Ensure the context is marked complete, with errors, once all of
+        its tasks are counted, without scanning the markers.
+        """
+        complete_event = Mock()
+        self._store_context(2, callbacks={'complete': Async('foo')})
+
+        self._count_completion("task0")
+        self._count_completion("task1", status=AsyncResult.ERROR)
+
+        with patch.object(FuriousContext, 'from_id') as context_from_id:
+            context_from_id.return_value = Context(
+                id="contextid", callbacks={'complete': complete_event})
+
+            with patch('furious.async.Async.start'):
+                result = _completion_checker("task1", "contextid")
+
+        self.assertTrue(result)
+        self.assertFalse(check_markers.called)
+        complete_event.start.assert_called_once_with(transactional=True)
+
+        marker = FuriousCompletionMarker.get_by_id("contextid")
+        self.assertTrue(marker.complete)
+        self.assertTrue(marker.has_errors)
+
+
 class CheckMarkersTestCase(NdbTestBase):
 
-    def test_all_markers_exist(self, get_multi):
+    def test_all_markers_exist(self):
         """Ensure True is returned when all markers exist."""
         task_ids = map(lambda x: "task" + str(x), range(11))
 
-        get_multi.side_effect = [Mock()], [Mock()]
+        ndb.put_multi([FuriousAsyncMarker(id=id, status=AsyncResult.SUCCESS)
+                       for id in task_ids])
 
-        done, has_errors = _check_markers(task_ids)
+        done, has_errors = _check_markers(task_ids, legacy_markers=True)
 
         self.assertTrue(done)
         self.assertFalse(has_errors)
 
-    def test_not_all_markers_exist(self, get_multi):
+    def test_not_all_markers_exist(self):
         """Ensure False is returned when not all markers exist."""
         task_ids = map(lambda x: "task" + str(x), range(11))
 
-        get_multi.side_effect = [Mock()], [None]
+        ndb.put_multi([FuriousAsyncMarker(id=id, status=AsyncResult.SUCCESS)
+                       for id in task_ids[1:]])
 
-        done, has_errors = _check_markers(task_ids)
+        done, has_errors = _check_markers(task_ids, offset=2,
+                                          legacy_markers=True)
 
         self.assertFalse(done)
         self.assertFalse(has_errors)
 
+    def test_statuses_read_instead_of_markers(self):
+        """Ensure the status entities are read, not the markers, when they
+        exist.
+        """
+        task_ids = map(lambda x: "task" + str(x), range(3))
+
+        ndb.put_multi([FuriousAsyncStatus(id=id, status=AsyncResult.SUCCESS)
+                       for id in task_ids])
+        FuriousAsyncStatus(id="task3", status=AsyncResult.ERROR).put()
+        task_ids.append("task3")
+
+        with patch('furious.extras.appengine.ndb_persistence.ndb.get_multi',
+                   wraps=ndb.get_multi) as get_multi:
+            done, has_errors = _check_markers(task_ids)
+
+        self.assertTrue(done)
+        self.assertTrue(has_errors)
+        self.assertFalse(get_multi.called)
+
+    def test_missing_status_falls_back_to_marker(self):
+        """Ensure Asyncs recorded without a status entity are checked by
+        their marker.
+        """
+        FuriousAsyncStatus(id="task0", status=AsyncResult.SUCCESS).put()
+        FuriousAsyncMarker(id="task1", status=AsyncResult.ERROR).put()
+
+        done, has_errors = _check_markers(["task0", "task1"],
+                                          legacy_markers=True)
+
+        self.assertTrue(done)
+        self.assertTrue(has_errors)
+
+    def test_missing_status_not_complete(self):
+        """Ensure an Async without a status entity isn't complete, and its
+        marker isn't read, unless legacy markers are checked.
+        """
+        FuriousAsyncStatus(id="task0", status=AsyncResult.SUCCESS).put()
+        FuriousAsyncMarker(id="task1", status=AsyncResult.SUCCESS).put()
+
+        with patch('furious.extras.appengine.ndb_persistence.ndb.get_multi',
+                   wraps=ndb.get_multi) as get_multi:
+            done, _ = _check_markers(["task0", "task1"])
+
+        self.assertFalse(done)
+        self.assertFalse(get_multi.called)
+
+    @patch('furious.extras.appengine.ndb_persistence.shuffle', Mock())
+    def test_errors_accumulated_across_windows(self):
+        """Ensure an error in an earlier window isn't lost by later windows
+        without errors.
+        """
+        task_ids = map(lambda x: "task" + str(x), range(6))
+
+        ndb.put_multi([FuriousAsyncMarker(id=id, status=AsyncResult.SUCCESS)
+                       for id in task_ids[1:]])
+        FuriousAsyncMarker(id=task_ids[0], status=AsyncResult.ERROR).put()
+
+        done, has_errors = _check_markers(task_ids, offset=2, in_flight=1,
+                                          legacy_markers=True)
+
+        self.assertTrue(done)
+        self.assertTrue(has_errors)
+
+    @patch('furious.extras.appengine.ndb_persistence.shuffle', Mock())
+    @patch('furious.extras.appengine.ndb_persistence.ndb.get_multi_async')
+    def test_windows_in_flight(self, get_multi_async):
+        """Ensure in_flight windows are looked up at once, and no more are
+        looked up once a marker is missing.
+        """
+        task_ids = map(lambda x: "task" + str(x), range(10))
+
+        def lookup(keys):
+            futures = [Mock() for _ in keys]
+            if keys[0].id() == "task0":
+                futures[0].get_result.return_value = None
+            return futures
+
+        get_multi_async.side_effect = lookup
+
+        done, _ = _check_markers(task_ids, offset=2, in_flight=3)
+
+        self.assertFalse(done)
+        self.assertEqual(3, get_multi_async.call_count)
+        self.assertEqual(
+            [ndb.Key(FuriousAsyncStatus, "task4"),
+             ndb.Key(FuriousAsyncStatus, "task5")],
+            get_multi_async.call_args[0][0])
+
 
 @patch('furious.extras.appengine.ndb_persistence.ndb.get_multi_async')
 class IterResultsTestCase(NdbTestBase):
@@ -400,6 +914,23 @@ class IterResultsTestCase(NdbTestBase):
         self.assertEqual(results[1], ("2", None))
         self.assertEqual(results[2], ("3", None))
 
+    def test_prefetch_looks_up_batches_ahead(self, get_multi_async):
+        """Ensure prefetch batches are looked up ahead of the batch being
+        read.
+        """
+        get_multi_async.side_effect = lambda keys: [
+            _build_future() for _ in keys]
+
+        context = Context(_task_ids=["1", "2", "3", "4"])
+
+        results = iter_context_results(context, batch_size=1, prefetch=2)
+
+        self.assertEqual(("1", None), results.next())
+        self.assertEqual(3, get_multi_async.call_count)
+
+        self.assertEqual(["2", "3", "4"], [key for key, _ in results])
+        self.assertEqual(4, get_multi_async.call_count)
+
     def test_failure_in_marker(self, get_multi_async):
         """Ensure all the results are yielded out when less than the batch
         size and a failure is included in the results.
@@ -517,6 +1048,82 @@ class ContextResultTestCase(NdbTestBase):
 
         self.assertFalse(get_multi_async.called)
 
+    @patch('furious.extras.appengine.ndb_persistence.ndb.get_multi_async')
+    def test_partial_iteration_not_served_from_cache(self, get_multi_async):
+        """Ensure results partially read before are loaded again rather than
+        served from the partial cache.
+        """
+        markers = [_build_marker(payload=str(index), status=1)
+                   for index in range(3)]
+
+        get_multi_async.side_effect = lambda keys: [
+            _build_future(markers[int(key.id())]) for key in keys]
+
+        context = Context(_task_ids=["0", "1", "2"])
+        context_result = ContextResult(context)
+        context_result.BATCH_SIZE = 1
+
+        self.assertEqual(("0", "0"), context_result.items().next())
+
+        self.assertEqual([("0", "0"), ("1", "1"), ("2", "2")],
+                         list(context_result.items()))
+
+    @patch('furious.extras.appengine.ndb_persistence.ndb.get_multi_async')
+    def test_bounded_cache(self, get_multi_async):
+        """Ensure a bounded cache keeps only the most recent markers."""
+        markers = [_build_marker(payload=str(index), status=1)
+                   for index in range(3)]
+
+        get_multi_async.return_value = [_build_future(marker)
+                                        for marker in markers]
+
+        context = Context(_task_ids=["0", "1", "2"])
+        context_result = ContextResult(context, cache_size=2)
+
+        self.assertEqual(["0", "1", "2"], list(context_result.values()))
+
+        self.assertEqual(2, len(context_result._task_cache))
+        self.assertNotIn("0", context_result._task_cache)
+
+    @patch('furious.extras.appengine.ndb_persistence.ndb.get_multi_async')
+    def test_stream_not_cached(self, get_multi_async):
+        """Ensure streamed results are decoded lazily and not cached."""
+        from furious.extras.appengine.ndb_persistence import MarkerResult
+
+        marker = FuriousAsyncMarker(
+            result=json.dumps({'payload': 'foo', 'status': 1}), status=1)
+
+        get_multi_async.return_value = [_build_future(marker)]
+
+        context = Context(_task_ids=["1"])
+        context_result = ContextResult(context)
+
+        results = list(context_result.stream())
+
+        self.assertEqual(1, len(results))
+        self.assertEqual("1", results[0][0])
+        self.assertIsInstance(results[0][1], MarkerResult)
+        self.assertEqual(1, results[0][1].status)
+        self.assertEqual('foo', results[0][1].payload)
+        self.assertEqual({}, context_result._task_cache)
+
+    def test_get_cached(self):
+        """Ensure get loads a single result, and caches it."""
+        marker = _build_marker(payload="1", status=1)
+        marker.key = ndb.Key(FuriousAsyncMarker, "1")
+        marker.put()
+
+        context = Context(_task_ids=["1"])
+        context_result = ContextResult(context)
+
+        self.assertEqual("1", context_result.get("1").payload)
+        self.assertEqual("1", context_result._task_cache["1"].key.id())
+
+        with patch.object(FuriousAsyncMarker, 'get_by_id') as get_by_id:
+            self.assertEqual("1", context_result.get("1").payload)
+
+        self.assertFalse(get_by_id.called)
+
     def test_has_errors_with_marker_not_cached(self):
         """Ensure returns the value from the marker when not cached."""
         context_id = 1
@@ -558,6 +1165,52 @@ class ContextResultTestCase(NdbTestBase):
         self.assertFalse(context_result.has_errors())
 
 
+class ResultCacheTestCase(unittest.TestCase):
+
+    def test_least_recently_used_evicted(self):
+        """Ensure the least recently used marker is evicted once full."""
+        from furious.extras.appengine.ndb_persistence import ResultCache
+
+        cache = ResultCache(2)
+        cache["1"] = 1
+        cache["2"] = 2
+
+        self.assertEqual(1, cache.get("1"))
+
+        cache["3"] = 3
+
+        self.assertEqual(2, len(cache))
+        self.assertIn("1", cache)
+        self.assertNotIn("2", cache)
+        self.assertIsNone(cache.get("2"))
+
+
+class MarkerResultTestCase(unittest.TestCase):
+
+    def test_payload_decoded_once(self):
+        """Ensure the stored result is decoded once, on first access."""
+        from furious.extras.appengine.ndb_persistence import MarkerResult
+
+        result = MarkerResult(_build_marker(payload="1", status=1))
+
+        with patch('furious.extras.appengine.ndb_persistence.json') as json_:
+            json_.loads.return_value = {'payload': 'decoded'}
+
+            self.assertEqual('decoded', result.payload)
+            self.assertEqual('decoded', result.payload)
+
+        self.assertEqual(1, json_.loads.call_count)
+
+    def test_missing_marker(self):
+        """Ensure a missing marker has no status or payload."""
+        from furious.extras.appengine.ndb_persistence import MarkerResult
+
+        result = MarkerResult(None)
+
+        self.assertIsNone(result.status)
+        self.assertIsNone(result.payload)
+
+
 def _build_marker(payload=None, status=None):
     return FuriousAsyncMarker(result=json.dumps(
         {
@@ -0,0 +1,63 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import os
+import shutil
+import tempfile
+import unittest
+
+from furious.extras.blob_store import LocalBlobStore
+
+
+class LocalBlobStoreTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(LocalBlobStoreTestCase, self).setUp()
+
+        self.root = tempfile.mkdtemp()
+        self.store = LocalBlobStore(os.path.join(self.root, 'blobs'))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+        super(LocalBlobStoreTestCase, self).tearDown()
+
+    def test_put_and_get(self):
+        """Ensure a stored blob is read back."""
+        self.store.put('asyncid', '{"payload": 1}')
+
+        self.assertEqual('{"payload": 1}', self.store.get('asyncid'))
+
+    def test_get_missing(self):
+        """Ensure a missing blob reads as None."""
+        self.assertIsNone(self.store.get('asyncid'))
+
+    def test_delete(self):
+        """Ensure deleted blobs are removed, ignoring missing blobs."""
+        self.store.put('one', '1')
+        self.store.put('two', '2')
+
+        self.store.delete(['one', 'missing'])
+
+        self.assertIsNone(self.store.get('one'))
+        self.assertEqual('2', self.store.get('two'))
+
+    def test_names_kept_in_root(self):
+        """Ensure blob names can't address files outside the root."""
+        self.store.put('../escape', 'data')
+
+        self.assertEqual(['..%2Fescape'],
+                         os.listdir(os.path.join(self.root, 'blobs')))
+        self.assertEqual('data', self.store.get('../escape'))
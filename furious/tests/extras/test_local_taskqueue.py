@@ -0,0 +1,387 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+import threading
+import unittest
+
+from mock import Mock
+from mock import patch
+
+from furious.extras import local_taskqueue
+from furious.extras.local_taskqueue import Queue
+from furious.extras.local_taskqueue import Task
+from furious.extras.local_taskqueue import TaskRetryOptions
+
+
+_calls = []
+
+
+def record_call(*args, **kwargs):
+    """Target used to ensure furious tasks are run by the local engine."""
+    _calls.append((args, kwargs))
+
+
+class LocalTaskqueueTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(LocalTaskqueueTestCase, self).setUp()
+
+        self.handler = Mock()
+        self.engine = local_taskqueue.reset_engine(handler=self.handler)
+
+    def tearDown(self):
+        self.engine.stop()
+
+        super(LocalTaskqueueTestCase, self).tearDown()
+
+
+class TestPushQueues(LocalTaskqueueTestCase):
+
+    def test_add_marks_enqueued(self):
+        """Ensure added tasks are flagged as enqueued."""
+        task = Task(url='/_ah/queue/async/foo')
+
+        Queue('q').add(task)
+
+        self.assertTrue(task.was_enqueued)
+        self.assertTrue(task.name)
+
+    def test_run_executes_tasks_in_eta_order(self):
+        """Ensure run executes each ready task once, earliest ETA first."""
+        first = Task(url='/first', countdown=-10)
+        second = Task(url='/second')
+
+        Queue('q').add([second, first])
+
+        processed = self.engine.run()
+
+        self.assertEqual(2, processed)
+        self.assertEqual([(('q', first), {}), (('q', second), {})],
+                         self.handler.call_args_list)
+
+    def test_run_ignore_eta(self):
+        """Ensure delayed tasks run immediately when ignore_eta is set."""
+        Queue('q').add(Task(url='/later', countdown=3600))
+
+        processed = self.engine.run(ignore_eta=True)
+
+        self.assertEqual(1, processed)
+
+    def test_run_leaves_tasks_delayed_past_max_wait(self):
+        """Ensure run returns rather than waiting for tasks delayed longer
+        than max_wait.
+        """
+        Queue('q').add([Task(url='/now'), Task(url='/later', countdown=3600)])
+
+        processed = self.engine.run(max_wait=1)
+
+        self.assertEqual(1, processed)
+        self.assertEqual(1, Queue('q').fetch_statistics().tasks)
+
+    def test_run_waits_for_tasks_within_max_wait(self):
+        """Ensure run waits for tasks ready within max_wait."""
+        Queue('q').add(Task(url='/soon', countdown=0.05))
+
+        processed = self.engine.run(max_wait=1)
+
+        self.assertEqual(1, processed)
+
+    def test_run_limited_by_queue_names(self):
+        """Ensure only tasks in the requested queues are run."""
+        Queue('a').add(Task(url='/a'))
+        Queue('b').add(Task(url='/b'))
+
+        processed = self.engine.run(queue_names=['b'])
+
+        self.assertEqual(1, processed)
+        self.assertEqual(1, Queue('a').fetch_statistics().tasks)
+
+    def test_duplicate_name_raises(self):
+        """Ensure adding a task with an existing name raises."""
+        Queue('q').add(Task(url='/a', name='named'))
+
+        self.assertRaises(local_taskqueue.TaskAlreadyExistsError,
+                          Queue('q').add, Task(url='/a', name='named'))
+
+    def test_tombstoned_name_raises(self):
+        """Ensure reusing the name of a task that ran raises."""
+        Queue('q').add(Task(url='/a', name='named'))
+        self.engine.run()
+
+        self.assertRaises(local_taskqueue.TombstonedTaskError,
+                          Queue('q').add, Task(url='/a', name='named'))
+
+    def test_batch_with_existing_name_adds_others(self):
+        """Ensure a non-transactional batch adds the other tasks before
+        raising, and flags which tasks were enqueued.
+        """
+        Queue('q').add(Task(url='/a', name='named'))
+
+        tasks = [Task(url='/a', name='named'), Task(url='/b')]
+
+        self.assertRaises(local_taskqueue.TaskAlreadyExistsError,
+                          Queue('q').add, tasks)
+        self.assertFalse(tasks[0].was_enqueued)
+        self.assertTrue(tasks[1].was_enqueued)
+
+    def test_add_async_defers_errors(self):
+        """Ensure add_async raises errors from get_result."""
+        Queue('q').add(Task(url='/a', name='named'))
+
+        rpc = Queue('q').add_async(Task(url='/a', name='named'))
+
+        self.assertRaises(local_taskqueue.TaskAlreadyExistsError,
+                          rpc.get_result)
+
+    def test_failed_task_is_retried(self):
+        """Ensure failing tasks are retried until the retry limit."""
+        self.handler.side_effect = Exception
+
+        task = Task(url='/a', retry_options=TaskRetryOptions(
+            task_retry_limit=2, min_backoff_seconds=0.001))
+        Queue('q').add(task)
+
+        processed = self.engine.run()
+
+        self.assertEqual(3, processed)
+        self.assertEqual(2, task.retry_count)
+        self.assertEqual(0, Queue('q').fetch_statistics().tasks)
+
+    def test_workers_drain_queues(self):
+        """Ensure the worker pool runs all tasks."""
+        # Mock's call bookkeeping isn't thread-safe, so record the runs under
+        # a lock instead.
+        lock = threading.Lock()
+        ran = []
+
+        def handler(queue_name, task):
+            with lock:
+                ran.append(task.name)
+
+        self.engine.handler = handler
+
+        tasks = [Task(url='/a') for _ in xrange(50)]
+        Queue('q').add(tasks)
+
+        self.engine.start(workers=4)
+
+        self.assertTrue(self.engine.join(timeout=10))
+        self.assertEqual(sorted(task.name for task in tasks), sorted(ran))
+
+    def test_join_leaves_tasks_delayed_past_max_wait(self):
+        """Ensure join returns once only tasks delayed longer than max_wait
+        are queued.
+        """
+        Queue('q').add([Task(url='/now'), Task(url='/later', countdown=3600)])
+
+        self.engine.start(workers=2)
+
+        self.assertTrue(self.engine.join(timeout=10, max_wait=1))
+        self.assertEqual(1, self.handler.call_count)
+
+
+class TestPullQueues(LocalTaskqueueTestCase):
+
+    def test_lease_by_tag(self):
+        """Ensure only tasks with the tag are leased, and they are hidden
+        until their lease expires.
+        """
+        queue = Queue('pull')
+        queue.add([Task(payload='1', method='PULL', tag='a'),
+                   Task(payload='2', method='PULL', tag='b'),
+                   Task(payload='3', method='PULL', tag='a')])
+
+        leased = queue.lease_tasks_by_tag(60, 10, tag='a')
+
+        self.assertEqual(['1', '3'], [task.payload for task in leased])
+        self.assertEqual([], queue.lease_tasks_by_tag(60, 10, tag='a'))
+
+    def test_lease_by_tag_without_tag_groups(self):
+        """Ensure leasing without a tag uses the oldest task's tag."""
+        queue = Queue('pull')
+        queue.add([Task(payload='1', method='PULL', tag='b', countdown=-5),
+                   Task(payload='2', method='PULL', tag='a')])
+
+        leased = queue.lease_tasks_by_tag(60, 10)
+
+        self.assertEqual(['b'], [task.tag for task in leased])
+
+    @patch('time.time')
+    def test_expired_lease_can_be_leased_again(self, time):
+        """Ensure tasks become leasable once their lease expires."""
+        time.return_value = 1000.0
+
+        queue = Queue('pull')
+        queue.add(Task(payload='1', method='PULL', tag='a'))
+        queue.lease_tasks_by_tag(60, 10, tag='a')
+
+        time.return_value = 1061.0
+
+        self.assertEqual(1, len(queue.lease_tasks_by_tag(60, 10, tag='a')))
+
+    @patch('time.time')
+    def test_modify_task_lease(self, time):
+        """Ensure modifying the lease keeps the task hidden."""
+        time.return_value = 1000.0
+
+        queue = Queue('pull')
+        queue.add(Task(payload='1', method='PULL', tag='a'))
+        task = queue.lease_tasks_by_tag(60, 10, tag='a')[0]
+
+        time.return_value = 1050.0
+        queue.modify_task_lease(task, 60)
+
+        time.return_value = 1061.0
+        self.assertEqual([], queue.lease_tasks_by_tag(60, 10, tag='a'))
+
+    def test_deleted_tasks_are_not_leased(self):
+        """Ensure deleted tasks are gone from the queue."""
+        queue = Queue('pull')
+        queue.add(Task(payload='1', method='PULL', tag='a', countdown=-1))
+        task = queue.lease_tasks_by_tag(0, 10, tag='a')[0]
+
+        queue.delete_tasks([task])
+
+        self.assertTrue(task.was_deleted)
+        self.assertEqual([], queue.lease_tasks_by_tag(60, 10, tag='a'))
+        self.assertEqual(0, queue.fetch_statistics().tasks)
+
+    def test_pull_tasks_are_not_run(self):
+        """Ensure the engine never executes pull tasks."""
+        Queue('pull').add(Task(payload='1', method='PULL', tag='a'))
+
+        self.assertEqual(0, self.engine.run())
+
+
+class TestFuriousIntegration(unittest.TestCase):
+
+    def setUp(self):
+        from furious.config import get_config
+
+        super(TestFuriousIntegration, self).setUp()
+
+        self.engine = local_taskqueue.reset_engine()
+
+        self._task_system = get_config()['task_system']
+        get_config()['task_system'] = 'local'
+
+        del _calls[:]
+
+    def tearDown(self):
+        from furious.config import get_config
+
+        get_config()['task_system'] = self._task_system
+        self.engine.stop()
+
+        super(TestFuriousIntegration, self).tearDown()
+
+    def test_task_system_is_configurable(self):
+        """Ensure the local task system is selected by name."""
+        from furious.config import get_default_task_system
+
+        self.assertEqual(local_taskqueue, get_default_task_system())
+
+    def test_async_runs_locally(self):
+        """Ensure an Async started on the local task system is run."""
+        from furious.async import Async
+
+        Async(record_call, args=[1, 2], kwargs={'a': 3}).start()
+
+        self.engine.run()
+
+        self.assertEqual([((1, 2), {'a': 3})], _calls)
+
+    def test_run_inline_keeps_callers_context(self):
+        """Ensure running tasks inline leaves the calling thread's context and
+        Async stack as they were.
+        """
+        from furious.async import Async
+        from furious.context import _local
+        from furious.context import get_current_context
+        from furious.context import new
+
+        local_context = _local.get_local_context()
+
+        with new() as ctx:
+            registry = list(local_context.registry)
+            executing = list(local_context._executing_async)
+
+            Async(record_call, args=[1]).start()
+
+            self.engine.run()
+
+            self.assertIs(local_context, _local.get_local_context())
+            self.assertIs(ctx, get_current_context())
+            self.assertEqual(registry, local_context.registry)
+            self.assertEqual(executing, local_context._executing_async)
+
+        self.assertEqual([((1,), {})], _calls)
+
+    def test_context_runs_locally(self):
+        """Ensure a Context's tasks are inserted into and run by the local
+        task system.
+        """
+        from furious.context import new
+
+        with new() as ctx:
+            for i in xrange(150):
+                ctx.add(record_call, args=[i])
+
+        self.assertEqual(150, ctx.insert_success)
+
+        self.engine.start(workers=4)
+        self.assertTrue(self.engine.join(timeout=10))
+
+        self.assertEqual(range(150), sorted(args[0] for args, _ in _calls))
+
+    def test_persisted_context_completes_locally(self):
+        """Ensure a persisted Context runs to completion, and its complete
+        callback runs, without waiting for the delayed marker cleanup.
+        """
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import ndb
+        from google.appengine.ext import testbed
+
+        from furious.async import Async
+        from furious.context import new
+        from furious.extras.appengine import ndb_persistence
+
+        bed = testbed.Testbed()
+        bed.activate()
+        self.addCleanup(bed.deactivate)
+        bed.init_memcache_stub()
+        bed.init_datastore_v3_stub(
+            consistency_policy=datastore_stub_util.
+            PseudoRandomHRConsistencyPolicy(probability=1))
+        ndb.get_context().clear_cache()
+
+        with new(persistence_engine=ndb_persistence,
+                 callbacks={'complete': Async(record_call,
+                                              args=['complete'])}) as ctx:
+            for i in xrange(3):
+                ctx.add(record_call, args=[i])
+
+        runner = threading.Thread(target=self.engine.run)
+        runner.daemon = True
+        runner.start()
+        runner.join(10)
+
+        self.assertFalse(runner.is_alive())
+
+        ndb.get_context().clear_cache()
+        self.assertEqual([0, 1, 2, 'complete'],
+                         sorted(args[0] for args, _ in _calls))
+        self.assertTrue(
+            ndb_persistence.FuriousCompletionMarker.get_by_id(ctx.id).complete)
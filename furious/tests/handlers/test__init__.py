@@ -75,3 +75,69 @@ class TestLogTaskInfo(unittest.TestCase):
             '"task_eta": 0.5, "execution_count": "yellow"}')
 
         debug_mock.assert_called_with('TASK-INFO: %s', expected_logs)
+
+
+@patch('time.time')
+class TestRecordTaskMetrics(unittest.TestCase):
+    """Ensure that _record_task_metrics records the task's metrics."""
+
+    def setUp(self):
+        from furious.metrics import MemoryRecorder
+        from furious.metrics import reset_recorder
+
+        self.recorder = MemoryRecorder(flush_handler=None)
+        reset_recorder(self.recorder)
+
+    def tearDown(self):
+        from furious.metrics import reset_recorder
+
+        reset_recorder()
+
+    def test_records_latency_and_retries(self, time_mock):
+        """Ensure the decode time, queue latency and retries are recorded."""
+        from furious import handlers
+
+        time_mock.return_value = 1.5
+        headers = {
+            'X-Appengine-Taskretrycount': '2',
+            'X-Appengine-Tasketa': '0.50'
+        }
+
+        handlers._record_task_metrics(headers, 'foo', 0.25)
+
+        metrics = self.recorder.snapshot()['foo']
+
+        self.assertEqual(0.25, metrics['decode']['total'])
+        self.assertEqual(1.0, metrics['queue_latency']['total'])
+        self.assertEqual(1, metrics['retries'])
+        self.assertEqual(1, metrics['executions'])
+
+    def test_retries_counted_per_execution(self, time_mock):
+        """Ensure a task retried several times counts one retry per retried
+        execution, not the running total of its retry count header.
+        """
+        from furious import handlers
+
+        time_mock.return_value = 1.5
+
+        for retry_count in xrange(4):
+            handlers._record_task_metrics(
+                {'X-Appengine-Taskretrycount': str(retry_count)}, 'foo', 0.25)
+
+        metrics = self.recorder.snapshot()['foo']
+
+        self.assertEqual(3, metrics['retries'])
+        self.assertEqual(4, metrics['executions'])
+
+    def test_no_headers(self, time_mock):
+        """Ensure missing headers record no latency or retries."""
+        from furious import handlers
+
+        time_mock.return_value = 1.5
+
+        handlers._record_task_metrics({}, 'foo', 0.25)
+
+        metrics = self.recorder.snapshot()['foo']
+
+        self.assertNotIn('queue_latency', metrics)
+        self.assertNotIn('retries', metrics)
@@ -961,6 +961,54 @@ class TestAsync(unittest.TestCase):
 
         self.assertEqual(async_job.to_dict(), new_async_job.to_dict())
 
+    @mock.patch('copy.deepcopy')
+    def test_encode_decode_do_not_deep_copy(self, deepcopy):
+        """Ensure encoding and decoding share the job's args rather than
+        deep copying them.
+        """
+        from furious.async import Async
+        from furious.async import decode_async_options
+        from furious.async import encode_async_options
+
+        args = [range(10)]
+        async_job = Async("something", args=args)
+
+        options = encode_async_options(async_job)
+        decoded = decode_async_options(options)
+
+        self.assertFalse(deepcopy.called)
+        self.assertIs(args, options['job'][1])
+        self.assertIs(args, decoded['job'][1])
+
+    def test_encode_eta_does_not_change_async(self):
+        """Ensure encoding an eta does not rewrite the Async's eta."""
+        import datetime
+
+        from furious.async import Async
+        from furious.async import encode_async_options
+
+        eta = datetime.datetime.now()
+        async_job = Async("something", task_args={'eta': eta})
+
+        options = encode_async_options(async_job)
+
+        self.assertIsInstance(options['task_args']['eta'], float)
+        self.assertEqual(eta, async_job.get_task_args()['eta'])
+
+    def test_decode_eta_does_not_change_options(self):
+        """Ensure decoding an eta does not rewrite the encoded options."""
+        import datetime
+
+        from furious.async import decode_async_options
+
+        options = {'job': ('something', None, None),
+                   'task_args': {'eta': 1400000000.0}}
+
+        decoded = decode_async_options(options)
+
+        self.assertIsInstance(decoded['task_args']['eta'], datetime.datetime)
+        self.assertEqual(1400000000.0, options['task_args']['eta'])
+
     def test_retry_value_is_decodable(self):
         """Ensure that from_dict is the inverse of to_dict when retry options
         are given.
@@ -1033,3 +1081,62 @@ class TestAsyncFromOptions(unittest.TestCase):
 
         self.assertIsInstance(result, MessageProcessor)
 
+
+class TestAsyncOptionsCopying(unittest.TestCase):
+    """Ensure encoding and decoding Async options do not deep copy the job's
+    args and kwargs.
+    """
+
+    def test_encode_shares_args_and_kwargs(self):
+        """Ensure encoded options share the Async's args and kwargs."""
+        from furious.async import Async
+        from furious.async import encode_async_options
+
+        async_job = Async("something", args=[['x'] * 1024],
+                          kwargs={'key': ['y'] * 1024},
+                          task_args={'countdown': 5})
+
+        options = encode_async_options(async_job)
+
+        self.assertIs(async_job._options['job'][1], options['job'][1])
+        self.assertIs(async_job._options['job'][2], options['job'][2])
+        self.assertIs(async_job._options['task_args'], options['task_args'])
+
+    def test_decode_shares_args_and_kwargs(self):
+        """Ensure decoded options share the encoded args and kwargs."""
+        from furious.async import decode_async_options
+
+        options = {'job': ("something", [['x'] * 1024],
+                           {'key': ['y'] * 1024}),
+                   'task_args': {'countdown': 5}}
+
+        async_options = decode_async_options(options)
+
+        self.assertIs(options['job'][1], async_options['job'][1])
+        self.assertIs(options['job'][2], async_options['job'][2])
+        self.assertIs(options['task_args'], async_options['task_args'])
+
+    def test_task_args_copied_with_eta(self):
+        """Ensure task_args are copied, not mutated, when an eta is encoded
+        and decoded.
+        """
+        import datetime
+
+        from furious.async import Async
+        from furious.async import decode_async_options
+        from furious.async import encode_async_options
+
+        eta = datetime.datetime(2014, 1, 1, 12, 30)
+        async_job = Async("something", task_args={'eta': eta})
+
+        options = encode_async_options(async_job)
+
+        self.assertIsNot(async_job._options['task_args'], options['task_args'])
+        self.assertEqual(eta, async_job._options['task_args']['eta'])
+
+        encoded_task_args = options['task_args']
+        async_options = decode_async_options(options)
+
+        self.assertIsNot(encoded_task_args, async_options['task_args'])
+        self.assertEqual(eta, async_options['task_args']['eta'])
+        self.assertIsInstance(encoded_task_args['eta'], float)
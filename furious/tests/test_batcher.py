@@ -1,6 +1,9 @@
 import json
 import unittest
 
+# Loaded so tests can patch the memcache module the batcher imports.
+import google.appengine.api.memcache
+
 from mock import Mock, patch
 
 
@@ -226,6 +229,47 @@ class MessageTestCase(unittest.TestCase):
         self.assertTrue(queue_mock.return_value.add.called)
 
 
+class InsertMessagesTestCase(unittest.TestCase):
+
+    @patch('google.appengine.api.taskqueue.Queue.add_async', autospec=True)
+    def test_inserts_in_batches(self, add_async):
+        """Ensure payloads are inserted as tagged pull tasks in batches of
+        100, with the inserted count reported.
+        """
+        from furious.batcher import insert_messages
+
+        result = insert_messages(({'index': index} for index in xrange(250)),
+                                 'tag', queue='pull-queue')
+
+        self.assertEqual((250, 0), result)
+        self.assertEqual(3, add_async.call_count)
+
+        queues = [call[0][0] for call in add_async.call_args_list]
+        batches = [call[0][1] for call in add_async.call_args_list]
+
+        self.assertEqual(['pull-queue'] * 3, [queue.name for queue in queues])
+        self.assertEqual([100, 100, 50], [len(batch) for batch in batches])
+
+        task = batches[2][-1]
+        self.assertEqual('{"index": 249}', task.payload)
+        self.assertEqual('tag', task.tag)
+        self.assertEqual('PULL', task.method)
+
+    @patch('furious.context.context._insert_tasks_pipelined')
+    def test_reports_failed(self, insert_tasks_pipelined):
+        """Ensure tasks that could not be inserted are reported as failed."""
+        from furious.batcher import insert_messages
+
+        insert_tasks_pipelined.side_effect = lambda batches, concurrency: (
+            (batch, len(batch) - 1) for _, batch in batches)
+
+        result = insert_messages(xrange(150), 'tag', batch_size=100,
+                                 concurrency=2)
+
+        self.assertEqual(148, result.inserted)
+        self.assertEqual(2, result.failed)
+
+
 class MessageProcessorTestCase(unittest.TestCase):
 
     def setUp(self):
@@ -234,6 +278,10 @@ class MessageProcessorTestCase(unittest.TestCase):
         import os
         import uuid
 
+        from furious.batcher import reset_batch_ids
+
+        reset_batch_ids()
+
         os.environ['REQUEST_ID_HASH'] = uuid.uuid4().hex
 
     def tearDown(self):
@@ -244,7 +292,7 @@ class MessageProcessorTestCase(unittest.TestCase):
         del os.environ['REQUEST_ID_HASH']
 
     @patch('furious.batcher.time')
-    @patch('furious.batcher.memcache')
+    @patch('google.appengine.api.memcache')
     def test_to_task_with_no_name_passed_in(self, memcache, time):
         """Ensure that if no name is passed into the MessageProcessor that it
         creates a default unique name when creating the task.
@@ -261,7 +309,7 @@ class MessageProcessorTestCase(unittest.TestCase):
         self.assertEqual(task.name, 'processor-processor-current-batch-3')
 
     @patch('furious.batcher.time')
-    @patch('furious.batcher.memcache')
+    @patch('google.appengine.api.memcache')
     def test_to_task_with_frequency_passed_in(self, memcache, time):
         """Ensure that if a frequency is passed into the MessageProcessor that
         it uses that frequency when creating the task.
@@ -278,7 +326,7 @@ class MessageProcessorTestCase(unittest.TestCase):
         self.assertEqual(task.name, 'processor-processor-current-batch-1')
 
     @patch('furious.batcher.time')
-    @patch('furious.batcher.memcache')
+    @patch('google.appengine.api.memcache')
     def test_to_task_with_name_passed_in(self, memcache, time):
         """Ensure that if a name is passed into the MessageProcessor that it
         uses that name when creating the task.
@@ -296,7 +344,7 @@ class MessageProcessorTestCase(unittest.TestCase):
         self.assertEqual(task.name, 'test-name-processor-current-batch-3')
 
     @patch('furious.batcher.time')
-    @patch('furious.batcher.memcache')
+    @patch('google.appengine.api.memcache')
     def test_to_task_with_tag_passed_in(self, memcache, time):
         """Ensure that if a tag is passed into the MessageProcessor that it
         uses that tag when creating the task.
@@ -316,7 +364,7 @@ class MessageProcessorTestCase(unittest.TestCase):
         memcache.get.assert_called_once_with('agg-batch-test-tag')
 
     @patch('furious.batcher.time')
-    @patch('furious.batcher.memcache')
+    @patch('google.appengine.api.memcache')
     def test_to_task_with_tag_not_passed_in(self, memcache, time):
         """Ensure that if a tag is not passed into the MessageProcessor that it
         uses a default value when creating the task.
@@ -337,7 +385,7 @@ class MessageProcessorTestCase(unittest.TestCase):
     @patch('google.appengine.api.taskqueue.TaskRetryOptions', autospec=True)
     @patch('google.appengine.api.taskqueue.Task', autospec=True)
     @patch('furious.batcher.time')
-    @patch('furious.batcher.memcache')
+    @patch('google.appengine.api.memcache')
     def test_to_task_has_correct_arguments(self, memcache, time, task,
                                            task_retry):
         """Ensure that if no name is passed into the MessageProcessor that it
@@ -370,7 +418,7 @@ class MessageProcessorTestCase(unittest.TestCase):
         task.assert_called_once_with(**task_args)
         task_retry.assert_called_once_with(task_retry_limit=MAX_RESTARTS)
 
-    @patch('furious.batcher.memcache')
+    @patch('google.appengine.api.memcache')
     def test_curent_batch_key_exists_in_cache(self, cache):
         """Ensure that if the current batch key exists in cache that it uses it
         and doesn't update it.
@@ -388,7 +436,7 @@ class MessageProcessorTestCase(unittest.TestCase):
         self.assertEqual(current_batch, 1)
         self.assertFalse(cache.add.called)
 
-    @patch('furious.batcher.memcache')
+    @patch('google.appengine.api.memcache')
     def test_curent_batch_key_doesnt_exist_in_cache(self, cache):
         """Ensure that if the current batch key doesn't exist in cache that it
         inserts the default value of 1 into cache and returns it.
@@ -407,9 +455,197 @@ class MessageProcessorTestCase(unittest.TestCase):
         cache.add.assert_called_once_with('agg-batch-processor', 1)
 
 
+class AdaptiveMessageProcessorTestCase(unittest.TestCase):
+
+    def setUp(self):
+        super(AdaptiveMessageProcessorTestCase, self).setUp()
+
+        import os
+        import uuid
+
+        from furious.batcher import reset_batch_ids
+        from furious.batcher import reset_queue_backlogs
+
+        reset_batch_ids()
+        reset_queue_backlogs()
+
+        os.environ['REQUEST_ID_HASH'] = uuid.uuid4().hex
+
+    def tearDown(self):
+        super(AdaptiveMessageProcessorTestCase, self).tearDown()
+
+        import os
+
+        del os.environ['REQUEST_ID_HASH']
+
+    def test_large_backlog_speeds_up(self):
+        """Ensure a backlog larger than the lease size shrinks the frequency
+        and grows the lease size, in power of two steps.
+        """
+        from furious.batcher import AdaptiveMessageProcessor
+
+        processor = AdaptiveMessageProcessor('something', freq=30,
+                                             lease_size=100,
+                                             lease_size_kwarg='size')
+
+        processor.adapt(450)
+
+        self.assertEqual(7, processor.frequency)
+        self.assertEqual(400, processor.lease_size)
+        self.assertEqual({'size': 400}, processor.job[2])
+
+    def test_lease_size_not_passed_by_default(self):
+        """Ensure the lease size is only passed to the target when a kwarg
+        is named for it.
+        """
+        from furious.batcher import AdaptiveMessageProcessor
+
+        processor = AdaptiveMessageProcessor('something', freq=30,
+                                             lease_size=100, kwargs={'a': 1})
+
+        processor.adapt(450)
+
+        self.assertEqual(400, processor.lease_size)
+        self.assertEqual({'a': 1}, processor.job[2])
+
+    def test_bounds_respected(self):
+        """Ensure the frequency and lease size stay within their bounds."""
+        from furious.batcher import AdaptiveMessageProcessor
+
+        processor = AdaptiveMessageProcessor('something', freq=30, min_freq=5,
+                                             lease_size=500,
+                                             max_lease_size=1000)
+
+        processor.adapt(1000000)
+
+        self.assertEqual(5, processor.frequency)
+        self.assertEqual(1000, processor.lease_size)
+
+    def test_empty_queue_backs_off(self):
+        """Ensure an empty backlog backs off to the max frequency."""
+        from furious.batcher import AdaptiveMessageProcessor
+
+        processor = AdaptiveMessageProcessor('something', freq=30,
+                                             max_freq=300, kwargs={'a': 1},
+                                             lease_size_kwarg='lease_size')
+
+        processor.adapt(0)
+
+        self.assertEqual(300, processor.frequency)
+        self.assertEqual({'a': 1, 'lease_size': 500}, processor.job[2])
+
+    def test_small_backlog_uses_defaults(self):
+        """Ensure a backlog within the lease size uses the defaults."""
+        from furious.batcher import AdaptiveMessageProcessor
+
+        processor = AdaptiveMessageProcessor('something', freq=30)
+
+        processor.adapt(20)
+
+        self.assertEqual(30, processor.frequency)
+        self.assertEqual(500, processor.lease_size)
+
+    @patch('google.appengine.api.taskqueue.Queue', autospec=True)
+    def test_unknown_backlog_uses_defaults(self, queue_mock):
+        """Ensure that without a backlog, or queue stats, the defaults are
+        used and the queue's stats aren't fetched.
+        """
+        from furious.batcher import AdaptiveMessageProcessor
+
+        processor = AdaptiveMessageProcessor('something', freq=30)
+
+        processor.adapt(processor.get_backlog())
+
+        self.assertEqual(30, processor.frequency)
+        self.assertEqual(500, processor.lease_size)
+        self.assertFalse(queue_mock.called)
+
+    @patch('google.appengine.api.taskqueue.Queue', autospec=True)
+    def test_backlog_from_queue_stats(self, queue_mock):
+        """Ensure the pull queue's task count is used when no backlog is
+        given and queue stats are enabled.
+        """
+        from furious.batcher import AdaptiveMessageProcessor
+
+        queue_mock.return_value.fetch_statistics.return_value.tasks = 12
+
+        processor = AdaptiveMessageProcessor('something', pull_queue='pull',
+                                             use_queue_stats=True)
+
+        self.assertEqual(12, processor.get_backlog())
+        queue_mock.assert_called_once_with('pull')
+
+    @patch('furious.batcher.time')
+    @patch('google.appengine.api.taskqueue.Queue', autospec=True)
+    def test_queue_stats_reused_within_ttl(self, queue_mock, time):
+        """Ensure the pull queue's task count is fetched once per ttl."""
+        from furious.batcher import get_queue_backlog
+
+        queue_mock.return_value.fetch_statistics.return_value.tasks = 12
+        time.time.return_value = 100
+
+        self.assertEqual(12, get_queue_backlog('pull', ttl=10))
+        self.assertEqual(12, get_queue_backlog('pull', ttl=10))
+        self.assertEqual(1, queue_mock.call_count)
+
+        time.time.return_value = 110
+
+        self.assertEqual(12, get_queue_backlog('pull', ttl=10))
+        self.assertEqual(2, queue_mock.call_count)
+
+    @patch('furious.batcher.time')
+    @patch('google.appengine.api.memcache')
+    def test_to_task_countdown_adapts(self, memcache, time):
+        """Ensure the task is named for the batch and the max frequency's
+        time window, and delayed by the adapted frequency.
+        """
+        from furious.batcher import AdaptiveMessageProcessor
+
+        memcache.get.return_value = 'current-batch'
+        time.time.return_value = 1000
+
+        processor = AdaptiveMessageProcessor('something', queue='test_queue',
+                                             freq=40, lease_size=100,
+                                             backlog=250,
+                                             lease_size_kwarg='lease_size')
+
+        task = processor.to_task()
+
+        self.assertEqual('processor-processor-current-batch-6', task.name)
+        self.assertEqual(
+            {'lease_size': 200},
+            json.loads(task.payload)['job'][2])
+        self.assertEqual(20, processor.get_task_args()['countdown'])
+
+    @patch('furious.batcher.time')
+    @patch('google.appengine.api.memcache')
+    def test_to_task_name_shared_across_backlogs(self, memcache, time):
+        """Ensure processors for the same batch and time window share a task
+        name, and are deduped, whatever their backlogs.
+        """
+        from furious.batcher import AdaptiveMessageProcessor
+
+        memcache.get.return_value = 'b'
+        time.time.return_value = 1000
+
+        names = [AdaptiveMessageProcessor('something', queue='test_queue',
+                                          freq=30.0, lease_size=500,
+                                          backlog=backlog).to_task().name
+                 for backlog in (0, 20, 999, 1000, 5000)]
+
+        self.assertEqual(['processor-processor-b-8'] * 5, names)
+
+
 class BumpBatchTestCase(unittest.TestCase):
 
-    @patch('furious.batcher.memcache')
+    def setUp(self):
+        super(BumpBatchTestCase, self).setUp()
+
+        from furious.batcher import reset_batch_ids
+
+        reset_batch_ids()
+
+    @patch('google.appengine.api.memcache')
     def test_cache_incremented_by_key(self, cache):
         """Ensure that the cache object is incremented by the key passed in."""
         from furious.batcher import bump_batch
@@ -423,6 +659,138 @@ class BumpBatchTestCase(unittest.TestCase):
         cache.incr.assert_called_once_with('agg-batch-group')
 
 
+class BatchIdProviderTestCase(unittest.TestCase):
+
+    def test_batch_id_added_if_missing(self):
+        """Ensure a missing batch id is added as 1."""
+        from furious.batcher import BatchIdProvider
+        from furious.batcher import LocalBatchClient
+
+        client = LocalBatchClient()
+        provider = BatchIdProvider(client)
+
+        self.assertEqual(1, provider.get('key'))
+        self.assertEqual({'key': 1}, client.values)
+
+    @patch('furious.batcher.time')
+    def test_batch_id_cached_for_ttl(self, time):
+        """Ensure the batch id is only read again once the ttl has passed."""
+        from furious.batcher import BatchIdProvider
+        from furious.batcher import LocalBatchClient
+
+        client = LocalBatchClient()
+        client.values['key'] = 3
+        provider = BatchIdProvider(client, ttl=5)
+
+        time.time.return_value = 100
+        self.assertEqual(3, provider.get('key'))
+
+        client.values['key'] = 4
+
+        time.time.return_value = 104
+        self.assertEqual(3, provider.get('key'))
+
+        time.time.return_value = 105
+        self.assertEqual(4, provider.get('key'))
+
+    @patch('furious.batcher.time')
+    def test_bump_updates_cached_batch_id(self, time):
+        """Ensure a bumped batch id is used without reading it again."""
+        from furious.batcher import BatchIdProvider
+        from furious.batcher import LocalBatchClient
+
+        time.time.return_value = 100
+
+        client = LocalBatchClient()
+        client.values['key'] = 3
+        provider = BatchIdProvider(client, ttl=5)
+
+        self.assertEqual(3, provider.get('key'))
+        self.assertEqual(4, provider.bump('key'))
+
+        client.values['key'] = 10
+
+        self.assertEqual(4, provider.get('key'))
+
+    @patch('furious.batcher.time')
+    def test_evicted_batch_id_restored(self, time):
+        """Ensure an evicted batch id is restored from the last known batch id
+        instead of starting over at 1.
+        """
+        from furious.batcher import BatchIdProvider
+        from furious.batcher import LocalBatchClient
+
+        client = LocalBatchClient()
+        client.values['key'] = 3
+        provider = BatchIdProvider(client, ttl=5)
+
+        time.time.return_value = 100
+        provider.get('key')
+
+        client.values.clear()
+
+        time.time.return_value = 200
+        self.assertEqual(3, provider.get('key'))
+        self.assertEqual({'key': 3}, client.values)
+
+    def test_evicted_batch_id_bumped_from_last_known(self):
+        """Ensure bumping an evicted batch id continues from the last known
+        batch id.
+        """
+        from furious.batcher import BatchIdProvider
+        from furious.batcher import LocalBatchClient
+
+        client = LocalBatchClient()
+        client.values['key'] = 3
+        provider = BatchIdProvider(client)
+
+        provider.get('key')
+        client.values.clear()
+
+        self.assertEqual(4, provider.bump('key'))
+
+    @patch('furious.batcher.time')
+    def test_unavailable_uses_last_known(self, time):
+        """Ensure the last known batch id is used while memcache is
+        unavailable.
+        """
+        from furious.batcher import BatchIdProvider
+
+        client = Mock()
+        client.get.return_value = 3
+        provider = BatchIdProvider(client, ttl=5)
+
+        time.time.return_value = 100
+        provider.get('key')
+
+        client.get.return_value = None
+        client.add.return_value = False
+
+        time.time.return_value = 200
+        self.assertEqual(3, provider.get('key'))
+
+    def test_unavailable_without_last_known(self):
+        """Ensure 1 is used if memcache is unavailable and no batch id was
+        seen.
+        """
+        from furious.batcher import BatchIdProvider
+
+        client = Mock()
+        client.get.return_value = None
+        client.add.return_value = False
+
+        self.assertEqual(1, BatchIdProvider(client).get('key'))
+
+    def test_bump_unavailable_returns_none(self):
+        """Ensure bump returns None if the batch id can't be incremented."""
+        from furious.batcher import BatchIdProvider
+
+        client = Mock()
+        client.incr.return_value = None
+
+        self.assertIsNone(BatchIdProvider(client).bump('key'))
+
+
 class MessageIteratorTestCase(unittest.TestCase):
 
     def test_raise_stopiteration_if_no_messages(self):
@@ -449,9 +817,9 @@ class MessageIteratorTestCase(unittest.TestCase):
         with patch.object(iterator, 'queue') as queue:
             queue.lease_tasks_by_tag.return_value = [task, task1, task2]
 
-            results = [payload for payload in iterator]
+            results = [message for message in iterator]
 
-        self.assertEqual(results, [payload, payload, payload])
+        self.assertEqual(results, [json.loads(payload)] * 3)
 
     def test_calls_lease_exactly_once(self):
         """Ensure MessageIterator calls lease only once."""
@@ -486,10 +854,10 @@ class MessageIteratorTestCase(unittest.TestCase):
         with patch.object(iterator, 'queue') as queue:
             queue.lease_tasks_by_tag.return_value = [task]
 
-            results = [payload for payload in iterator]
-            self.assertEqual(results, [payload])
+            results = [message for message in iterator]
+            self.assertEqual(results, [json.loads(payload)])
 
-            results = [payload for payload in iterator]
+            results = [message for message in iterator]
 
         queue.lease_tasks_by_tag.assert_called_once_with(
             60, 1, tag='tag', deadline=10)
@@ -506,8 +874,8 @@ class MessageIteratorTestCase(unittest.TestCase):
         with patch.object(iterator, 'queue') as queue:
             queue.lease_tasks_by_tag.return_value = [task]
 
-            results = [payload for payload in iterator]
-            self.assertEqual(results, [payload])
+            results = [message for message in iterator]
+            self.assertEqual(results, [json.loads(payload)])
 
             # This new work should never be leased, but simulates new pending
             # work.
@@ -516,8 +884,8 @@ class MessageIteratorTestCase(unittest.TestCase):
 
             # Iterating again should return the "originally leased" work, not
             # new work.
-            results = [payload for payload in iterator]
-            self.assertEqual(results, [payload])
+            results = [message for message in iterator]
+            self.assertEqual(results, [json.loads(payload)])
 
             # Lease should only have been called a single time.
             queue.lease_tasks_by_tag.assert_called_once_with(
@@ -527,6 +895,106 @@ class MessageIteratorTestCase(unittest.TestCase):
             iterator.delete_messages()
             queue.delete_tasks.assert_called_once_with([task])
 
+    def test_rerun_replays_in_lease_order(self):
+        """Ensure iterating again replays every message in the order it was
+        leased, and only deletes the messages that were iterated over.
+        """
+        from furious.batcher import MessageIterator
+
+        tasks = [Mock(payload='[%d]' % index, tag='tag') for index in range(5)]
+
+        iterator = MessageIterator('tag', 'qn', 5, auto_delete=False)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.return_value = tasks
+
+            iterator = iter(iterator)
+            iterator.next()
+            iterator.next()
+
+            results = [message for message in iterator]
+            self.assertEqual([[0], [1], [2], [3], [4]], results)
+
+            iterator = iter(iterator)
+            iterator.next()
+            iterator.delete_messages()
+
+        queue.delete_tasks.assert_called_once_with(tasks[:1])
+
+    def test_delete_all_messages(self):
+        """Ensure deleting all messages includes those not iterated over."""
+        from furious.batcher import MessageIterator
+
+        tasks = [Mock(payload='[%d]' % index, tag='tag') for index in range(3)]
+
+        iterator = MessageIterator('tag', 'qn', 3, auto_delete=False)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.return_value = tasks
+
+            iter(iterator).next()
+            iterator.delete_messages(only_processed=False)
+            iterator.delete_messages()
+
+        queue.delete_tasks.assert_called_once_with(tasks)
+
+    def test_incremental_deletes(self):
+        """Ensure processed messages are deleted every delete_batch_size
+        messages, and the rest once iteration is complete.
+        """
+        from furious.batcher import MessageIterator
+
+        tasks = [Mock(payload='[%d]' % index, tag='tag') for index in range(5)]
+
+        iterator = MessageIterator('tag', 'qn', 5, delete_batch_size=2)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.return_value = tasks
+
+            iterator = iter(iterator)
+            iterator.next()
+            iterator.next()
+
+            # The second message is still being processed.
+            self.assertFalse(queue.delete_tasks.called)
+
+            iterator.next()
+
+            queue.delete_tasks.assert_called_once_with(tasks[:2])
+
+            for _ in range(2):
+                iterator.next()
+
+            self.assertRaises(StopIteration, iterator.next)
+
+        self.assertEqual(
+            [((tasks[:2],), {}), ((tasks[2:4],), {}), ((tasks[4:],), {})],
+            queue.delete_tasks.call_args_list)
+
+    def test_async_deletes_finished(self):
+        """Ensure async deletes are waited on when iteration is complete."""
+        from furious.batcher import MessageIterator
+
+        tasks = [Mock(payload='[%d]' % index, tag='tag') for index in range(3)]
+
+        iterator = MessageIterator('tag', 'qn', 3, delete_batch_size=2,
+                                   async_delete=True)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.return_value = tasks
+            rpcs = [Mock(), Mock()]
+            queue.delete_tasks_async.side_effect = rpcs
+
+            results = [message for message in iterator]
+
+        self.assertEqual([[0], [1], [2]], results)
+        self.assertFalse(queue.delete_tasks.called)
+        self.assertEqual(
+            [((tasks[:2],), {}), ((tasks[2:],), {})],
+            queue.delete_tasks_async.call_args_list)
+        rpcs[0].get_result.assert_called_once_with()
+        rpcs[1].get_result.assert_called_once_with()
+
     def test_custom_deadline(self):
         """Ensure that a custom deadline gets passed to lease_tasks."""
         from furious.batcher import MessageIterator
@@ -547,6 +1015,97 @@ class MessageIteratorTestCase(unittest.TestCase):
         queue.lease_tasks_by_tag.assert_called_once_with(
             60, 1, tag='tag', deadline=2)
 
+    def test_leases_multiple_batches(self):
+        """Ensure the next batch is leased once the current batch has been
+        iterated over, up to the requested number of batches.
+        """
+        from furious.batcher import MessageIterator
+
+        tasks = [Mock(payload='[%d]' % index, tag='tag') for index in range(5)]
+
+        iterator = MessageIterator('tag', 'qn', 2, batches=3)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.side_effect = [
+                tasks[:2], tasks[2:4], tasks[4:]]
+
+            results = [message for message in iterator]
+
+        self.assertEqual([[0], [1], [2], [3], [4]], results)
+        self.assertEqual(3, queue.lease_tasks_by_tag.call_count)
+        queue.delete_tasks.assert_called_once_with(tasks)
+
+    def test_stops_leasing_after_partial_batch(self):
+        """Ensure no more batches are leased once a batch is not full."""
+        from furious.batcher import MessageIterator
+
+        task = Mock(payload='["test"]', tag='tag')
+
+        iterator = MessageIterator('tag', 'qn', 2, batches=5)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.return_value = [task]
+
+            results = [message for message in iterator]
+
+        self.assertEqual([["test"]], results)
+        queue.lease_tasks_by_tag.assert_called_once_with(
+            60, 2, tag='tag', deadline=10)
+
+    def test_prefetch_keeps_leases_in_flight(self):
+        """Ensure prefetching keeps the requested number of async leases in
+        flight while a batch is iterated over.
+        """
+        from furious.batcher import MessageIterator
+
+        tasks = [Mock(payload='[%d]' % index, tag='tag') for index in range(5)]
+        rpcs = [Mock(), Mock(), Mock()]
+        rpcs[0].get_result.return_value = tasks[:2]
+        rpcs[1].get_result.return_value = tasks[2:4]
+        rpcs[2].get_result.return_value = tasks[4:]
+
+        iterator = MessageIterator('tag', 'qn', 2, batches=3, prefetch=2)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag_async.side_effect = rpcs
+
+            iter(iterator)
+
+            # The first batch is consumed, the next two are in flight.
+            self.assertEqual(3, queue.lease_tasks_by_tag_async.call_count)
+            self.assertFalse(rpcs[1].get_result.called)
+
+            results = [message for message in iterator]
+
+        self.assertEqual([[0], [1], [2], [3], [4]], results)
+        self.assertFalse(queue.lease_tasks_by_tag.called)
+        queue.lease_tasks_by_tag_async.assert_called_with(
+            60, 2, tag='tag', deadline=10)
+
+    def test_prefetch_rerun_returns_leased_messages(self):
+        """Ensure iterating again with leases in flight returns every message
+        leased so far, and leases no more.
+        """
+        from furious.batcher import MessageIterator
+
+        tasks = [Mock(payload='[%d]' % index, tag='tag') for index in range(4)]
+        rpcs = [Mock(), Mock()]
+        rpcs[0].get_result.return_value = tasks[:2]
+        rpcs[1].get_result.return_value = tasks[2:]
+
+        iterator = MessageIterator('tag', 'qn', 2, batches=10, prefetch=1,
+                                   auto_delete=False)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag_async.side_effect = rpcs + [Mock()]
+
+            iter(iterator).next()
+
+            results = [message for message in iterator]
+
+        self.assertEqual([[0], [1], [2], [3]], results)
+        self.assertEqual(2, queue.lease_tasks_by_tag_async.call_count)
+
     @patch('time.time')
     def test_time_check(self, time):
         """Ensure that a DeadlineExceededError is thrown when the lease takes
@@ -564,3 +1123,459 @@ class MessageIteratorTestCase(unittest.TestCase):
             self.assertRaises(
                 apiproxy_errors.DeadlineExceededError, iter, message_iterator)
 
+    def test_prefetch_deadline_on_first_batch(self):
+        """Ensure a prefetched first lease that hits its deadline raises a
+        DeadlineExceededError, as the synchronous lease does.
+        """
+        from google.appengine.runtime import apiproxy_errors
+        from furious.batcher import MessageIterator
+
+        rpc = Mock()
+        rpc.get_result.side_effect = apiproxy_errors.DeadlineExceededError
+
+        message_iterator = MessageIterator('tag', 'qn', 1, prefetch=1)
+
+        with patch.object(message_iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag_async.return_value = rpc
+
+            self.assertRaises(
+                apiproxy_errors.DeadlineExceededError, iter, message_iterator)
+
+    def test_prefetch_deadline_ends_iteration(self):
+        """Ensure a prefetched lease that hits its deadline after the first
+        batch ends the iteration, deleting the messages already processed.
+        """
+        from google.appengine.runtime import apiproxy_errors
+        from furious.batcher import MessageIterator
+
+        tasks = [Mock(payload='[0]', tag='tag')]
+        rpcs = [Mock(), Mock()]
+        rpcs[0].get_result.return_value = tasks
+        rpcs[1].get_result.side_effect = apiproxy_errors.DeadlineExceededError
+
+        iterator = MessageIterator('tag', 'qn', 1, batches=3, prefetch=1)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag_async.side_effect = rpcs
+
+            results = [message for message in iterator]
+
+        self.assertEqual([[0]], results)
+        self.assertEqual(2, queue.lease_tasks_by_tag_async.call_count)
+        queue.delete_tasks.assert_called_once_with(tasks)
+
+    @patch('time.time')
+    def test_time_check_after_first_batch_ends_iteration(self, time):
+        """Ensure a synchronous lease that hits its deadline after the first
+        batch ends the iteration.
+        """
+        from furious.batcher import MessageIterator
+
+        tasks = [Mock(payload='[0]', tag='tag')]
+        time.side_effect = [0.0, 0.1, 1.0] + [9.9] * 10
+
+        iterator = MessageIterator('tag', 'qn', 1, batches=3)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.side_effect = [tasks, []]
+
+            results = [message for message in iterator]
+
+        self.assertEqual([[0]], results)
+        queue.delete_tasks.assert_called_once_with(tasks)
+
+
+class MultiTagMessageIteratorTestCase(unittest.TestCase):
+
+    def test_leases_each_tag_in_turn(self):
+        """Ensure each tag is leased in turn, yielding (tag, payload) pairs,
+        until every tag's batch comes back short.
+        """
+        from mock import call
+
+        from furious.batcher import MultiTagMessageIterator
+
+        red = [Mock(payload='[%d]' % index, tag='red') for index in range(3)]
+        blue = [Mock(payload='[%d]' % index, tag='blue') for index in range(1)]
+
+        iterator = MultiTagMessageIterator(['red', 'blue'], 'qn', 2,
+                                           batches=5)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.side_effect = [red[:2], blue, red[2:]]
+
+            results = [item for item in iterator]
+
+        self.assertEqual([('red', [0]), ('red', [1]), ('blue', [0]),
+                          ('red', [2])], results)
+        self.assertEqual([call(60, 2, tag='red', deadline=10),
+                          call(60, 2, tag='blue', deadline=10),
+                          call(60, 2, tag='red', deadline=10)],
+                         queue.lease_tasks_by_tag.call_args_list)
+        queue.delete_tasks.assert_called_once_with(red[:2] + blue + red[2:])
+
+    def test_batches_default_to_one_per_tag(self):
+        """Ensure each tag is leased once by default."""
+        from furious.batcher import MultiTagMessageIterator
+
+        iterator = MultiTagMessageIterator(['red', 'blue', 'green'], 'qn', 2)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.side_effect = lambda *args, **kwargs: [
+                Mock(payload='[]', tag=kwargs['tag'])] * 2
+
+            results = [tag for tag, _ in iterator]
+
+        self.assertEqual(['red', 'red', 'blue', 'blue', 'green', 'green'],
+                         results)
+
+    def test_groups_by_tag_without_tags(self):
+        """Ensure leases are grouped by tag without tags, until a lease comes
+        back empty.
+        """
+        from furious.batcher import MultiTagMessageIterator
+
+        red = [Mock(payload='[%d]' % index, tag='red') for index in range(2)]
+        blue = [Mock(payload='[%d]' % index, tag='blue') for index in range(1)]
+
+        iterator = MultiTagMessageIterator(None, 'qn', 2)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.side_effect = [red, blue, []]
+
+            results = [item for item in iterator]
+
+        self.assertEqual([('red', [0]), ('red', [1]), ('blue', [0])], results)
+        self.assertEqual(3, queue.lease_tasks_by_tag.call_count)
+        queue.lease_tasks_by_tag.assert_called_with(
+            60, 2, tag=None, deadline=10)
+
+    def test_sub_batches(self):
+        """Ensure sub batches group consecutive messages with the same tag."""
+        from furious.batcher import MultiTagMessageIterator
+
+        red = [Mock(payload='[%d]' % index, tag='red') for index in range(2)]
+        blue = [Mock(payload='[%d]' % index, tag='blue') for index in range(1)]
+
+        iterator = MultiTagMessageIterator(['red', 'blue'], 'qn', 2,
+                                           sub_batches=True, prefetch=2)
+
+        with patch.object(iterator, 'queue') as queue:
+            rpcs = [Mock(), Mock()]
+            rpcs[0].get_result.return_value = red
+            rpcs[1].get_result.return_value = blue
+            queue.lease_tasks_by_tag_async.side_effect = rpcs
+
+            results = [item for item in iterator]
+
+        self.assertEqual([('red', [[0], [1]]), ('blue', [[0]])], results)
+        queue.delete_tasks.assert_called_once_with(red + blue)
+
+
+class LeasedMessageTestCase(unittest.TestCase):
+
+    def test_decodes_on_first_access_only(self):
+        """Ensure the payload is decoded once, on first access."""
+        from furious.batcher import LeasedMessage
+
+        decoder = Mock(return_value={'a': 1})
+        task = Mock(payload='{"a": 1}')
+
+        message = LeasedMessage(task, decoder)
+
+        self.assertFalse(decoder.called)
+        self.assertEqual({'a': 1}, message.payload)
+        self.assertEqual({'a': 1}, message.payload)
+        decoder.assert_called_once_with('{"a": 1}')
+
+    def test_task_attributes(self):
+        """Ensure the raw payload, name, tag and eta come from the task."""
+        from furious.batcher import LeasedMessage
+
+        task = Mock(payload='[1]', tag='tag', eta='eta')
+        task.name = 'name'
+
+        message = LeasedMessage(task)
+
+        self.assertEqual('[1]', message.raw)
+        self.assertEqual('name', message.name)
+        self.assertEqual('tag', message.tag)
+        self.assertEqual('eta', message.eta)
+        self.assertEqual([1], message.payload)
+
+    def test_iterator_yields_lazy_messages(self):
+        """Ensure a lazy MessageIterator yields undecoded LeasedMessages."""
+        from furious.batcher import LeasedMessage
+        from furious.batcher import MessageIterator
+
+        decoder = Mock(return_value='decoded')
+        tasks = [Mock(payload='[%d]' % index, tag='tag') for index in range(2)]
+
+        iterator = MessageIterator('tag', 'qn', 2, lazy=True, decoder=decoder)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.return_value = tasks
+
+            results = [message for message in iterator]
+
+        self.assertTrue(all(isinstance(message, LeasedMessage)
+                            for message in results))
+        self.assertEqual(tasks, [message.task for message in results])
+        self.assertFalse(decoder.called)
+
+        self.assertEqual('decoded', results[1].payload)
+        decoder.assert_called_once_with('[1]')
+
+    def test_iterator_uses_decoder(self):
+        """Ensure payloads are decoded with the given decoder."""
+        from furious.batcher import MessageIterator
+
+        iterator = MessageIterator('tag', 'qn', 2, decoder=len)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.return_value = [Mock(payload='abc')]
+
+            results = [message for message in iterator]
+
+        self.assertEqual([3], results)
+
+
+def _add_counts(counts, payload):
+    counts[payload['color']] = counts.get(payload['color'], 0) + 1
+    return counts
+
+
+def _merge_counts(aggregate, counts):
+    for color, count in counts.iteritems():
+        aggregate[color] = aggregate.get(color, 0) + count
+    return aggregate
+
+
+class ReduceMessagesTestCase(unittest.TestCase):
+
+    def test_reduces_merges_then_deletes(self):
+        """Ensure the messages are folded, merged into the aggregate, and
+        only then deleted.
+        """
+        from furious.batcher import MessageIterator
+        from furious.batcher import reduce_messages
+
+        tasks = [Mock(payload='{"color": "%s"}' % color, tag='tag')
+                 for color in ('red', 'blue', 'red')]
+
+        store = Mock()
+        store.merge.return_value = 'aggregate'
+
+        iterator = MessageIterator('tag', 'qn', 5)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.return_value = tasks
+
+            def merge(key, accumulator, merge, initial):
+                self.assertFalse(queue.delete_tasks.called)
+                return 'aggregate'
+
+            store.merge.side_effect = merge
+
+            aggregate = reduce_messages(iterator, _add_counts, dict,
+                                        _merge_counts, 'stats', store=store)
+
+        self.assertEqual('aggregate', aggregate)
+        store.merge.assert_called_once_with(
+            'stats', {'red': 2, 'blue': 1}, _merge_counts, dict)
+        queue.delete_tasks.assert_called_once_with(tasks)
+
+    def test_failed_merge_doesnt_delete(self):
+        """Ensure the messages are not deleted if the merge fails."""
+        from furious.batcher import MessageIterator
+        from furious.batcher import reduce_messages
+        from furious.errors import AggregateCollisionError
+
+        store = Mock()
+        store.merge.side_effect = AggregateCollisionError()
+
+        iterator = MessageIterator('tag', 'qn', 5)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.return_value = [
+                Mock(payload='{"color": "red"}', tag='tag')]
+
+            self.assertRaises(AggregateCollisionError, reduce_messages,
+                              iterator, _add_counts, dict, _merge_counts,
+                              'stats', store=store)
+
+        self.assertFalse(queue.delete_tasks.called)
+
+    def test_no_messages_not_merged(self):
+        """Ensure nothing is merged if there are no messages."""
+        from furious.batcher import MessageIterator
+        from furious.batcher import reduce_messages
+
+        store = Mock()
+
+        iterator = MessageIterator('tag', 'qn', 5)
+
+        with patch.object(iterator, 'queue') as queue:
+            queue.lease_tasks_by_tag.return_value = []
+
+            self.assertIsNone(reduce_messages(
+                iterator, _add_counts, dict, _merge_counts, 'stats',
+                store=store))
+
+        self.assertFalse(store.merge.called)
+
+
+@patch('furious.batcher.time')
+@patch('google.appengine.api.memcache')
+class MemcacheAggregateStoreTestCase(unittest.TestCase):
+
+    def test_missing_aggregate_added(self, memcache, time):
+        """Ensure a missing aggregate is merged into the initial value and
+        added.
+        """
+        from furious.batcher import MemcacheAggregateStore
+
+        client = memcache.Client.return_value
+        client.gets.return_value = None
+        client.add.return_value = True
+
+        aggregate = MemcacheAggregateStore().merge(
+            'stats', {'red': 1}, _merge_counts, dict)
+
+        self.assertEqual({'red': 1}, aggregate)
+        client.add.assert_called_once_with('stats', json.dumps({'red': 1}), 0)
+        self.assertFalse(client.cas.called)
+
+    def test_aggregate_merged_with_cas(self, memcache, time):
+        """Ensure an existing aggregate is merged and set with cas."""
+        from furious.batcher import MemcacheAggregateStore
+
+        client = memcache.Client.return_value
+        client.gets.return_value = json.dumps({'red': 2})
+        client.cas.return_value = True
+
+        aggregate = MemcacheAggregateStore().merge(
+            'stats', {'red': 1}, _merge_counts, dict)
+
+        self.assertEqual({'red': 3}, aggregate)
+        client.cas.assert_called_once_with('stats', json.dumps({'red': 3}), 0)
+        self.assertFalse(time.sleep.called)
+
+    def test_collision_retried_with_backoff(self, memcache, time):
+        """Ensure a cas collision is retried, after backing off, against the
+        newly stored aggregate.
+        """
+        from furious.batcher import MemcacheAggregateStore
+
+        client = memcache.Client.return_value
+        client.gets.side_effect = [json.dumps({'red': 2}),
+                                   json.dumps({'red': 5})]
+        client.cas.side_effect = [False, True]
+
+        aggregate = MemcacheAggregateStore().merge(
+            'stats', {'red': 1}, _merge_counts, dict)
+
+        self.assertEqual({'red': 6}, aggregate)
+        self.assertEqual(1, time.sleep.call_count)
+
+    def test_collisions_raise_after_retries(self, memcache, time):
+        """Ensure AggregateCollisionError is raised once the retries are
+        used up.
+        """
+        from furious.batcher import MemcacheAggregateStore
+        from furious.errors import AggregateCollisionError
+
+        client = memcache.Client.return_value
+        client.gets.return_value = json.dumps({'red': 2})
+        client.cas.return_value = False
+
+        store = MemcacheAggregateStore(retries=3)
+
+        self.assertRaises(AggregateCollisionError, store.merge, 'stats',
+                          {'red': 1}, _merge_counts, dict)
+        self.assertEqual(3, client.cas.call_count)
+        self.assertEqual(2, time.sleep.call_count)
+
+
+class MessageIteratorLeaseExtensionTestCase(unittest.TestCase):
+
+    def setUp(self):
+        import os
+
+        from google.appengine.ext import testbed
+
+        from furious.batcher import insert_messages
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        self.testbed.init_taskqueue_stub(
+            root_path=os.path.join(os.path.dirname(__file__), '..', '..'))
+
+        insert_messages([1, 2, 3], 'tag', queue='default-pull')
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    @patch('furious.batcher.time')
+    def test_extends_leases_near_expiry(self, time):
+        """Ensure the leases of the leased messages are extended once they
+        are close to expiring, and not before.
+        """
+        from furious.batcher import MessageIterator
+
+        time.time.return_value = 1000.0
+
+        iterator = iter(MessageIterator('tag', 'default-pull', 3,
+                                        auto_delete=False, extend_leases=True))
+
+        queue = iterator.queue
+        with patch.object(queue, 'modify_task_lease',
+                          wraps=queue.modify_task_lease) as modify_task_lease:
+            iterator.next()
+
+            self.assertFalse(modify_task_lease.called)
+
+            time.time.return_value = 1050.0
+            iterator.next()
+
+            self.assertEqual(3, modify_task_lease.call_count)
+            modify_task_lease.assert_called_with(iterator._messages[2], 60)
+
+            # The extended leases are not extended again until they are
+            # close to expiring.
+            iterator.next()
+
+            self.assertEqual(3, modify_task_lease.call_count)
+
+    @patch('furious.batcher.time')
+    def test_deleted_messages_not_extended(self, time):
+        """Ensure leases are only extended for messages not yet deleted."""
+        from furious.batcher import MessageIterator
+
+        time.time.return_value = 1000.0
+
+        iterator = iter(MessageIterator('tag', 'default-pull', 3,
+                                        delete_batch_size=1,
+                                        extend_leases=True))
+
+        queue = iterator.queue
+        with patch.object(queue, 'modify_task_lease',
+                          wraps=queue.modify_task_lease) as modify_task_lease:
+            iterator.next()
+
+            time.time.return_value = 1050.0
+            iterator.next()
+
+        self.assertEqual(2, modify_task_lease.call_count)
+
+    def test_leases_not_extended_by_default(self):
+        """Ensure leases are left alone unless extension is requested."""
+        from furious.batcher import MessageIterator
+
+        iterator = iter(MessageIterator('tag', 'default-pull', 3))
+
+        with patch.object(iterator.queue, 'modify_task_lease') as modify:
+            results = [message for message in iterator]
+
+        self.assertEqual([1, 2, 3], sorted(results))
+        self.assertFalse(modify.called)
@@ -54,6 +54,47 @@ class TestConfigurationLoading(unittest.TestCase):
         delay = get_completion_cleanup_delay()
         self.assertEqual(delay, expected)
 
+    def test_completion_shard_count_config(self):
+        """Ensure completion counters are disabled by default."""
+        from furious.config import get_completion_shard_count
+
+        self.assertEqual(0, get_completion_shard_count())
+
+    def test_completion_check_window_config(self):
+        """Ensure completion checks are not coalesced by default."""
+        from furious.config import get_completion_check_window
+
+        self.assertEqual(0, get_completion_check_window())
+
+    def test_payload_encoding_config(self):
+        """Ensure task payloads are JSON encoded by default."""
+        from furious.config import get_payload_encoding
+
+        self.assertEqual('json', get_payload_encoding())
+
+    def test_metrics_recorder_config(self):
+        """Ensure metrics are discarded by default."""
+        from furious.config import get_metrics_recorder
+        from furious.metrics import NullRecorder
+
+        self.assertIs(NullRecorder, get_metrics_recorder())
+
+    def test_result_blob_store_config(self):
+        """Ensure results are stored inline by default."""
+        from furious.config import get_result_blob_store
+
+        self.assertIsNone(get_result_blob_store())
+
+    @patch('furious.config.get_config')
+    def test_result_blob_store_known_name(self, get_config):
+        """Ensure a known blob store name selects its class."""
+        from furious.config import get_result_blob_store
+        from furious.extras.blob_store import LocalBlobStore
+
+        get_config.return_value = {'result_blob_store': 'local'}
+
+        self.assertIs(LocalBlobStore, get_result_blob_store())
+
     def test_load_yaml_config(self):
         """Ensure _load_yaml_config will load a specified path."""
         from furious.config import _load_yaml_config
@@ -90,7 +131,12 @@ class TestConfigurationLoading(unittest.TestCase):
                                      'task_system': 'flah',
                                      'cleanupqueue': 'default',
                                      'cleanupdelay': 7600,
-                                     'defaultqueue': 'default'})
+                                     'defaultqueue': 'default',
+                                     'completionshards': 0,
+                                     'completioncheckwindow': 0,
+                                     'payload_encoding': 'json',
+                                     'metrics': 'null',
+                                     'result_blob_store': None})
 
     def test_get_configured_persistence_exists(self):
         """Ensure a chosen persistence module is selected."""
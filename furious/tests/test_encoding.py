@@ -0,0 +1,173 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import json
+import unittest
+
+from mock import patch
+
+
+def success_callback():
+    pass
+
+
+OPTIONS = {
+    'job': ['foo.bar', [1, 2], {'a': 'b'}],
+    'id': 'asyncid',
+    '_type': 'furious.async.Async',
+    '_recursion': {'current': 1, 'max': 100},
+    'context_id': 'contextid',
+    'parent_id': 'parentid',
+    'callbacks': {
+        'success': 'foo.success',
+        'error': {'job': ['foo.error', None, None],
+                  '_recursion': {'current': 0, 'max': 100}}
+    },
+    'task_args': {'countdown': 10},
+    'custom': {'current': 'unchanged'}
+}
+
+
+class TestEncodePayload(unittest.TestCase):
+
+    def test_json_is_default(self):
+        """Ensure payloads are plain JSON by default."""
+        from furious.encoding import encode_payload
+
+        payload = encode_payload(OPTIONS)
+
+        self.assertEqual(OPTIONS, json.loads(payload))
+
+    @patch('furious.config.get_payload_encoding')
+    def test_configured_encoding_used(self, get_payload_encoding):
+        """Ensure the configured payload encoding is used."""
+        from furious.encoding import COMPACT_MAGIC
+        from furious.encoding import encode_payload
+
+        get_payload_encoding.return_value = 'compact'
+
+        self.assertTrue(encode_payload(OPTIONS).startswith(COMPACT_MAGIC))
+
+    def test_unknown_encoding_raises(self):
+        """Ensure an unknown encoding raises PayloadEncodingError."""
+        from furious.encoding import encode_payload
+        from furious.errors import PayloadEncodingError
+
+        self.assertRaises(PayloadEncodingError, encode_payload, OPTIONS,
+                          encoding='pickle')
+
+
+class TestCompactEncoding(unittest.TestCase):
+
+    def test_round_trip(self):
+        """Ensure compact payloads decode to the original options."""
+        from furious.encoding import decode_payload
+        from furious.encoding import encode_compact
+
+        self.assertEqual(OPTIONS, decode_payload(encode_compact(OPTIONS)))
+
+    def test_smaller_than_json(self):
+        """Ensure the compact payload is smaller than the JSON payload."""
+        from furious.encoding import encode_compact
+
+        self.assertLess(len(encode_compact(OPTIONS)), len(json.dumps(OPTIONS)))
+
+    def test_large_payload_compressed(self):
+        """Ensure large payloads are compressed, and still round trip."""
+        from furious.encoding import COMPACT_HEADER_SIZE
+        from furious.encoding import FLAG_ZLIB
+        from furious.encoding import decode_payload
+        from furious.encoding import encode_compact
+
+        options = dict(OPTIONS, job=['foo.bar', ['x' * 100] * 100, None])
+
+        payload = encode_compact(options)
+
+        self.assertTrue(ord(payload[COMPACT_HEADER_SIZE - 1]) & FLAG_ZLIB)
+        self.assertLess(len(payload), 1000)
+        self.assertEqual(options, decode_payload(payload))
+
+    def test_small_payload_not_compressed(self):
+        """Ensure small payloads are not compressed."""
+        from furious.encoding import COMPACT_HEADER_SIZE
+        from furious.encoding import encode_compact
+
+        payload = encode_compact({'job': ['foo.bar', None, None]})
+
+        self.assertEqual(0, ord(payload[COMPACT_HEADER_SIZE - 1]))
+
+    def test_unsupported_version_raises(self):
+        """Ensure a payload from an unknown schema version raises."""
+        from furious.encoding import COMPACT_MAGIC
+        from furious.encoding import decode_payload
+        from furious.errors import PayloadEncodingError
+
+        payload = COMPACT_MAGIC + chr(99) + chr(0) + '{}'
+
+        self.assertRaises(PayloadEncodingError, decode_payload, payload)
+
+
+@patch('furious.config.get_payload_encoding')
+class TestCompactAsyncTasks(unittest.TestCase):
+
+    def test_async_round_trip(self, get_payload_encoding):
+        """Ensure an Async encoded as a compact task payload is restored by
+        async_from_options.
+        """
+        from furious.async import Async
+        from furious.async import async_from_options
+        from furious.encoding import COMPACT_MAGIC
+        from furious.encoding import decode_payload
+
+        get_payload_encoding.return_value = 'compact'
+
+        async = Async('foo.bar', args=[1], kwargs={'a': 'b'},
+                      callbacks={'success': success_callback})
+
+        payload = async.to_task().payload
+
+        self.assertTrue(payload.startswith(COMPACT_MAGIC))
+
+        restored = async_from_options(decode_payload(payload))
+
+        self.assertEqual(async.id, restored.id)
+        self.assertEqual(async.job, restored.job)
+        self.assertEqual(async.recursion_depth, restored.recursion_depth)
+        self.assertIs(success_callback,
+                      restored.get_callbacks()['success'])
+
+    def test_mapped_tasks(self, get_payload_encoding):
+        """Ensure mapped jobs are compact encoded with their own ids and
+        args.
+        """
+        from furious.async import Async
+        from furious.context.context import _iter_mapped_tasks
+        from furious.encoding import decode_payload
+
+        get_payload_encoding.return_value = 'compact'
+
+        template = Async('foo.bar', kwargs={'a': 'b'})
+
+        tasks = list(_iter_mapped_tasks(template, [('id-0', [1]),
+                                                   ('id-1', [2])]))
+
+        options = [decode_payload(task.payload) for task in tasks]
+
+        self.assertEqual(['id-0', 'id-1'],
+                         [option['id'] for option in options])
+        self.assertEqual([['foo.bar', [1], {'a': 'b'}],
+                          ['foo.bar', [2], {'a': 'b'}]],
+                         [option['job'] for option in options])
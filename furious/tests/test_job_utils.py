@@ -242,3 +242,79 @@ class TestPathToReference(unittest.TestCase):
 
         self.assertIs(dumb, imported_module)
 
+    @patch('furious.job_utils._import_container')
+    def test_resolved_container_is_cached(self, import_container):
+        """Ensure a path's module is only imported once, while the function
+        is still looked up on every call.
+        """
+        from furious.job_utils import clear_reference_cache
+        from furious.job_utils import path_to_reference
+        from furious.tests import dummy_module
+
+        clear_reference_cache()
+        import_container.return_value = dummy_module
+
+        path_to_reference('furious.tests.dummy_module.dumb')
+
+        with patch('furious.tests.dummy_module.dumb') as dumb_mock:
+            function = path_to_reference('furious.tests.dummy_module.dumb')
+
+        self.assertIs(dumb_mock, function)
+        import_container.assert_called_once_with(
+            'furious.tests.dummy_module', 'dumb')
+
+    @patch('furious.job_utils._import_container')
+    def test_clear_reference_cache_for_path(self, import_container):
+        """Ensure clearing a path causes it to be imported again."""
+        from furious.job_utils import clear_reference_cache
+        from furious.job_utils import path_to_reference
+        from furious.tests import dummy_module
+
+        clear_reference_cache()
+        import_container.return_value = dummy_module
+
+        path_to_reference('furious.tests.dummy_module.dumb')
+        clear_reference_cache('furious.tests.dummy_module.dumb')
+        path_to_reference('furious.tests.dummy_module.dumb')
+
+        self.assertEqual(2, import_container.call_count)
+
+    @patch('furious.job_utils.REFERENCE_CACHE_SIZE', 1)
+    def test_cache_is_bounded(self):
+        """Ensure the oldest paths are evicted once the cache is full."""
+        from furious.job_utils import _container_cache
+        from furious.job_utils import clear_reference_cache
+        from furious.job_utils import path_to_reference
+
+        clear_reference_cache()
+
+        path_to_reference('furious.tests.dummy_module.dumb')
+        path_to_reference('email.parser.Parser')
+
+        self.assertEqual(['email.parser.Parser'], _container_cache.keys())
+
+
+class TestReferenceToPathCache(unittest.TestCase):
+    """Test that reference_to_path remembers validated paths."""
+
+    def test_valid_path_validated_once(self):
+        """Ensure a path string is only validated the first time."""
+        from furious.job_utils import clear_reference_cache
+        from furious.job_utils import reference_to_path
+
+        clear_reference_cache()
+        reference_to_path('furious.tests.dummy_module.dumb')
+
+        with patch('furious.job_utils._PATH_PATTERN') as pattern:
+            path = reference_to_path('furious.tests.dummy_module.dumb')
+
+        self.assertEqual('furious.tests.dummy_module.dumb', path)
+        self.assertFalse(pattern.match.called)
+
+    def test_invalid_path_not_remembered(self):
+        """Ensure invalid paths raise every time."""
+        from furious.errors import BadObjectPathError
+        from furious.job_utils import reference_to_path
+
+        for _ in xrange(2):
+            self.assertRaises(BadObjectPathError, reference_to_path, '1.bad')
@@ -0,0 +1,150 @@
+#
+# Copyright 2014 WebFilings, LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+# http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+#
+
+import unittest
+
+from mock import Mock
+from mock import patch
+
+
+class TestMemoryRecorder(unittest.TestCase):
+
+    def test_timings_aggregated(self):
+        """Ensure timings are aggregated per name and function path."""
+        from furious.metrics import MemoryRecorder
+
+        recorder = MemoryRecorder(flush_handler=None)
+
+        recorder.timing('execute', 'foo', 0.002)
+        recorder.timing('execute', 'foo', 0.004)
+        recorder.timing('execute', 'bar', 2)
+
+        metrics = recorder.snapshot()
+
+        self.assertEqual(2, metrics['foo']['execute']['count'])
+        self.assertAlmostEqual(0.003, metrics['foo']['execute']['mean'])
+        self.assertEqual(0.002, metrics['foo']['execute']['min'])
+        self.assertEqual(0.004, metrics['foo']['execute']['max'])
+        self.assertEqual({'0.005': 2}, metrics['foo']['execute']['buckets'])
+        self.assertEqual({'5': 1}, metrics['bar']['execute']['buckets'])
+
+    def test_counters_aggregated(self):
+        """Ensure counters are summed per name and function path."""
+        from furious.metrics import MemoryRecorder
+
+        recorder = MemoryRecorder(flush_handler=None)
+
+        recorder.increment('retries', 'foo', 2)
+        recorder.increment('retries', 'foo')
+
+        self.assertEqual({'foo': {'retries': 3}}, recorder.snapshot())
+
+    def test_flush_resets(self):
+        """Ensure flush returns the metrics and resets the aggregates."""
+        from furious.metrics import MemoryRecorder
+
+        recorder = MemoryRecorder(flush_handler=None)
+        recorder.increment('executions', 'foo')
+
+        self.assertEqual({'foo': {'executions': 1}}, recorder.flush())
+        self.assertEqual({}, recorder.snapshot())
+
+    def test_metrics_recorded_during_flush_kept(self):
+        """Ensure metrics recorded while a flush builds its output are kept
+        for the next flush.
+        """
+        from furious import metrics
+        from furious.metrics import MemoryRecorder
+
+        recorder = MemoryRecorder(flush_handler=None)
+        recorder.increment('executions', 'foo')
+
+        metrics_by_path = metrics._metrics_by_path
+
+        def record_during_flush(timings, counters):
+            recorder.increment('executions', 'bar')
+            return metrics_by_path(timings, counters)
+
+        with patch('furious.metrics._metrics_by_path',
+                   side_effect=record_during_flush):
+            self.assertEqual({'foo': {'executions': 1}}, recorder.flush())
+
+        self.assertEqual({'bar': {'executions': 1}}, recorder.snapshot())
+
+    def test_slowest(self):
+        """Ensure slowest orders function paths by mean timing."""
+        from furious.metrics import MemoryRecorder
+
+        recorder = MemoryRecorder(flush_handler=None)
+        recorder.timing('execute', 'fast', 0.1)
+        recorder.timing('execute', 'slow', 1.0)
+        recorder.timing('decode', 'slowest', 5.0)
+
+        slowest = recorder.slowest('execute', limit=1)
+
+        self.assertEqual(['slow'], [path for path, _ in slowest])
+
+    @patch('time.time')
+    def test_flushed_to_handler_each_interval(self, time):
+        """Ensure metrics are passed to the flush handler once the flush
+        interval has passed.
+        """
+        from furious.metrics import MemoryRecorder
+
+        handler = Mock()
+        time.return_value = 100.0
+
+        recorder = MemoryRecorder(flush_interval=60, flush_handler=handler)
+        recorder.increment('executions', 'foo')
+
+        self.assertFalse(handler.called)
+
+        time.return_value = 161.0
+        recorder.increment('executions', 'foo')
+
+        handler.assert_called_once_with({'foo': {'executions': 2}})
+        self.assertEqual({}, recorder.snapshot())
+
+
+class TestTimer(unittest.TestCase):
+
+    def tearDown(self):
+        from furious.metrics import reset_recorder
+
+        reset_recorder()
+
+    def test_records_time_on_error(self):
+        """Ensure the time is recorded when the block raises."""
+        from furious.metrics import reset_recorder
+        from furious.metrics import timer
+
+        recorder = Mock()
+        reset_recorder(recorder)
+
+        def fail():
+            with timer('execute', 'foo'):
+                raise ValueError()
+
+        self.assertRaises(ValueError, fail)
+        self.assertEqual('execute', recorder.timing.call_args[0][0])
+        self.assertEqual('foo', recorder.timing.call_args[0][1])
+
+    def test_null_recorder_by_default(self):
+        """Ensure the configured null recorder is used by default."""
+        from furious.metrics import NullRecorder
+        from furious.metrics import get_recorder
+
+        self.assertIsInstance(get_recorder(), NullRecorder)
@@ -269,6 +269,62 @@ class TestRunJob(unittest.TestCase):
         logging.getLogger().removeHandler(AbortLogHandler())
 
 
+class TestRunJobMetrics(unittest.TestCase):
+    """Test that run_job records timings for the executed function."""
+
+    def setUp(self):
+        import os
+        import uuid
+
+        from furious.metrics import MemoryRecorder
+        from furious.metrics import reset_recorder
+
+        os.environ['REQUEST_ID_HASH'] = uuid.uuid4().hex
+
+        self.recorder = MemoryRecorder(flush_handler=None)
+        reset_recorder(self.recorder)
+
+    def tearDown(self):
+        from furious.metrics import reset_recorder
+
+        reset_recorder()
+
+    @patch('__builtin__.dir')
+    def test_records_timings(self, dir_mock):
+        """Ensure the execute, callbacks and completion check timings are
+        recorded for the function path.
+        """
+        from furious.async import Async
+        from furious.context._execution import _ExecutionContext
+        from furious.processors import run_job
+
+        with _ExecutionContext(Async("dir")):
+            run_job()
+
+        metrics = self.recorder.snapshot()['dir']
+
+        self.assertEqual(1, metrics['execute']['count'])
+        self.assertEqual(1, metrics['callbacks']['count'])
+        self.assertEqual(1, metrics['completion_check']['count'])
+        self.assertNotIn('errors', metrics)
+
+    def test_records_errors(self):
+        """Ensure failing functions are counted as errors."""
+        from furious.async import Async
+        from furious.context._execution import _ExecutionContext
+        from furious.processors import run_job
+
+        def handle_errors():
+            pass
+
+        work = Async("dir", args=[1, 2, 3], callbacks={'error': handle_errors})
+
+        with _ExecutionContext(work):
+            run_job()
+
+        self.assertEqual(1, self.recorder.snapshot()['dir']['errors'])
+
+
 class TestHandleResults(unittest.TestCase):
     """Test that _handle_results does the Right Things."""
 
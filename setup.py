@@ -20,7 +20,7 @@ setup_args = dict(
     author='Robert Kluin',
     author_email='robert.kluin@webfilings.com',
     url='http://github.com/WebFilings/furious',
-    packages=find_packages(exclude=['example']),
+    packages=find_packages(exclude=['example', 'benchmarks']),
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Environment :: Web Environment',